@@ -9,64 +9,98 @@ Režimy:
 
   smart-backup  – „chytrá“ záloha: layout (GPT/MBR) + každá partition zvlášť (partclone)
   smart-restore – obnova layoutu + partitions, volitelně --resize poslední ext4 na celý disk
+  bkpart        – záloha layout + partition (dd) do --dir, zdroj --disk nebo obraz --file
+  rspart        – obnova zálohy bkpart z --dir na --disk nebo do nového řídkého obrazu --file
 
+  shrink        – zmenšení .img na minimum: poslední ext4, partition, GPT i soubor (--shrink-size)
+  sparsify      – uvolnění nulových bloků .img dírami (PUNCH_HOLE), --trim i fstrim přes loop
   compress      – gzip komprese existujícího .img (např. po editaci)
   decompress    – dekomprese .img.gz → .img
 
+  batch         – dávková záloha více disků souběžně podle job souboru (--jobs)
+  daemon        – headless daemon, přijímá úlohy přes Unix socket
+  jobs          – výpis / sledování / rušení úloh daemonu
+  catalog       – katalog záloh: rebuild (--dir) | list | latest (--disk)
+  copy          – kopie obrazu pro úpravy (--file → --to), reflink kde to FS umí
+  prune         – retence záloh v --dir (--keep-daily / --keep-weekly)
+  clone         – přímý klon disku na disk (--from sdX --to sdY), bez mezisouboru
+  flash         – jeden obraz na více karet najednou (--file img --to sdb,sdc,...)
+  diff          – porovnání dvou obrazů / zařízení (diff A B [--json])
+  parity        – paritní sidecar <obraz>.par (Reed-Solomon, --redundancy v %)
+  repair        – kontrola obrazu podle .par a oprava vadných bloků (--dry-run jen kontrola)
+
 Vlastnosti:
   - SHA256 vždy generovaný pro každý výstupní soubor (*.sha256)
   - při restore/ smart-restore se SHA kontroluje (lze vypnout --no-sha)
-  - gzip se použije jen, pokud je zadán --fast nebo --max
+  - gzip se použije jen, pokud je zadán --fast, --max nebo --adaptive
+  - --adaptive mění úroveň gzip po blocích podle rychlosti čtení zdroje
+  - --bwlimit / --iops / --schedule / --ionice / --cgroup omezí dopad zálohy na běžící služby
   - autoprefix (YYYY-MM-DD-HHMM_disk_...) je default, vypne se --noautoprefix
+  - backup/restore umí --file - (stdout/stdin), pojmenovanou rouru a --split-size svazky
 """
 
 from __future__ import annotations
 
 import argparse
-import datetime
 import json
 import re
 import subprocess
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
 from typing import List, Dict, Any
 import libs.toolhelp as th
 import libs.glb as glb
 import os
 import libs.toolhelp as th
+import libs.adaptgz as agz
+import libs.throttle as throttle
+import libs.rawbkp as rb
+import libs.pgunzip as pgz
+import libs.pipeline as pipeline
+import libs.pagecache as pagecache
+import libs.postrestore as postrestore
+import libs.streams as streams
+import libs.imgsrc as imgsrc
+from libs.rawbkp import generate_base_name
 from libs.JBLibs.input import anyKey,cls,confirm
 from libs.JBLibs.term import reset
 from libs.JBLibs.format import bytesTx
 
-# ============================================================
-# Simple backup / restore / extract (dd)
-# ============================================================
+@contextmanager
+def disk_lock(disk: str):
+    """Zámek disku pro CLI režimy – stejný jako v dávce a daemonu (th.device_lock).
 
-def generate_base_name(disk: str, base: str | None, autoprefix: bool) -> str:
+    Nečeká: disk drží jiný proces → chyba hned. Soubor obrazu se nezamyká.
     """
-    Vygeneruje základ jména souboru.
-    - pokud base je zadané, použije se
-    - jinak 'disk'
-    - autoprefix -> YYYY-MM-DD-HHMM_disk_base
-    """
-    if not base:
-        base = disk
-    if autoprefix:
-        prefix = datetime.datetime.now().strftime("%Y-%m-%d-%H%M")
-        return f"{prefix}_{base}"
-    return base
+    try:
+        with th.device_lock(disk, wait=False):
+            yield
+    except BlockingIOError:
+        raise RuntimeError(f"Disk {disk} právě používá jiný běžící imgtool (zámek {th.LOCK_DIR}).") from None
+
 
+# ============================================================
+# Simple backup / restore / extract (dd)
+# ============================================================
 
 def backup_disk_raw(disk: str, base: str | None, fast: bool, maxC: bool,
-                    autoprefix: bool) -> None:
+                    autoprefix: bool, adaptive: bool = False, parity: float | None = None,
+                    splitSize: int | None = None, dests: list[str] | None = None,
+                    destMode: str = "mirror") -> None:
     """
     Záloha celého /dev/<disk> přes dd.
-    Bez komprese, pokud není --fast / --max.
-    Vždy se vytvoří SHA256 sidecar.
+    Bez komprese, pokud není --fast / --max / --adaptive.
+    Vždy se vytvoří SHA256 sidecar, s --parity i paritní sidecar .par.
+    base "-" / roura = výstup do proudu, splitSize = svazky po splitSize bajtech.
+    dests = zapsat do více adresářů najednou (mirror / stripe, libs/multidest).
     """
-    cls()
+    if not streams.is_stream(base):
+        # u proudu je fd 1 přesměrovaný na stderr, mazat terminál nemá smysl
+        cls()
     
     dev = f"/dev/{disk}"
-    base_name = generate_base_name(disk, base, autoprefix)
+    # do stdout / roury se píše pod zadaným jménem, bez prefixu a přípony
+    base_name = base if streams.is_stream(base) else generate_base_name(disk, base, autoprefix)
    
     header = [
         "*** Disk Backup Tool (RAW dd) ***\n0c",
@@ -74,11 +108,12 @@ def backup_disk_raw(disk: str, base: str | None, fast: bool, maxC: bool,
         f"Záloha disku {dev} → {base_name}.img\n0c",
     ]
     
-    if not fast and not maxC:
+    if not fast and not maxC and not adaptive:
         opts=[
             ["Pokračovat bez komprese (RAW .img)","y"],
             ["Pokračovat s rychlou kompresí (gzip -1)","f"],
             ["Pokračovat s maximální kompresí (gzip -9)","m"],
+            ["Pokračovat s adaptivní kompresí (gzip -1 až -9 podle rychlosti disku)","a"],
             ["Zrušit","q"]
         ]
         volba=th.menu(header,opts,"Vyber možnost:")
@@ -89,10 +124,14 @@ def backup_disk_raw(disk: str, base: str | None, fast: bool, maxC: bool,
             fast=True
         elif volba=="m":
             maxC=True
+        elif volba=="a":
+            adaptive=True
     else:
-        if fast:
+        if adaptive:
+            header.append("Adaptivní komprese: gzip -1 až -9\n0c")
+        elif fast:
             header.append("Rychlá komprese: gzip -1\n0c")
-        if maxC:
+        elif maxC:
             header.append("Maximální komprese: gzip -9\n0c")
         
         opts=[
@@ -105,66 +144,58 @@ def backup_disk_raw(disk: str, base: str | None, fast: bool, maxC: bool,
             return
 
     # rozhodnutí o kompresi
-    if fast:
-        out = Path(base_name + ".img.gz")
-        print(f"Záloha disku {dev} → {out} (gzip -1)")
-        if not confirm("Spustit backup s rychlou kompresí?"):
-            print("Zrušeno.")
-            return
-        dd = ["dd", f"if={dev}", "bs=4M", "status=progress"]
-        gz = ["gzip", "-1"]
-        with out.open("wb") as f:
-            p1 = subprocess.Popen(dd, stdout=subprocess.PIPE)
-            p2 = subprocess.Popen(gz, stdin=p1.stdout, stdout=f)
-            p1.stdout.close()
-            p2.communicate()
-    elif maxC:
-        out = Path(base_name + ".img.gz")
-        print(f"Záloha disku {dev} → {out} (gzip -9)")
-        if not confirm("Spustit backup s maximální kompresí?"):
+    codec = rb.codec_from_flags(fast, maxC, adaptive)
+    if codec != "none":
+        out = Path(base_name + rb.CODECS[codec])
+        if codec == "adaptive":
+            print(f"Záloha disku {dev} → {out} (gzip adaptivní)")
+            q = "Spustit backup s adaptivní kompresí?"
+        elif codec == "fast":
+            print(f"Záloha disku {dev} → {out} (gzip -1)")
+            q = "Spustit backup s rychlou kompresí?"
+        else:
+            print(f"Záloha disku {dev} → {out} (gzip -9)")
+            q = "Spustit backup s maximální kompresí?"
+        if not confirm(q):
             print("Zrušeno.")
             return
-        dd = ["dd", f"if={dev}", "bs=4M", "status=progress"]
-        gz = ["gzip", "-9"]
-        with out.open("wb") as f:
-            p1 = subprocess.Popen(dd, stdout=subprocess.PIPE)
-            p2 = subprocess.Popen(gz, stdin=p1.stdout, stdout=f)
-            p1.stdout.close()
-            p2.communicate()
-    else:
-        out = Path(base_name + ".img")
-        th.run(["dd", f"if={dev}", f"of={str(out)}", "bs=4M", "status=progress"])
 
-    th.write_sha256_sidecar(out)
+    out = rb.backup_raw(dev, base_name, codec, parity=parity, splitSize=splitSize,
+                        dests=dests, destMode=destMode)
     print(f"Hotovo: {out}")
 
 
-def restore_disk_raw(filename: Path, disk: str, no_sha: bool) -> None:
+def restore_disk_raw(filename: Path, disk: str, no_sha: bool, delta: bool = False, dryRun: bool = False) -> None:
     """
     Obnova RAW nebo .gz obrazu na /dev/<disk>.
     Před zápisem ověří SHA256, pokud existuje sidecar a není --no-sha.
+    delta = zapíše jen bloky, které se na disku liší; dryRun = jen vypíše rozdíly.
     """
     dev = f"/dev/{disk}"
-    if not filename.exists():
+    if not streams.exists(filename):
         raise FileNotFoundError(filename)
 
     print(f"\nObnova {filename} → {dev}")
-    if not no_sha:
-        ok = th.verify_sha256_sidecar(filename)
+    if streams.is_stream(filename):
+        print("[SHA256] Obnova z proudu – kontrola přeskočena.")
+    elif not no_sha:
+        # sada svazků: každý svazek má vlastní sidecar
+        ok = th.verify_sha256_sidecar(filename) if filename.exists() else streams.verify_volumes(filename)
         if not ok:
             if not confirm("Hash nesedí nebo sidecar chybí. Pokračovat i tak?"):
                 print("Zrušeno.")
                 return
 
+    if delta and dryRun:
+        rb.restore_raw(filename, dev, delta=True, dryRun=True)
+        return
+
     if not confirm("!!! Tohle přepíše celý disk. Pokračovat?"):
         print("Zrušeno.")
         return
 
-    if th.is_gzip(filename):
-        cmd = ["bash", "-c", f"gunzip -c '{filename}' | dd of={dev} bs=4M status=progress"]
-        th.run(cmd)
-    else:
-        th.run(["dd", f"if={str(filename)}", f"of={dev}", "bs=4M", "status=progress"])
+    # .img kopií v jádře, .img.gz paralelním rozbalením; restore_raw si řeší cgroup i fsync
+    rb.restore_raw(filename, dev, delta=delta)
 
     print("Obnova dokončena.")
 
@@ -181,13 +212,27 @@ def extract_gz_to_img(filename: Path) -> None:
         return
 
     print(f"Extract {filename} → gunzip")
-    th.run(["gunzip", str(filename)])
-    out = Path(str(filename).removesuffix(".gz"))
+    out = _gunzip_file(filename)
+    print(f"Extract hotov: {out}")
+
+
+def _gunzip_file(path: Path) -> Path:
+    """
+    Náhrada `gunzip soubor.gz`: paralelní rozbalení (libs/pgunzip), SHA256 sidecar
+    z hashe spočítaného při zápisu, po úspěchu smaže .gz jako gunzip.
+    """
+    out = Path(str(path).removesuffix(".gz"))
     if out.exists():
-        th.write_sha256_sidecar(out)
-        print(f"Extract hotov: {out}")
-    else:
-        print("Extract se nepovedl – výstupní soubor neexistuje.")
+        raise FileExistsError(f"Výstupní soubor už existuje: {out}")
+    try:
+        stats = pgz.decompress_file(path, out)
+    except BaseException:
+        out.unlink(missing_ok=True)
+        raise
+    pgz.print_summary(stats)
+    th.write_sha256_sidecar(out, stats["sha256"])
+    path.unlink()
+    return out
 
 
 # ============================================================
@@ -276,7 +321,8 @@ def smart_restore(
       - načte manifest.json
       - obnoví layout
       - obnoví každou partition
-      - volitelně roztáhne poslední ext4 partition na celý disk (--resize)
+      - volitelně roztáhne poslední ext4 partition na celý disk (--resize);
+        e2fsck všech ext4 partition běží souběžně (libs/postrestore)
     """
     if not inDir.is_dir():
         raise NotADirectoryError(inDir)
@@ -297,25 +343,29 @@ def smart_restore(
         image = inDir / part_info["image"]
         restore_partition_image(image, devPath, no_sha=no_sha)
 
-    # Volitelné zvětšení poslední ext4 partition
+    # Volitelné zvětšení poslední ext4 partition (growpart → e2fsck → resize2fs),
+    # ostatní ext4 partition se mezitím souběžně zkontrolují
     if resize and manifest["partitions"]:
         last = manifest["partitions"][-1]
         fs = (last.get("fstype") or "").lower()
-        devName = last["name"]
-        if fs == "ext4":
-            print(f"[RESIZE] Pokus o zvětšení poslední partition {devName} (ext4).")
-            # vyparsujeme číslo partition z názvu (sdf2, nvme0n1p3 → 2, 3)
-            m = re.search(r"(\d+)$", devName)
-            if not m:
-                print("[RESIZE] Nepodařilo se zjistit číslo partition, resize přeskočen.")
-            else:
-                partnum = m.group(1)
-                devdisk = f"/dev/{disk}"
-                th.run(["growpart", devdisk, partnum])
-                th.run(["resize2fs", f"/dev/{devName}"])
-                print("[RESIZE] Hotovo.")
-        else:
+        m = re.search(r"(\d+)$", last["name"])
+        if fs != "ext4":
             print("[RESIZE] Poslední partition není ext4, resize přeskočen.")
+        elif not m:
+            print("[RESIZE] Nepodařilo se zjistit číslo partition, resize přeskočen.")
+        else:
+            print(f"[RESIZE] Pokus o zvětšení poslední partition {last['name']} (ext4).")
+            parts = []
+            for p in manifest["partitions"]:
+                pm = re.search(r"(\d+)$", p["name"])
+                if pm:
+                    parts.append({"num": int(pm.group(1)), "dev": p["devpath"], "fstype": p.get("fstype")})
+            lastNum = int(m.group(1))
+            steps = postrestore.plan(disk, parts, grow=[lastNum], fsck=True, resize=[lastNum])
+            wall = postrestore.run(steps)
+            if not postrestore.print_report(steps, wall):
+                raise RuntimeError("Zvětšení / kontrola partition po obnově selhala")
+            print("[RESIZE] Hotovo.")
 
     print("SMART RESTORE dokončen.")
 
@@ -324,10 +374,11 @@ def smart_restore(
 # Compress / Decompress
 # ============================================================
 
-def compress_image(path: Path, fast: bool, maxC: bool) -> None:
+def compress_image(path: Path, fast: bool, maxC: bool, adaptive: bool = False) -> None:
     """
     gzip komprese existujícího .img (nebo libovolného souboru).
     Default level = -6 pokud nezadáš ani fast, ani max.
+    adaptive = úroveň se mění po blocích podle toho, zda stíhá čtení nebo komprese.
     Vytvoří nový .gz a SHA256 pro .gz.
     """
     if not path.exists():
@@ -336,6 +387,15 @@ def compress_image(path: Path, fast: bool, maxC: bool) -> None:
         print("Soubor už je gzip – není co komprimovat.")
         return
 
+    if adaptive:
+        out = Path(str(path) + ".gz")
+        print(f"Komprese {path} → {out} (gzip adaptivní)")
+        stats = agz.compress_file(path, out)
+        agz.print_summary(stats)
+        th.write_sha256_sidecar(out, stats["sha256"])
+        print("Komprese hotová.")
+        return
+
     level = "-6"
     if fast:
         level = "-1"
@@ -345,15 +405,9 @@ def compress_image(path: Path, fast: bool, maxC: bool) -> None:
     out = Path(str(path) + ".gz")
     print(f"Komprese {path} → {out} (gzip {level})")
 
-    dd = ["dd", f"if={str(path)}", "bs=4M"]
-    gz = ["gzip", level]
-    with out.open("wb") as f:
-        p1 = subprocess.Popen(dd, stdout=subprocess.PIPE)
-        p2 = subprocess.Popen(gz, stdin=p1.stdout, stdout=f)
-        p1.stdout.close()
-        p2.communicate()
+    digest = rb.dd_gzip(path, out, level)
 
-    th.write_sha256_sidecar(out)
+    th.write_sha256_sidecar(out, digest)
     print("Komprese hotová.")
 
 
@@ -369,13 +423,8 @@ def decompress_image(path: Path) -> None:
         return
 
     print(f"Dekomprese {path} → gunzip")
-    th.run(["gunzip", str(path)])
-    out = Path(str(path).removesuffix(".gz"))
-    if out.exists():
-        th.write_sha256_sidecar(out)
-        print(f"Dekomprese hotová: {out}")
-    else:
-        print("Výstupní soubor po gunzip neexistuje.")
+    out = _gunzip_file(path)
+    print(f"Dekomprese hotová: {out}")
 
 
 # ============================================================
@@ -391,18 +440,35 @@ def build_parser() -> argparse.ArgumentParser:
             "backup", "restore", "extract",
             "smart-backup", "smart-restore",
             "compress", "decompress","swap",
-            "bkpart", "rspart",
+            "bkpart", "rspart", "shrink", "sparsify",
+            "batch", "daemon", "jobs", "catalog",
+            "copy", "prune", "clone", "flash", "diff",
+            "parity", "repair",
         ],
         default=None,
         help="Režim práce s disky/obrazy"
     )
+    p.add_argument(
+        "action",
+        nargs="?",
+        default=None,
+        help="catalog: rebuild | list | latest, diff: první obraz"
+    )
+    p.add_argument(
+        "other",
+        nargs="?",
+        default=None,
+        help="diff: druhý obraz"
+    )
 
     p.add_argument("--disk", help="název disku (bez /dev, např. sdb)")
-    p.add_argument("--file", help="soubor (.img / .img.gz) nebo základ jména")
+    p.add_argument("--file", help="soubor (.img / .img.gz) nebo základ jména, backup/restore: - = stdout/stdin")
     p.add_argument("--dir", help="adresář pro smart-backup/smart-restore",default=None)
 
     p.add_argument("--fast", action="store_true", help="rychlý gzip (-1)")
     p.add_argument("--max", action="store_true", help="maximální gzip (-9)")
+    p.add_argument("--adaptive", action="store_true",
+                   help="adaptivní gzip (-1 až -9 po blocích podle rychlosti čtení zdroje)")
 
     p.add_argument("--noautoprefix", action="store_true",
                    help="nevkládat auto prefix YYYY-MM-DD-HHMM_")
@@ -413,12 +479,85 @@ def build_parser() -> argparse.ArgumentParser:
     p.add_argument("--no-sha", action="store_true",
                    help="při restore nesrovnávat SHA256 (nedoporučeno)")
 
-    p.add_argument("--shrink-size", type=int, default=None,
-                   help="shrink: cílová velikost v GiB (min 1 GiB), pokud není zadáno, auto výpočet")
+    p.add_argument("--shrink-size", default=None,
+                   help="shrink: cílová velikost obrazu (4 = GiB, nebo 3500M, 4G), pokud není zadáno, auto výpočet")
     
     p.add_argument("--target-size", type=int, default=None,
                    help="swap: cílová velikost v MB nebo GB (př.zadání: 512M, 2G)")
 
+    p.add_argument("--jobs", default=None,
+                   help="batch: job soubor (JSON/JSONC) se seznamem disků, režimů a cílů")
+    p.add_argument("--max-jobs", type=int, default=None,
+                   help="batch: max. počet souběžných úloh")
+    p.add_argument("--per-bus", type=int, default=None,
+                   help="batch: max. počet souběžných úloh na jedné USB sběrnici")
+    p.add_argument("--max-cpu", type=int, default=None,
+                   help="batch: max. počet souběžně komprimujících úloh")
+    p.add_argument("--report", default=None,
+                   help="batch: cesta pro JSON report (default batch-report-<čas>.json)")
+
+    p.add_argument("--via-daemon", action="store_true",
+                   help="backup/restore: neprovádět lokálně, ale odeslat úlohu daemonu")
+    p.add_argument("--socket", default=glb.DAEMON_SOCK,
+                   help=f"Unix socket daemonu (default {glb.DAEMON_SOCK})")
+    p.add_argument("--workers", type=int, default=2,
+                   help="daemon: počet souběžně běžících úloh")
+    p.add_argument("--watch", type=int, default=None, help="jobs: sledovat průběh úlohy ID")
+    p.add_argument("--cancel", type=int, default=None, help="jobs: zrušit úlohu ID")
+    p.add_argument("--history", action="store_true", help="jobs: vypsat historii dokončených úloh")
+
+    p.add_argument("--from", dest="src", default=None, help="clone: zdrojový disk (bez /dev)")
+    p.add_argument("--to", default=None, help="copy: cílový soubor, clone: cílový disk, flash: cílové disky oddělené čárkou")
+    p.add_argument("--parts-only", action="store_true",
+                   help="clone: zkopírovat jen layout a partition, ne volné místo")
+    p.add_argument("--no-zero-skip", action="store_true",
+                   help="clone: zapisovat i nulové bloky, které na cíli už nuly jsou")
+    p.add_argument("--no-verify", action="store_true", help="clone/flash: bez ověření zpětným čtením")
+    p.add_argument("--keep-daily", type=int, default=7, help="prune: počet dnů s ponechanou zálohou")
+    p.add_argument("--keep-weekly", type=int, default=4, help="prune: počet týdnů s ponechanou zálohou")
+    p.add_argument("--keep-last", type=int, default=1, help="prune: vždy ponechat N nejnovějších")
+    p.add_argument("--dry-run", action="store_true", help="jen vypsat, co by se provedlo")
+    p.add_argument("--trim", action="store_true",
+                   help="sparsify: připojit obraz přes loop a pustit fstrim na každý FS (root)")
+    p.add_argument("--json", action="store_true", help="diff: výstup jako JSON")
+    p.add_argument("--redundancy", type=float, default=None,
+                   help="parity: redundance paritního souboru v %% (default 5)")
+    p.add_argument("--parity", type=float, default=None,
+                   help="backup: vytvořit i paritní sidecar .par s danou redundancí v %%, např. 5")
+    p.add_argument("--delta", action="store_true",
+                   help="restore: zapsat jen bloky, které se na disku liší (s --dry-run jen vypsat rozdíly)")
+
+    p.add_argument("--image-size", default=None,
+                   help="rspart --file: velikost vytvářeného obrazu, např. 8G (default velikost původního disku)")
+    p.add_argument("--scratch", default=None,
+                   help="bkpart: partition (čísla nebo labely oddělené čárkou), jejichž obsah se nezálohuje, např. 3,tmp")
+
+    p.add_argument("--split-size", default=None,
+                   help="backup: rozdělit výstup na svazky <obraz>.000, .001, … po dané velikosti, např. 4G")
+
+    p.add_argument("--dest", default=None,
+                   help="backup: cílové adresáře oddělené čárkou, zdroj se čte jen jednou")
+    p.add_argument("--dest-mode", choices=["mirror", "stripe"], default="mirror",
+                   help="backup --dest: mirror = celá kopie v každém, stripe = svazky --split-size střídavě")
+
+    p.add_argument("--mem-limit", default=None,
+                   help="strop paměti pro buffery čtení/zápisu, např. 32M (default 64M)")
+    p.add_argument("--keep-cache", action="store_true",
+                   help="nezahazovat přečtená/zapsaná data z page cache")
+    p.add_argument("--read-ahead", type=int, default=None,
+                   help="read_ahead_kb zdrojového disku po dobu úlohy, např. 4096")
+
+    p.add_argument("--bwlimit", default=None,
+                   help="omezení propustnosti čtení/zápisu, např. 20M (B/s)")
+    p.add_argument("--iops", type=int, default=None,
+                   help="omezení počtu I/O operací za sekundu")
+    p.add_argument("--schedule", default=None,
+                   help="časový rozvrh limitů, např. '08:00-18:00=20M:200,22:00-06:00=0'")
+    p.add_argument("--ionice", default=None,
+                   help="I/O priorita: idle, be[:0-7], rt[:0-7]")
+    p.add_argument("--cgroup", action="store_true",
+                   help="limity vynutit přes cgroup v2 io.max (platí i pro dd/gzip)")
+
     return p
 
 def __showMenu() -> None:
@@ -458,33 +597,89 @@ def __showMenu() -> None:
 def main() -> None:
     args = build_parser().parse_args()
     autoprefix = not args.noautoprefix
+    throttle.activate(throttle.from_args(args.bwlimit, args.iops, args.schedule, args.cgroup, args.ionice))
+    throttle.cgroup_enter()
+    if args.mem_limit:
+        pipeline.MEM_LIMIT = throttle.parse_rate(args.mem_limit)
+    pagecache.ENABLED = not args.keep_cache
+    pagecache.READ_AHEAD_KB = args.read_ahead
     
     mode=args.mode
     repeat = mode is None
     
-    while repeat:
+    while True:
         if not mode:
             cls()
             mode=__showMenu()
             if not mode:
                 return
 
-        if mode == "backup":
+        if args.via_daemon and streams.is_stream(args.file):
+            raise ValueError("--via-daemon nejde kombinovat se stdin/stdout ani s rourou")
+
+        if mode == "backup" and args.via_daemon:
+            if not args.disk:
+                raise ValueError("backup --via-daemon vyžaduje --disk")
+            from libs import daemon
+            base = args.file or args.disk
+            daemon.submit_and_watch({
+                "mode": "backup",
+                "disk": args.disk,
+                "dest": os.path.abspath(os.path.dirname(base) or os.getcwd()),
+                "name": os.path.basename(base),
+                "autoprefix": autoprefix,
+                "compress": rb.codec_from_flags(args.fast, args.max, args.adaptive),
+            }, args.socket)
+            mode=None
+
+        elif mode == "restore" and args.via_daemon:
+            if not args.file or not args.disk:
+                raise ValueError("restore --via-daemon vyžaduje --file a --disk")
+            if not args.no_sha:
+                ok = th.verify_sha256_sidecar(Path(args.file))
+                if not ok and not confirm("Hash nesedí nebo sidecar chybí. Pokračovat i tak?"):
+                    print("Zrušeno.")
+                    return
+            if not confirm(f"!!! Tohle přepíše celý disk /dev/{args.disk}. Pokračovat?"):
+                print("Zrušeno.")
+                return
+            from libs import daemon
+            daemon.submit_and_watch({
+                "mode": "restore",
+                "disk": args.disk,
+                "file": os.path.abspath(args.file),
+            }, args.socket)
+            mode=None
+
+        elif mode == "backup":
+            if streams.is_stdio(args.file):
+                # data jdou na stdout – výpisy (i výběr disku) od teď na stderr
+                streams.claim_stdout()
             disk = args.disk or th.choose_disk()
-            backup_disk_raw(
-                disk=disk,
-                base=args.file,
-                fast=args.fast,
-                maxC=args.max,
-                autoprefix=autoprefix,
-            )
+            with disk_lock(disk):
+                backup_disk_raw(
+                    disk=disk,
+                    base=args.file,
+                    fast=args.fast,
+                    maxC=args.max,
+                    autoprefix=autoprefix,
+                    adaptive=args.adaptive,
+                    parity=args.parity,
+                    splitSize=throttle.parse_rate(args.split_size) if args.split_size else None,
+                    dests=[d.strip() for d in args.dest.split(",") if d.strip()] if args.dest else None,
+                    destMode=args.dest_mode,
+                )
             mode=None
 
         elif mode == "restore":
             if not args.file:
                 raise ValueError("restore vyžaduje --file")
+            if streams.is_stdio(args.file):
+                # data jdou ze stdin – dotazy se čtou z terminálu
+                streams.claim_stdin()
             disk = args.disk or th.choose_disk()
-            restore_disk_raw(Path(args.file), disk, no_sha=args.no_sha)
+            with disk_lock(disk):
+                restore_disk_raw(Path(args.file), disk, no_sha=args.no_sha, delta=args.delta, dryRun=args.dry_run)
             mode=None
 
         elif mode == "extract":
@@ -513,31 +708,57 @@ def main() -> None:
                 print("Zrušeno.")
                 return
             
-            smart_backup(
-                disk=args.disk or th.choose_disk(),
-                outdir=Path(dir),
-                fast=args.fast,
-                maxC=args.max,
-                autoprefix=autoprefix,
-            )
+            disk = args.disk or th.choose_disk()
+            with disk_lock(disk):
+                smart_backup(
+                    disk=disk,
+                    outdir=Path(dir),
+                    fast=args.fast,
+                    maxC=args.max,
+                    autoprefix=autoprefix,
+                )
             mode=None
 
         elif mode == "smart-restore":
             if not args.dir:
                 raise ValueError("smart-restore vyžaduje --dir (adresář se zálohou)")
-            smart_restore(
-                disk=args.disk or th.choose_disk(),
-                inDir=Path(args.dir),
-                resize=args.resize,
-                no_sha=args.no_sha,
-            )
+            disk = args.disk or th.choose_disk()
+            with disk_lock(disk):
+                smart_restore(
+                    disk=disk,
+                    inDir=Path(args.dir),
+                    resize=args.resize,
+                    no_sha=args.no_sha,
+                )
+            mode=None
+
+        elif mode == "bkpart":
+            # zdroj: disk nebo soubor obrazu (tabulka oddílů a partition se čtou ze souboru, bez losetup)
+            from libs.partDiskBkp import diskImgLikeBackup
+            src = args.file or args.disk or th.choose_disk()
+            with nullcontext() if imgsrc.is_image(src) else disk_lock(src):
+                diskImgLikeBackup(src, args.dir or os.getcwd(), adaptive=args.adaptive,
+                                  scratch=[s.strip() for s in args.scratch.split(",") if s.strip()] if args.scratch else None)
+            mode=None
+
+        elif mode == "rspart":
+            # cíl: disk nebo nový řídký soubor obrazu (--file), velikost --image-size
+            if not args.dir:
+                raise ValueError("rspart vyžaduje --dir (adresář se zálohou)")
+            from libs.partDiskBkp import diskImgLikeRestore
+            # --file je vždy obraz (i nový soubor bez cesty), --disk vždy disk
+            target = os.path.abspath(args.file) if args.file else args.disk or th.choose_disk()
+            with nullcontext() if imgsrc.is_image_target(target) else disk_lock(target):
+                diskImgLikeRestore(args.dir, target, verifySha=not args.no_sha,
+                                   delta=args.delta,
+                                   imageSize=throttle.parse_rate(args.image_size) if args.image_size else None)
             mode=None
 
         elif mode == "compress":
             file = args.file or th.scan_current_dir_for_imgs(".img")
             if not file:
                 raise ValueError("compress vyžaduje --file (.img)")
-            compress_image(Path(file), fast=args.fast, maxC=args.max)
+            compress_image(Path(file), fast=args.fast, maxC=args.max, adaptive=args.adaptive)
             mode=None
 
         elif mode == "decompress":
@@ -547,6 +768,154 @@ def main() -> None:
             decompress_image(Path(file))
             mode=None
             
+        elif mode == "batch":
+            if not args.jobs:
+                raise ValueError("batch vyžaduje --jobs (job soubor)")
+            from libs import batch
+            batch.run_batch(
+                args.jobs,
+                maxJobs=args.max_jobs,
+                perBus=args.per_bus,
+                maxCpu=args.max_cpu,
+                reportFile=args.report,
+            )
+            mode=None
+
+        elif mode == "daemon":
+            from libs import daemon
+            daemon.serve(args.socket, args.workers)
+            mode=None
+
+        elif mode == "jobs":
+            from libs import daemon
+            if args.cancel is not None:
+                r = daemon.request({"op": "cancel", "id": args.cancel}, args.socket)
+                print(f"Úloha #{args.cancel}: " + ("zrušení vyžádáno" if r.get("ok") else r.get("error")))
+            elif args.watch is not None:
+                for ev in daemon.stream({"op": "watch", "id": args.watch}, args.socket):
+                    if not ev.get("ok"):
+                        print(ev.get("error"))
+                        break
+                    daemon.print_progress(ev)
+                print()
+            else:
+                r = daemon.request({"op": "history" if args.history else "list"}, args.socket)
+                daemon.print_jobs(r.get("jobs", []))
+            mode=None
+
+        elif mode == "catalog":
+            from libs import catalog
+            action = args.action or "list"
+            if action == "rebuild":
+                root = args.dir or os.getcwd()
+                n, removed = catalog.rebuild(root)
+                print(f"[CATALOG] {root}: {n} záloh zaindexováno, {removed} neexistujících odstraněno.")
+            elif action == "list":
+                catalog.print_sets(catalog.list_sets(root=args.dir, disk=args.disk))
+            elif action == "latest":
+                disk = args.disk or th.choose_disk()
+                if not disk:
+                    raise ValueError("catalog latest vyžaduje --disk")
+                row = catalog.latest_for_disk(disk)
+                if row is None:
+                    print(f"[CATALOG] Pro disk {disk} není v katalogu žádná dobrá záloha.")
+                else:
+                    catalog.print_sets([row])
+            else:
+                raise ValueError(f"Neznámá akce katalogu: {action} (rebuild | list | latest)")
+            mode=None
+
+        elif mode == "copy":
+            if not args.file or not args.to:
+                raise ValueError("copy vyžaduje --file a --to")
+            from libs import reflink
+            reflink.copy_image(Path(args.file), Path(args.to), forEdit=True)
+            mode=None
+
+        elif mode == "prune":
+            if not args.dir:
+                raise ValueError("prune vyžaduje --dir (kořen záloh)")
+            from libs import reflink
+            if not args.dry_run:
+                reflink.prune(args.dir, args.keep_daily, args.keep_weekly, args.keep_last, dryRun=True)
+                if not confirm("Smazat uvedené zálohy?"):
+                    print("Zrušeno.")
+                    return
+            reflink.prune(args.dir, args.keep_daily, args.keep_weekly, args.keep_last, dryRun=args.dry_run)
+            mode=None
+
+        elif mode == "clone":
+            if not args.src or not args.to:
+                raise ValueError("clone vyžaduje --from a --to")
+            from libs import clone
+            if not confirm(f"!!! Tohle přepíše celý disk /dev/{args.to} obsahem /dev/{args.src}. Pokračovat?"):
+                print("Zrušeno.")
+                return
+            res = clone.clone_disk(args.src, args.to, partsOnly=args.parts_only,
+                                   zeroSkip=not args.no_zero_skip, verify=not args.no_verify)
+            if not clone.print_summary(res):
+                raise RuntimeError("Ověření klonu selhalo – cíl neodpovídá zdroji")
+            mode=None
+
+        elif mode == "flash":
+            if not args.file or not args.to:
+                raise ValueError("flash vyžaduje --file a --to sdb,sdc,...")
+            from libs import fleet
+            disks = [d.strip() for d in args.to.split(",") if d.strip()]
+            if not confirm(f"!!! Tohle přepíše disky {', '.join('/dev/' + d for d in disks)} obrazem {args.file}. Pokračovat?"):
+                print("Zrušeno.")
+                return
+            res = fleet.flash(args.file, disks, verify=not args.no_verify)
+            fleet.print_report(res)
+            if not any(t.status == "ok" for t in res):
+                raise RuntimeError("Obraz se nepodařilo nahrát na žádnou kartu")
+            mode=None
+
+        elif mode == "diff":
+            if not args.action or not args.other:
+                raise ValueError("diff vyžaduje dva obrazy: imgtool diff A B")
+            from libs import imgdiff
+            imgdiff.print_diff(imgdiff.diff(args.action, args.other), asJson=args.json)
+            mode=None
+
+        elif mode == "shrink":
+            file = args.file or th.scan_current_dir_for_imgs(".img")
+            if not file:
+                raise ValueError("shrink vyžaduje --file obraz.img")
+            size = args.shrink_size
+            if size is not None:
+                size = int(float(size) * 1024 ** 3) if re.fullmatch(r"\d+(\.\d+)?", size) else throttle.parse_rate(size)
+            from libs import shrink
+            shrink.print_report(shrink.shrink_image(file, size, dryRun=args.dry_run))
+            mode=None
+
+        elif mode == "sparsify":
+            file = args.file or th.scan_current_dir_for_imgs(".img")
+            if not file:
+                raise ValueError("sparsify vyžaduje --file obraz.img")
+            from libs import sparsify
+            sparsify.print_report(sparsify.sparsify(file, trimFs=args.trim, dryRun=args.dry_run), dryRun=args.dry_run)
+            mode=None
+
+        elif mode == "parity":
+            if not args.file:
+                raise ValueError("parity vyžaduje --file")
+            from libs import parity
+            out = parity.create(args.file, args.redundancy or parity.REDUNDANCY)
+            print(f"Hotovo: {out}")
+            mode=None
+
+        elif mode == "repair":
+            if not args.file:
+                raise ValueError("repair vyžaduje --file")
+            from libs import parity
+            if not parity.par_path(args.file).exists():
+                raise FileNotFoundError(f"Chybí paritní soubor {parity.par_path(args.file)}")
+            res = parity.repair(args.file, dryRun=args.dry_run)
+            if not parity.print_report(res) and not args.dry_run:
+                raise RuntimeError("Obraz se nepodařilo opravit celý")
+            mode=None
+
         elif mode== "t":
             app="jbtool"
             myPath=os.path.abspath(__file__)
@@ -573,6 +942,10 @@ def main() -> None:
         else:
             raise ValueError(f"Neznámý režim: {args.mode}")
 
+        # režim zadaný z CLI se provede jednou, menu se opakuje
+        if not repeat:
+            return
+
 if __name__ == "__main__":
     reset()
     main()
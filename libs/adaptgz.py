@@ -0,0 +1,263 @@
+"""
+Adaptivní gzip komprese
+
+Úroveň komprese se nevolí pevně (-1 / -9), ale mění se po blocích podle toho,
+kdo je zrovna úzkým hrdlem:
+  - zdroj (SD karta, USB) čte pomaleji než stíhá komprese → fronta přečtených
+    bloků je prázdná → úroveň se zvyšuje (lepší poměr „zadarmo“)
+  - komprese nestíhá zdroj (rychlé NVMe) → fronta se plní → úroveň se snižuje
+
+Každý blok se komprimuje jako samostatný gzip member, výsledek je tedy
+standardní vícečlenný gzip, který rozbalí `gunzip`, `pigz` i python `gzip`.
+Member nese v hlavičce svou délku, libs/pgunzip ho díky tomu rozbalí paralelně.
+Komprese běží ve vláknech (zlib uvolňuje GIL), zápis je vždy ve správném pořadí.
+"""
+import os
+import sys
+import time
+import queue
+import struct
+import zlib
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from pathlib import Path
+from typing import BinaryIO, Callable, Optional
+
+from . import pagecache
+from . import streams
+from . import throttle
+
+BLOCK_SIZE: int = 4 * 1024 * 1024
+"""Velikost bloku, pro který se volí úroveň komprese (odpovídá dd bs=4M)."""
+
+MIN_LEVEL: int = 1
+MAX_LEVEL: int = 9
+START_LEVEL: int = 6
+
+QUEUE_BLOCKS: int = 8
+"""Maximální počet přečtených bloků čekajících na kompresi."""
+
+
+class c_level_ctl:
+    """Regulátor úrovně komprese podle zaplnění fronty přečtených bloků.
+
+    Úroveň se mění nejvýše o 1 a až po několika po sobě jdoucích vzorcích
+    na stejné straně (hystereze), aby úroveň nekmitala blok od bloku.
+    """
+
+    def __init__(self, minLevel: int = MIN_LEVEL, maxLevel: int = MAX_LEVEL,
+                 startLevel: int = START_LEVEL, queueSize: int = QUEUE_BLOCKS,
+                 hysteresis: int = 3) -> None:
+        if not (1 <= minLevel <= maxLevel <= 9):
+            raise ValueError("Úrovně komprese musí splňovat 1 <= min <= max <= 9")
+        self.minLevel = minLevel
+        self.maxLevel = maxLevel
+        self.level = min(max(startLevel, minLevel), maxLevel)
+        self.high = max(2, (queueSize * 3) // 4)
+        self.low = max(0, queueSize // 4)
+        self.hysteresis = hysteresis
+        self._up = 0
+        self._down = 0
+        self.histogram = [0] * 10
+
+    def next_level(self, backlog: int) -> int:
+        """Vrátí úroveň pro další blok.
+
+        Args:
+            backlog (int): počet přečtených bloků, které ještě nebyly zkomprimovány.
+        Returns:
+            int: úroveň komprese 1-9
+        """
+        if backlog >= self.high:
+            self._down += 1
+            self._up = 0
+        elif backlog <= self.low:
+            self._up += 1
+            self._down = 0
+        else:
+            self._up = self._down = 0
+
+        if self._down >= self.hysteresis and self.level > self.minLevel:
+            self.level -= 1
+            self._down = 0
+        elif self._up >= self.hysteresis and self.level < self.maxLevel:
+            self.level += 1
+            self._up = 0
+
+        self.histogram[self.level] += 1
+        return self.level
+
+
+SIZE_SUBFIELD: bytes = b"IG"
+"""FEXTRA subfield s celkovou délkou memberu (uint32 LE), podle něj libs/pgunzip
+najde hranice memberů bez rozbalování a rozbalí je paralelně (obdoba BGZF "BC")."""
+
+
+def _gzip_member(data: bytes, level: int) -> bytes:
+    """Zkomprimuje blok jako samostatný gzip member s délkou v FEXTRA."""
+    c = zlib.compressobj(level, zlib.DEFLATED, -15)
+    body = c.compress(data) + c.flush()
+    xfl = 2 if level == 9 else 4 if level == 1 else 0
+    size = 10 + 2 + 8 + len(body) + 8
+    # ID1 ID2 CM=deflate FLG=FEXTRA MTIME=0 XFL OS=unknown | XLEN | SI1 SI2 LEN délka
+    head = struct.pack("<BBBBIBBH2sHI", 0x1F, 0x8B, 8, 4, 0, xfl, 255, 8, SIZE_SUBFIELD, 4, size)
+    return head + body + struct.pack("<II", zlib.crc32(data), len(data) & 0xFFFFFFFF)
+
+
+def _fmt_rate(bytesPerSec: float) -> str:
+    return f"{bytesPerSec / 1024 / 1024:7.1f} MB/s"
+
+
+def print_progress(done: int, total: int | None, rate: float, level: int) -> None:
+    """Výchozí výpis průběhu (na jeden řádek jako dd status=progress)."""
+    if total:
+        pct = f"{done * 100 / total:5.1f}%"
+    else:
+        pct = "  ?  "
+    sys.stdout.write(f"\r[ADAPT] {done / 1024 / 1024 / 1024:8.2f} GiB {pct}  čtení {_fmt_rate(rate)}  gzip -{level} ")
+    sys.stdout.flush()
+
+
+def compress_stream(
+    src: BinaryIO,
+    dst: BinaryIO,
+    total: int | None = None,
+    minLevel: int = MIN_LEVEL,
+    maxLevel: int = MAX_LEVEL,
+    workers: int | None = None,
+    progress: Optional[Callable[[int, int | None, float, int], None]] = print_progress,
+) -> dict:
+    """Adaptivně zkomprimuje `src` do `dst` jako vícečlenný gzip.
+
+    Args:
+        src: zdroj otevřený binárně (soubor, blokové zařízení, pipe)
+        dst: cíl otevřený binárně pro zápis
+        total: celková velikost zdroje, jen pro výpis průběhu
+        minLevel, maxLevel: rozsah úrovní komprese, ve kterém se regulátor pohybuje
+        workers: počet kompresních vláken, default počet CPU
+        progress: callback(done, total, readRate, level), None = bez výpisu
+    Returns:
+        dict: {"bytes_in", "bytes_out", "sha256", "seconds", "levels": {úroveň: počet bloků}}
+    """
+    if workers is None:
+        workers = max(1, os.cpu_count() or 1)
+
+    ctl = c_level_ctl(minLevel, maxLevel, queueSize=QUEUE_BLOCKS)
+    blocks: "queue.Queue[bytes | BaseException | None]" = queue.Queue(maxsize=QUEUE_BLOCKS)
+    stop = threading.Event()
+    readStats = {"bytes": 0, "rate": 0.0}
+    pagecache.advise_sequential(src)
+    dropIn = pagecache.c_drop_behind(src)
+    dropOut = pagecache.c_drop_behind(dst, write=True)
+
+    def reader() -> None:
+        t0 = time.monotonic()
+        try:
+            while not stop.is_set():
+                throttle.consume(BLOCK_SIZE)
+                data = src.read(BLOCK_SIZE)
+                if not data:
+                    break
+                readStats["bytes"] += len(data)
+                dropIn(len(data))
+                elapsed = time.monotonic() - t0
+                if elapsed > 0:
+                    readStats["rate"] = readStats["bytes"] / elapsed
+                blocks.put(data)
+        except BaseException as e:
+            blocks.put(e)
+            return
+        blocks.put(None)
+
+    sha = hashlib.sha256()
+    bytesOut = 0
+    pending: deque[Future] = deque()
+    t0 = time.monotonic()
+
+    def write_one() -> None:
+        nonlocal bytesOut
+        out = pending.popleft().result()
+        dst.write(out)
+        sha.update(out)
+        bytesOut += len(out)
+        dropOut(len(out))
+
+    rd = threading.Thread(target=reader, name="adaptgz-reader", daemon=True)
+    rd.start()
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="adaptgz") as ex:
+            while True:
+                data = blocks.get()
+                if data is None:
+                    break
+                if isinstance(data, BaseException):
+                    raise data
+                # backlog = bloky čekající ve frontě + rozpracované v poolu
+                level = ctl.next_level(blocks.qsize() + max(0, len(pending) - workers))
+                pending.append(ex.submit(_gzip_member, data, level))
+                # omezíme počet rozpracovaných bloků, ať nerosté paměť
+                while len(pending) > workers * 2:
+                    write_one()
+                if progress:
+                    progress(readStats["bytes"], total, readStats["rate"], level)
+            while pending:
+                write_one()
+            if not bytesOut:
+                # prázdný vstup – 0 B soubor není platný gzip, zapíše se jeden prázdný member
+                pending.append(ex.submit(_gzip_member, b"", minLevel))
+                write_one()
+    finally:
+        stop.set()
+        # uvolníme čtecí vlákno, pokud čeká na místo ve frontě
+        while rd.is_alive():
+            try:
+                blocks.get_nowait()
+            except queue.Empty:
+                rd.join(0.05)
+        dropIn.close()
+        dropOut.close()
+
+    if progress:
+        sys.stdout.write("\n")
+    return {
+        "bytes_in": readStats["bytes"],
+        "bytes_out": bytesOut,
+        "sha256": sha.hexdigest(),
+        "seconds": time.monotonic() - t0,
+        "levels": {lvl: n for lvl, n in enumerate(ctl.histogram) if n},
+    }
+
+
+def compress_file(src: str | Path, out: str | Path, minLevel: int = MIN_LEVEL,
+                  maxLevel: int = MAX_LEVEL, workers: int | None = None,
+                  progress: Optional[Callable[[int, int | None, float, int], None]] = print_progress,
+                  splitSize: int | None = None) -> dict:
+    """Adaptivně zkomprimuje soubor nebo blokové zařízení `src` do `out`.
+
+    out může být i "-" (stdout), roura nebo už otevřený výstup (libs/streams),
+    splitSize rozdělí výstup na svazky.
+
+    Returns:
+        dict: viz compress_stream
+    """
+    src = Path(src)
+    # výstupní velikost předem neznáme – bez prealokace, jen writeback po oknech a fsync
+    with src.open("rb") as fi, streams.open_sink(out, splitSize=splitSize) as fo:
+        try:
+            total = os.lseek(fi.fileno(), 0, os.SEEK_END)
+            os.lseek(fi.fileno(), 0, os.SEEK_SET)
+        except OSError:
+            total = None
+        return compress_stream(fi, fo, total, minLevel, maxLevel, workers, progress)
+
+
+def print_summary(stats: dict) -> None:
+    """Vypíše souhrn adaptivní komprese."""
+    secs = stats["seconds"] or 1e-9
+    ratio = stats["bytes_out"] / stats["bytes_in"] if stats["bytes_in"] else 0
+    print(f"[ADAPT] {stats['bytes_in']} B → {stats['bytes_out']} B (poměr {ratio:.3f}), "
+          f"{_fmt_rate(stats['bytes_in'] / secs).strip()}")
+    levels = ", ".join(f"-{lvl}: {n}" for lvl, n in sorted(stats["levels"].items()))
+    print(f"[ADAPT] Použité úrovně (počet bloků): {levels}")
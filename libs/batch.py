@@ -0,0 +1,287 @@
+"""
+Dávkové zálohy více disků najednou (např. hub čteček karet)
+
+Job soubor (JSON / JSONC):
+
+    {
+      "max_jobs": 8,        // max. souběžných úloh celkem
+      "per_bus": 2,         // max. souběžných úloh na jedné USB sběrnici
+      "max_cpu": 4,         // max. souběžně komprimujících úloh (1 CPU slot na úlohu)
+      "jobs": [
+        {"disk": "sdb", "mode": "backup", "dest": "/var/backups/karty", "name": "opi-01", "compress": "adaptive"},
+        {"disk": "sdc", "mode": "bkpart", "dest": "/var/backups/karty", "compress": "none"}
+      ]
+    }
+
+Režimy úloh:
+  backup  – RAW záloha celého disku (compress: none | fast | max | adaptive)
+  bkpart  – záloha layout + partition (compress: none | adaptive); "scratch": [3, "tmp"]
+            = partition (číslo / label), jejichž obsah se nezálohuje, restore je jen naformátuje
+  restore – obnova .img / .img.gz ("file") na disk, bez dotazů
+  verify  – kontrola SHA256 sidecar souboru "file" (disk není potřeba)
+
+Každá úloha drží zámek svého disku (th.device_lock). Stejný zámek berou i CLI
+režimy imgtool, které s diskem pracují (backup, restore, smart-*, bkpart,
+rspart, clone, flash), takže dvě úlohy ani dva běžící imgtool nikdy
+nepracují se stejným diskem.
+"""
+import json
+import os
+import threading
+import time
+import traceback
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable
+
+import libs.toolhelp as th
+from . import catalog
+from . import rawbkp as rb
+
+JOB_MODES: tuple[str, ...] = ("backup", "bkpart", "restore", "verify")
+
+
+class JobCancelled(Exception):
+    """Vyhodí progress callback, když byla úloha zrušena (daemon cancel)."""
+
+
+class c_job:
+    """Jedna úloha dávky a její výsledek."""
+
+    def __init__(self, idx: int, spec: dict) -> None:
+        self.idx = idx
+        self.disk: str = os.path.basename(str(spec.get("disk") or ""))
+        self.mode: str = spec.get("mode", "backup")
+        self.dest: str = spec.get("dest") or os.getcwd()
+        self.name: str | None = spec.get("name")
+        self.compress: str = spec.get("compress", "none")
+        self.file: str | None = spec.get("file")
+        self.autoprefix: bool = bool(spec.get("autoprefix", True))
+        self.scratch: list = list(spec.get("scratch") or [])
+        self.bus: str | None = None
+
+        self.status: str = "pending"
+        self.error: str | None = None
+        self.output: str | None = None
+        self.started: float | None = None
+        self.finished: float | None = None
+
+        if self.mode not in JOB_MODES:
+            raise ValueError(f"Úloha #{idx}: neznámý režim '{self.mode}' (podporováno: {', '.join(JOB_MODES)})")
+        if self.compress not in rb.CODECS:
+            raise ValueError(f"Úloha #{idx}: neznámá komprese '{self.compress}' (podporováno: {', '.join(rb.CODECS)})")
+        if self.mode == "bkpart" and self.compress not in ("none", "adaptive"):
+            raise ValueError(f"Úloha #{idx}: bkpart podporuje jen compress none | adaptive")
+        if not self.disk and self.mode != "verify":
+            raise ValueError(f"Úloha #{idx}: chybí 'disk'")
+        if self.mode in ("restore", "verify") and not self.file:
+            raise ValueError(f"Úloha #{idx}: režim {self.mode} vyžaduje 'file'")
+
+    @property
+    def usesCpu(self) -> bool:
+        return self.compress != "none" and self.mode in ("backup", "bkpart")
+
+    @property
+    def seconds(self) -> float | None:
+        if self.started is None or self.finished is None:
+            return None
+        return round(self.finished - self.started, 1)
+
+    def report(self) -> dict:
+        return {
+            "idx": self.idx,
+            "disk": self.disk,
+            "mode": self.mode,
+            "compress": self.compress,
+            "file": self.file,
+            "bus": self.bus,
+            "status": self.status,
+            "output": self.output,
+            "seconds": self.seconds,
+            "error": self.error,
+        }
+
+
+def load_jobs(path: str | Path) -> tuple[dict, list[c_job]]:
+    """Načte job soubor (JSON nebo JSONC s komentáři) a zvaliduje úlohy."""
+    text = Path(path).read_text(encoding="utf-8")
+    try:
+        import json5
+        data = json5.loads(text)
+    except ImportError:
+        data = json.loads(text)
+    if isinstance(data, list):
+        data = {"jobs": data}
+    jobs = [c_job(i, spec) for i, spec in enumerate(data.get("jobs", []), start=1)]
+    if not jobs:
+        raise ValueError(f"Job soubor {path} neobsahuje žádné úlohy")
+    return data, jobs
+
+
+def run_job(job: c_job, progress: Callable[[int, int | None], None] | None = None) -> str:
+    """Provede jednu úlohu neinteraktivně, vrátí cestu výstupu.
+
+    Volající musí držet zámek disku.
+    progress: callback(done, total); vyhozená výjimka (JobCancelled) úlohu přeruší
+    """
+    dev = f"/dev/{job.disk}"
+    if job.mode == "verify":
+        ok = th.verify_sha256_sidecar(Path(job.file), progress=progress)
+        catalog.set_hash_status(job.file, "ok" if ok else "bad")
+        if not ok:
+            raise RuntimeError(f"SHA256 nesedí nebo chybí sidecar: {job.file}")
+        return job.file
+    if job.mode == "restore":
+        rb.restore_raw(Path(job.file), dev, progress=progress)
+        return dev
+    Path(job.dest).mkdir(parents=True, exist_ok=True)
+    # komprese v dávce běží v jednom vlákně na úlohu, CPU omezuje scheduler
+    if job.mode == "backup":
+        base = os.path.join(job.dest, rb.generate_base_name(job.disk, job.name, job.autoprefix))
+        return str(rb.backup_raw(dev, base, job.compress, workers=1, progress=progress))
+    if job.mode == "bkpart":
+        from .partDiskBkp import diskImgLikeBackup
+        return diskImgLikeBackup(job.disk, job.dest, job.name or job.disk,
+                                 adaptive=job.compress == "adaptive", interactive=False, workers=1,
+                                 scratch=job.scratch, progress=progress)
+    raise ValueError(f"Neznámý režim úlohy: {job.mode}")
+
+
+class c_scheduler:
+    """Spouští úlohy souběžně s limity na disk, USB sběrnici a CPU."""
+
+    def __init__(self, jobs: list[c_job], maxJobs: int = 4, perBus: int = 2, maxCpu: int | None = None,
+                 runner: Callable[[c_job], str] = run_job) -> None:
+        self.jobs = jobs
+        self.maxJobs = max(1, maxJobs)
+        self.perBus = max(1, perBus)
+        self.maxCpu = max(1, maxCpu or os.cpu_count() or 1)
+        self.runner = runner
+        self._cond = threading.Condition()
+        self._busyDisks: set[str] = set()
+        self._busBusy: dict[str, int] = {}
+        self._cpuBusy = 0
+        self._running = 0
+
+        for j in jobs:
+            j.bus = th.usb_bus_of(j.disk)
+
+    def _can_start(self, job: c_job) -> bool:
+        if self._running >= self.maxJobs:
+            return False
+        if job.disk and job.disk in self._busyDisks:
+            return False
+        if job.bus and self._busBusy.get(job.bus, 0) >= self.perBus:
+            return False
+        if job.usesCpu and self._cpuBusy >= self.maxCpu:
+            return False
+        return True
+
+    def _take(self, job: c_job) -> None:
+        self._running += 1
+        self._busyDisks.add(job.disk)
+        if job.bus:
+            self._busBusy[job.bus] = self._busBusy.get(job.bus, 0) + 1
+        if job.usesCpu:
+            self._cpuBusy += 1
+
+    def _release(self, job: c_job) -> None:
+        with self._cond:
+            self._running -= 1
+            self._busyDisks.discard(job.disk)
+            if job.bus:
+                self._busBusy[job.bus] -= 1
+            if job.usesCpu:
+                self._cpuBusy -= 1
+            self._cond.notify_all()
+
+    def _worker(self, job: c_job) -> None:
+        job.started = time.monotonic()
+        try:
+            # neblokující zámek: disk drží jiný proces → úloha selže hned, ne až po hodině čekání
+            if job.disk:
+                with th.device_lock(job.disk, wait=False):
+                    job.status = "running"
+                    print(f"[BATCH] #{job.idx} start {job.mode} /dev/{job.disk} ({job.compress})")
+                    job.output = self.runner(job)
+            else:
+                job.status = "running"
+                print(f"[BATCH] #{job.idx} start {job.mode} {job.file}")
+                job.output = self.runner(job)
+            job.status = "ok"
+            print(f"[BATCH] #{job.idx} OK → {job.output}")
+        except BlockingIOError:
+            job.status = "failed"
+            job.error = f"Disk {job.disk} je zamčený jiným procesem"
+            print(f"[BATCH] #{job.idx} CHYBA: {job.error}")
+        except Exception as e:
+            job.status = "failed"
+            job.error = f"{type(e).__name__}: {e}"
+            print(f"[BATCH] #{job.idx} CHYBA: {job.error}")
+            traceback.print_exc()
+        finally:
+            job.finished = time.monotonic()
+            self._release(job)
+
+    def run(self) -> list[c_job]:
+        """Spustí všechny úlohy a počká na dokončení."""
+        pending = list(self.jobs)
+        threads: list[threading.Thread] = []
+        with self._cond:
+            while pending:
+                startable = next((j for j in pending if self._can_start(j)), None)
+                if startable is None:
+                    self._cond.wait()
+                    continue
+                pending.remove(startable)
+                self._take(startable)
+                t = threading.Thread(target=self._worker, args=(startable,), name=f"batch-{startable.idx}")
+                threads.append(t)
+                t.start()
+        for t in threads:
+            t.join()
+        return self.jobs
+
+
+def print_report(jobs: list[c_job]) -> None:
+    """Vypíše souhrnnou tabulku výsledků."""
+    tit = f"{'#':>3} | {'Disk':<10} | {'Režim':<7} | {'Komprese':<8} | {'Stav':<7} | {'Čas [s]':>8} | Výstup / chyba"
+    print(tit)
+    print("-" * len(tit))
+    for j in jobs:
+        info = j.output if j.status == "ok" else (j.error or "")
+        secs = f"{j.seconds:.1f}" if j.seconds is not None else "-"
+        print(f"{j.idx:>3} | {j.disk:<10} | {j.mode:<7} | {j.compress:<8} | {j.status:<7} | {secs:>8} | {info}")
+    ok = sum(1 for j in jobs if j.status == "ok")
+    print(f"Hotovo: {ok}/{len(jobs)} úloh v pořádku.")
+
+
+def run_batch(jobFile: str | Path, maxJobs: int | None = None, perBus: int | None = None,
+              maxCpu: int | None = None, reportFile: str | Path | None = None) -> list[c_job]:
+    """Načte job soubor, spustí úlohy a uloží JSON report.
+
+    Parametry z CLI mají přednost před hodnotami v job souboru.
+    """
+    cfg, jobs = load_jobs(jobFile)
+    sched = c_scheduler(
+        jobs,
+        maxJobs=maxJobs or cfg.get("max_jobs", 4),
+        perBus=perBus or cfg.get("per_bus", 2),
+        maxCpu=maxCpu or cfg.get("max_cpu"),
+    )
+    print(f"[BATCH] {len(jobs)} úloh, max {sched.maxJobs} souběžně, {sched.perBus} na USB sběrnici, {sched.maxCpu} CPU")
+    t0 = datetime.now()
+    sched.run()
+    print_report(jobs)
+
+    if reportFile is None:
+        reportFile = Path(os.getcwd()) / f"batch-report-{t0.strftime('%Y-%m-%d-%H%M%S')}.json"
+    report: dict[str, Any] = {
+        "job_file": str(Path(jobFile).resolve()),
+        "started": t0.strftime("%Y-%m-%d %H:%M:%S"),
+        "finished": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "jobs": [j.report() for j in jobs],
+    }
+    Path(reportFile).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"[BATCH] Report: {reportFile}")
+    return jobs
@@ -0,0 +1,348 @@
+"""
+Katalog záloh v SQLite
+
+Každá dokončená záloha (RAW .img/.img.gz i partition záloha s manifest.json)
+se zapíše do databáze, takže výpis a vyhledání nevyžaduje procházet adresáře
+a číst manifesty. Existující stromy záloh zaindexuje `imgtool catalog rebuild`.
+
+Disk (karta) se identifikuje sériovým číslem a PTUUID tabulky oddílů, takže
+"poslední dobrá záloha této karty" funguje i když se karta připojí jako jiné sdX.
+
+Stav hashe (hash_status):
+  ok         – SHA256 ověřena proti sidecar
+  unverified – sidecar existuje, ale neověřovalo se (typicky hned po záloze)
+  bad        – SHA256 nesedí
+  missing    – chybí sidecar
+"""
+import json
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+import libs.toolhelp as th
+import libs.glb as glb
+
+HASH_STATES: tuple[str, ...] = ("ok", "unverified", "bad", "missing")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sets (
+    id          INTEGER PRIMARY KEY,
+    path        TEXT NOT NULL UNIQUE,
+    kind        TEXT NOT NULL,
+    name        TEXT,
+    disk        TEXT,
+    serial      TEXT,
+    ptuuid      TEXT,
+    created     TEXT NOT NULL,
+    size_bytes  INTEGER NOT NULL DEFAULT 0,
+    codec       TEXT,
+    hash_status TEXT NOT NULL DEFAULT 'unverified',
+    verified_at TEXT
+);
+CREATE INDEX IF NOT EXISTS sets_serial ON sets(serial, created);
+CREATE INDEX IF NOT EXISTS sets_ptuuid ON sets(ptuuid, created);
+CREATE INDEX IF NOT EXISTS sets_created ON sets(created);
+CREATE TABLE IF NOT EXISTS parts (
+    set_id      INTEGER NOT NULL REFERENCES sets(id) ON DELETE CASCADE,
+    num         INTEGER NOT NULL,
+    name        TEXT,
+    partuuid    TEXT,
+    fstype      TEXT,
+    size_bytes  INTEGER NOT NULL DEFAULT 0,
+    filename    TEXT,
+    codec       TEXT,
+    PRIMARY KEY (set_id, num)
+);
+CREATE INDEX IF NOT EXISTS parts_partuuid ON parts(partuuid);
+"""
+
+
+def connect(dbPath: str | Path = glb.CATALOG_DB) -> sqlite3.Connection:
+    """Otevře (a případně vytvoří) databázi katalogu."""
+    dbPath = Path(dbPath)
+    dbPath.parent.mkdir(parents=True, exist_ok=True)
+    # dávka/daemon zapisují z více vláken → každé volání má vlastní spojení, WAL a timeout
+    con = sqlite3.connect(str(dbPath), timeout=30)
+    con.row_factory = sqlite3.Row
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA foreign_keys=ON")
+    con.executescript(_SCHEMA)
+    return con
+
+
+def disk_identity(disk: str) -> dict[str, str | None]:
+    """Vrátí sériové číslo a PTUUID disku a PARTUUID jeho partition.
+
+    Returns:
+        dict: {"serial": ..., "ptuuid": ..., "partuuids": {"sdb1": "...", ...}}
+    """
+    dev = disk if disk.startswith("/dev/") else f"/dev/{disk}"
+    out = th.check_output(["lsblk", "-J", "-o", "NAME,TYPE,SERIAL,PTUUID,PARTUUID", dev])
+    data = json.loads(out)
+    r: dict[str, Any] = {"serial": None, "ptuuid": None, "partuuids": {}}
+    for node in data.get("blockdevices", []):
+        r["serial"] = node.get("serial") or None
+        r["ptuuid"] = node.get("ptuuid") or None
+        for ch in node.get("children", []) or []:
+            if ch.get("partuuid"):
+                r["partuuids"][ch["name"]] = ch["partuuid"]
+    return r
+
+
+def _hash_status(files: list[Path]) -> str:
+    """Stav hashe podle existence sidecar souborů (bez přepočtu)."""
+    if any(not Path(str(f) + ".sha256").exists() for f in files):
+        return "missing"
+    return "unverified"
+
+
+def _upsert_set(con: sqlite3.Connection, rec: dict, parts: list[dict]) -> int:
+    """Vloží nebo aktualizuje sadu podle cesty. Identitu disku nepřepisuje na NULL."""
+    con.execute("""
+        INSERT INTO sets (path, kind, name, disk, serial, ptuuid, created, size_bytes, codec, hash_status)
+        VALUES (:path, :kind, :name, :disk, :serial, :ptuuid, :created, :size_bytes, :codec, :hash_status)
+        ON CONFLICT(path) DO UPDATE SET
+            kind=excluded.kind,
+            name=excluded.name,
+            disk=COALESCE(excluded.disk, sets.disk),
+            serial=COALESCE(excluded.serial, sets.serial),
+            ptuuid=COALESCE(excluded.ptuuid, sets.ptuuid),
+            created=excluded.created,
+            size_bytes=excluded.size_bytes,
+            codec=excluded.codec,
+            hash_status=CASE
+                WHEN excluded.hash_status='missing' THEN 'missing'
+                WHEN sets.hash_status IN ('ok', 'bad') THEN sets.hash_status
+                ELSE excluded.hash_status END
+    """, rec)
+    sid = con.execute("SELECT id FROM sets WHERE path=?", (rec["path"],)).fetchone()["id"]
+    con.execute("DELETE FROM parts WHERE set_id=?", (sid,))
+    con.executemany("""
+        INSERT INTO parts (set_id, num, name, partuuid, fstype, size_bytes, filename, codec)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, [(sid, p.get("num", 0), p.get("name"), p.get("partuuid"), p.get("fstype"),
+           int(p.get("size_bytes") or 0), p.get("filename"), p.get("codec")) for p in parts])
+    return sid
+
+
+def _raw_record(image: Path, disk: str | None = None, ident: dict | None = None) -> dict:
+    st = image.stat()
+    ident = ident or {}
+    return {
+        "path": str(image.resolve()),
+        "kind": "raw",
+        "name": image.name,
+        "disk": disk,
+        "serial": ident.get("serial"),
+        "ptuuid": ident.get("ptuuid"),
+        "created": datetime.fromtimestamp(st.st_mtime).strftime("%Y-%m-%d %H:%M:%S"),
+        "size_bytes": st.st_size,
+        "codec": "gzip" if th.is_gzip(image) else "raw",
+        "hash_status": _hash_status([image]),
+    }
+
+
+def _manifest_record(setDir: Path, manifest: dict) -> tuple[dict, list[dict]]:
+    parts = manifest.get("partitions", [])
+    # swap / scratch partition (action recreate) nemají obraz
+    images = [p for p in parts if p.get("filename")]
+    codecs = sorted({p.get("codec", "raw") for p in images})
+    size = 0
+    files = []
+    for p in images:
+        fn = setDir / p["filename"]
+        files.append(fn)
+        if fn.exists():
+            size += fn.stat().st_size
+    rec = {
+        "path": str(setDir.resolve()),
+        "kind": manifest.get("type", "manifest"),
+        "name": setDir.name,
+        "disk": manifest.get("source_disk"),
+        "serial": manifest.get("serial"),
+        "ptuuid": manifest.get("ptuuid"),
+        "created": manifest.get("created") or datetime.fromtimestamp(setDir.stat().st_mtime).strftime("%Y-%m-%d %H:%M:%S"),
+        "size_bytes": size,
+        "codec": ",".join(codecs) if codecs else None,
+        "hash_status": _hash_status(files),
+    }
+    return rec, parts
+
+
+def register_raw(image: Path, disk: str | None = None, dbPath: str | Path = glb.CATALOG_DB) -> None:
+    """Zapíše RAW obraz do katalogu (volá se na konci zálohy).
+
+    Chyba katalogu zálohu neshodí, jen se vypíše varování.
+    """
+    try:
+        ident = None
+        if disk and disk.startswith("/dev/"):
+            try:
+                ident = disk_identity(disk)
+            except Exception:
+                ident = None
+        with closing(connect(dbPath)) as con, con:
+            _upsert_set(con, _raw_record(Path(image), os.path.basename(disk) if disk else None, ident), [])
+    except (sqlite3.Error, OSError) as e:
+        print(f"[CATALOG] Zápis do katalogu selhal: {e}")
+
+
+def register_set(setDir: Path, dbPath: str | Path = glb.CATALOG_DB) -> None:
+    """Zapíše adresář zálohy s manifest.json do katalogu."""
+    try:
+        setDir = Path(setDir)
+        manifest = json.loads((setDir / "manifest.json").read_text(encoding="utf-8"))
+        rec, parts = _manifest_record(setDir, manifest)
+        with closing(connect(dbPath)) as con, con:
+            _upsert_set(con, rec, parts)
+    except (sqlite3.Error, OSError, ValueError) as e:
+        print(f"[CATALOG] Zápis do katalogu selhal: {e}")
+
+
+def set_hash_status(path: str | Path, status: str, dbPath: str | Path = glb.CATALOG_DB) -> None:
+    """Uloží výsledek ověření SHA256 pro obraz nebo pro sadu, do které soubor patří."""
+    if status not in HASH_STATES:
+        raise ValueError(f"Neplatný stav hashe: {status}")
+    p = Path(path).resolve()
+    try:
+        with closing(connect(dbPath)) as con, con:
+            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            cur = con.execute("UPDATE sets SET hash_status=?, verified_at=? WHERE path=?", (status, now, str(p)))
+            if cur.rowcount == 0 and status == "bad":
+                # soubor partition → špatný hash shodí celou sadu
+                con.execute("UPDATE sets SET hash_status=?, verified_at=? WHERE path=?", (status, now, str(p.parent)))
+    except (sqlite3.Error, OSError) as e:
+        print(f"[CATALOG] Zápis do katalogu selhal: {e}")
+
+
+def scan_tree(root: str | Path):
+    """Projde strom záloh a vrací (záznam, partition) pro každou nalezenou sadu."""
+    root = Path(root).resolve()
+    for dirpath, dirnames, filenames in os.walk(root):
+        d = Path(dirpath)
+        if "manifest.json" in filenames:
+            try:
+                manifest = json.loads((d / "manifest.json").read_text(encoding="utf-8"))
+                yield _manifest_record(d, manifest)
+            except (OSError, ValueError) as e:
+                print(f"[CATALOG] Vadný manifest {d}: {e}")
+            # obsah sady (partition obrazy) už nejsou samostatné zálohy
+            dirnames[:] = []
+            continue
+        for fn in filenames:
+            if fn.endswith((".img", ".img.gz")):
+                try:
+                    yield _raw_record(d / fn), []
+                except OSError as e:
+                    print(f"[CATALOG] {d / fn}: {e}")
+
+
+def rebuild(root: str | Path, dbPath: str | Path = glb.CATALOG_DB) -> tuple[int, int]:
+    """Zaindexuje strom záloh a odstraní záznamy pod root, které už neexistují.
+
+    Returns:
+        (počet sad, počet odstraněných záznamů)
+    """
+    root = Path(root).resolve()
+    seen: set[str] = set()
+    with closing(connect(dbPath)) as con, con:
+        for rec, parts in scan_tree(root):
+            _upsert_set(con, rec, parts)
+            seen.add(rec["path"])
+        prefix = str(root).rstrip("/") + "/"
+        stale = [r["id"] for r in con.execute("SELECT id, path FROM sets WHERE path LIKE ? ESCAPE '\\'",
+                                              (_like_prefix(prefix),))
+                 if r["path"] not in seen]
+        con.executemany("DELETE FROM sets WHERE id=?", [(i,) for i in stale])
+    return len(seen), len(stale)
+
+
+def _like_prefix(prefix: str) -> str:
+    return prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def list_sets(root: str | Path | None = None, disk: str | None = None, serial: str | None = None,
+              ptuuid: str | None = None, kind: str | None = None, good: bool = False,
+              limit: int | None = None, dbPath: str | Path = glb.CATALOG_DB) -> list[dict]:
+    """Vrátí sady z katalogu, nejnovější první.
+
+    Args:
+        root: jen sady pod tímto adresářem
+        disk / serial / ptuuid: filtr identity; serial a ptuuid se kombinují přes OR
+        kind: raw | imgtool-disk-backup | ...
+        good: vynechat sady se špatným nebo chybějícím hashem
+    """
+    where: list[str] = []
+    par: list[Any] = []
+    if root is not None:
+        where.append("path LIKE ? ESCAPE '\\'")
+        par.append(_like_prefix(str(Path(root).resolve()).rstrip("/") + "/"))
+    ident = []
+    if serial:
+        ident.append("serial=?")
+        par.append(serial)
+    if ptuuid:
+        ident.append("ptuuid=?")
+        par.append(ptuuid)
+    if ident:
+        where.append("(" + " OR ".join(ident) + ")")
+    elif disk:
+        where.append("disk=?")
+        par.append(disk)
+    if kind:
+        where.append("kind=?")
+        par.append(kind)
+    if good:
+        where.append("hash_status IN ('ok', 'unverified')")
+    sql = "SELECT * FROM sets" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY created DESC, id DESC"
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+    with closing(connect(dbPath)) as con:
+        return [dict(r) for r in con.execute(sql, par)]
+
+
+def parts_of(setId: int, dbPath: str | Path = glb.CATALOG_DB) -> list[dict]:
+    """Partition zálohované v sadě."""
+    with closing(connect(dbPath)) as con:
+        return [dict(r) for r in con.execute("SELECT * FROM parts WHERE set_id=? ORDER BY num", (setId,))]
+
+
+def latest_for_disk(disk: str, kind: str | None = None, dbPath: str | Path = glb.CATALOG_DB) -> dict | None:
+    """Poslední dobrá záloha právě připojeného disku (podle serial/PTUUID, jinak jména)."""
+    try:
+        ident = disk_identity(disk)
+    except Exception:
+        ident = {"serial": None, "ptuuid": None}
+    rows = list_sets(disk=os.path.basename(disk), serial=ident.get("serial"), ptuuid=ident.get("ptuuid"),
+                     kind=kind, good=True, limit=1, dbPath=dbPath)
+    return rows[0] if rows else None
+
+
+def set_paths(root: str | Path, kind: str | None = None, dbPath: str | Path = glb.CATALOG_DB) -> set[str] | None:
+    """Množina cest sad pod root pro rychlé označení v TUI.
+
+    Vrací None, pokud katalog neexistuje nebo pro root nic nemá – volající
+    pak použije původní kontrolu souborů.
+    """
+    if not Path(dbPath).exists():
+        return None
+    try:
+        paths = {r["path"] for r in list_sets(root=root, kind=kind, dbPath=dbPath)}
+    except sqlite3.Error:
+        return None
+    return paths or None
+
+
+def print_sets(rows: list[dict]) -> None:
+    """Vypíše tabulku sad."""
+    from libs.JBLibs.format import bytesTx
+    tit = f"{'Vytvořeno':<19} | {'Typ':<6} | {'Disk':<6} | {'Serial':<16} | {'Velikost':>10} | {'Kodek':<8} | {'Hash':<10} | Cesta"
+    print(tit)
+    print("-" * len(tit))
+    for r in rows:
+        kind = "raw" if r["kind"] == "raw" else "parts"
+        print(f"{r['created']:<19} | {kind:<6} | {r['disk'] or '-':<6} | {(r['serial'] or '-')[:16]:<16} | "
+              f"{bytesTx(r['size_bytes']):>10} | {r['codec'] or '-':<8} | {r['hash_status']:<10} | {r['path']}")
@@ -0,0 +1,193 @@
+"""
+Delta restore: zapisují se jen bloky, které se na cíli liší
+
+Karta, na které je minulý týden nahraný stejný (nebo podobný) obraz, se při
+běžné obnově přepisuje celá. Čtení je na SD kartách řádově levnější než zápis,
+proto se obraz i cíl porovnávají po blocích CHUNK:
+  - bloky cíle se čtou a hashují paralelně ve vláknech, s předstihem před zdrojem
+  - zdroj (.img přes pipeline, .img.gz přes pgunzip) se hashuje po stejných blocích
+  - zapíše se jen blok, jehož hash nesedí
+
+--dry-run nic nezapisuje, jen vypíše rozsahy bajtů, které by se přepsaly.
+"""
+import hashlib
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Optional
+
+from . import pgunzip
+from . import pipeline
+from . import streams
+from . import throttle
+
+CHUNK: int = 4 * 1024 * 1024
+"""Velikost porovnávaného bloku (= pipeline.BLOCK_SIZE, bloky pipeline se nedělí)."""
+
+PREFETCH: int = 4
+"""Kolik bloků cíle na jedno vlákno se čte dopředu."""
+
+
+def digest(data) -> bytes:
+    """Krátký hash bloku (blake2b-128), pro porovnání stačí a je rychlý."""
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def _hash_at(fd: int, off: int, n: int) -> bytes:
+    """Hash n bajtů cíle od off (kratší čtení na konci zařízení → jiný hash)."""
+    return digest(os.pread(fd, n, off))
+
+
+class c_delta_writer:
+    """Cíl pro pipeline / pgunzip: blok zapíše jen pokud se jeho hash liší od cíle.
+
+    Bloky cíle se hashují v poolu vláken s předstihem PREFETCH × workers bloků.
+    """
+
+    def __init__(self, fd: int, chunk: int = CHUNK, workers: int | None = None,
+                 dryRun: bool = False, limit: int | None = None) -> None:
+        """
+        Args:
+            fd: cíl otevřený O_RDWR (u dry-run stačí O_RDONLY)
+            limit: velikost cíle, bloky za koncem se nehashují (zápis by selhal)
+        """
+        self.fd = fd
+        self.chunk = chunk
+        self.dryRun = dryRun
+        self.limit = limit
+        self.workers = workers or os.cpu_count() or 1
+        self.pos = 0
+        self.written = 0
+        self.ranges: list[list[int]] = []
+        self._buf = bytearray()
+        self._ex = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="delta")
+        self._ahead: deque[tuple[int, Future]] = deque()
+        self._next = 0
+
+    def _prefetch(self) -> None:
+        depth = self.workers * PREFETCH
+        while len(self._ahead) < depth and (self.limit is None or self._next < self.limit):
+            n = self.chunk if self.limit is None else min(self.chunk, self.limit - self._next)
+            self._ahead.append((self._next, self._ex.submit(_hash_at, self.fd, self._next, n)))
+            self._next += n
+
+    def _target_hash(self, off: int, n: int) -> bytes | None:
+        self._prefetch()
+        while self._ahead and self._ahead[0][0] < off:
+            self._ahead.popleft()
+        if self._ahead and self._ahead[0][0] == off:
+            fut = self._ahead.popleft()[1]
+            h = fut.result()
+            # poslední (kratší) blok zdroje – předčtený hash je pro celý blok cíle
+            return h if n == self.chunk or self.limit == off + n else _hash_at(self.fd, off, n)
+        return None
+
+    def _block(self, mv: memoryview) -> None:
+        n = len(mv)
+        off = self.pos
+        if self.limit is not None and off + n > self.limit:
+            raise RuntimeError(f"Obraz je větší než cíl ({self.limit} B)")
+        if self._target_hash(off, n) != digest(mv):
+            if self.ranges and self.ranges[-1][0] + self.ranges[-1][1] == off:
+                self.ranges[-1][1] += n
+            else:
+                self.ranges.append([off, n])
+            if not self.dryRun:
+                throttle.consume(n)
+                done = 0
+                while done < n:
+                    done += os.pwrite(self.fd, mv[done:], off + done)
+            self.written += n
+        self.pos += n
+
+    def write(self, data) -> int:
+        mv = memoryview(data)
+        n = len(mv)
+        if not self._buf and n == self.chunk:
+            self._block(mv)
+            return n
+        self._buf += mv
+        while len(self._buf) >= self.chunk:
+            self._block(memoryview(self._buf)[:self.chunk])
+            del self._buf[:self.chunk]
+        return n
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        """Zpracuje zbytek posledního bloku a ukončí pool."""
+        try:
+            if self._buf:
+                self._block(memoryview(bytes(self._buf)))
+                self._buf.clear()
+        finally:
+            self._ex.shutdown(wait=True, cancel_futures=True)
+
+
+def print_progress(done: int, total: int | None, rate: float, extra) -> None:
+    """Výchozí výpis průběhu na jeden řádek."""
+    pct = f"{done * 100 / total:5.1f}%" if total else "  ?  "
+    sys.stdout.write(f"\r[DELTA] {done / 1024 / 1024 / 1024:8.2f} GiB {pct}  {rate / 1024 / 1024:7.1f} MB/s ")
+    sys.stdout.flush()
+
+
+def delta_restore(image: str | Path, dev: str, dryRun: bool = False, chunk: int = CHUNK,
+                  workers: int | None = None,
+                  progress: Optional[Callable[[int, int | None, float, str], None]] = print_progress) -> dict:
+    """Obnoví .img / .img.gz na dev, zapíše jen bloky, které se liší.
+
+    image může být i "-" (stdin), roura nebo sada svazků (libs/streams).
+
+    Args:
+        dryRun: nic nezapisovat, jen zjistit rozdílné rozsahy
+        chunk: velikost bloku (musí dělit pipeline.BLOCK_SIZE nebo být jeho násobkem)
+    Returns:
+        dict: {"bytes", "written", "ranges": [(offset, délka)], "seconds", "dry_run"}
+    """
+    image = Path(image)
+    t0 = time.monotonic()
+    fd = os.open(dev, os.O_RDONLY if dryRun else os.O_RDWR)
+    try:
+        limit = os.lseek(fd, 0, os.SEEK_END)
+        w = c_delta_writer(fd, chunk, workers, dryRun, limit)
+        try:
+            size = streams.size(image)
+            with streams.open_source(image) as fi:
+                if streams.is_gzip(image, fi):
+                    stats = pgunzip.decompress_stream(fi, w, size, workers, progress=progress)
+                    total = stats["bytes_out"]
+                else:
+                    if size is not None and size > limit:
+                        raise RuntimeError(f"Obraz {image} ({size} B) je větší než {dev} ({limit} B)")
+                    total = pipeline.run(fi, w, size, progress=progress)["bytes"]
+        finally:
+            w.close()
+        if not dryRun and w.written:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+    return {
+        "bytes": total,
+        "written": w.written,
+        "ranges": [tuple(r) for r in w.ranges],
+        "seconds": time.monotonic() - t0,
+        "dry_run": dryRun,
+    }
+
+
+def print_report(res: dict, maxRanges: int = 50) -> None:
+    """Vypíše souhrn delta restore, u dry-run i rozdílné rozsahy."""
+    secs = res["seconds"] or 1e-9
+    pct = res["written"] * 100 / res["bytes"] if res["bytes"] else 0.0
+    verb = "by se zapsalo" if res["dry_run"] else "zapsáno"
+    print(f"[DELTA] Porovnáno {res['bytes'] / 1024 / 1024:.0f} MiB za {secs:.1f} s, "
+          f"{verb} {res['written'] / 1024 / 1024:.0f} MiB ({pct:.1f} %) v {len(res['ranges'])} rozsazích")
+    if res["dry_run"]:
+        for off, n in res["ranges"][:maxRanges]:
+            print(f"  {off:>14} – {off + n:<14} ({n / 1024 / 1024:.1f} MiB)")
+        if len(res["ranges"]) > maxRanges:
+            print(f"  ... a dalších {len(res['ranges']) - maxRanges} rozsahů")
@@ -0,0 +1,190 @@
+"""
+Přímé klonování disku na disk (bez mezisouboru)
+
+  - čtení, SHA256 a zápis běží souběžně (libs/pipeline)
+  - nulové bloky se na cíl nezapisují, pokud tam nuly už jsou (zero-skip) –
+    šetří zápisy na flash a čas u z větší části prázdných karet
+  - --parts-only zkopíruje jen layout (sfdisk) a obsah partition, ne volné místo
+  - na konci se cíl přečte zpět a porovná se SHA256 zdroje
+"""
+import os
+from pathlib import Path
+from typing import Callable, Optional
+
+import libs.toolhelp as th
+from . import pagecache
+from . import pipeline
+from . import throttle
+
+
+class c_zero_skip_writer:
+    """Cíl pro pipeline: nulový blok zapíše jen pokud na cíli nuly nejsou.
+
+    Přečíst blok z karty je výrazně rychlejší (a šetrnější) než ho zapsat.
+    """
+
+    def __init__(self, fd: int, zeroSkip: bool = True) -> None:
+        self.fd = fd
+        self.zeroSkip = zeroSkip
+        self.pos = 0
+        self.skipped = 0
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def write(self, mv: memoryview) -> int:
+        n = len(mv)
+        if self.zeroSkip and pipeline.is_zero(mv):
+            old = os.pread(self.fd, n, self.pos)
+            if len(old) == n and pipeline.is_zero(memoryview(old)):
+                self.pos += n
+                self.skipped += n
+                return n
+        done = 0
+        while done < n:
+            done += os.pwrite(self.fd, mv[done:], self.pos + done)
+        self.pos += n
+        return n
+
+
+def _dev(name: str) -> str:
+    return name if name.startswith("/dev/") else f"/dev/{name}"
+
+
+def _sha_of(dev: str, size: int, progress=pipeline.print_progress) -> str:
+    """SHA256 prvních size bajtů zařízení."""
+    sha = pipeline.c_sha256()
+    with open(dev, "rb", buffering=0) as f:
+        pipeline.run(_limited(f, size), None, size, [sha], progress=progress)
+    return sha.hexdigest()
+
+
+class _limited:
+    """readinto omezený na prvních size bajtů (cíl může být větší než zdroj)."""
+
+    def __init__(self, f, size: int) -> None:
+        self.f = f
+        self.left = size
+
+    def fileno(self) -> int:
+        return self.f.fileno()
+
+    def readinto(self, buf) -> int:
+        if self.left <= 0:
+            return 0
+        mv = memoryview(buf)
+        if len(mv) > self.left:
+            mv = mv[:self.left]
+        n = self.f.readinto(mv)
+        self.left -= n or 0
+        return n
+
+
+def copy_device(src: str, dst: str, size: int | None = None, zeroSkip: bool = True, verify: bool = True,
+                progress: Optional[Callable[[int, int | None, float, str], None]] = pipeline.print_progress) -> dict:
+    """Zkopíruje zařízení src na dst přes pipeline s hashem a zero-skip.
+
+    Args:
+        size: kolik bajtů kopírovat (default celý zdroj)
+    Returns:
+        dict: {"bytes", "sha256", "skipped", "seconds", "verified": bool | None}
+    """
+    sha = pipeline.c_sha256()
+    fo = os.open(dst, os.O_RDWR)
+    try:
+        with open(src, "rb", buffering=0) as fi:
+            if size is None:
+                size = os.lseek(fi.fileno(), 0, os.SEEK_END)
+                os.lseek(fi.fileno(), 0, os.SEEK_SET)
+            w = c_zero_skip_writer(fo, zeroSkip)
+            with throttle.cgroup_limit([src, dst]), pagecache.read_ahead(src):
+                stats = pipeline.run(_limited(fi, size), w, size, [sha], progress=progress)
+        os.fsync(fo)
+    finally:
+        os.close(fo)
+    res = {"bytes": stats["bytes"], "sha256": sha.hexdigest(), "skipped": w.skipped,
+           "seconds": stats["seconds"], "verified": None}
+    if verify:
+        # ať se čte z karty, ne z page cache
+        th.run(["blockdev", "--flushbufs", dst])
+        print(f"[CLONE] Ověření {dst} zpětným čtením")
+        res["verified"] = _sha_of(dst, size, progress) == res["sha256"]
+    return res
+
+
+def _pttype(dev: str) -> str:
+    try:
+        return th.check_output(["blkid", "-o", "value", "-s", "PTTYPE", dev]).decode().strip()
+    except Exception:
+        return ""
+
+
+def clone_disk(srcDisk: str, dstDisk: str, partsOnly: bool = False, zeroSkip: bool = True,
+               verify: bool = True) -> list[dict]:
+    """Naklonuje disk srcDisk na dstDisk (bez dotazů – potvrzení řeší volající).
+
+    Args:
+        partsOnly: zkopírovat jen layout a partition (ne nealokované místo)
+    Returns:
+        list[dict]: výsledek copy_device pro disk nebo pro každou partition ("dev" navíc)
+    """
+    src, dst = _dev(srcDisk), _dev(dstDisk)
+    sname, dname = os.path.basename(src), os.path.basename(dst)
+    if sname == dname:
+        raise ValueError("Zdroj a cíl klonu nesmí být stejný disk")
+    used = th.disk_in_use(dname)
+    if used:
+        raise RuntimeError(f"Cílový disk {dst} se používá: {', '.join(used)}")
+
+    srcSize, dstSize = th.disk_size(sname), th.disk_size(dname)
+    results: list[dict] = []
+    # zámky v pořadí podle jména, ať se dva klony navzájem nezablokují
+    first, second = sorted([sname, dname])
+    with th.device_lock(first), th.device_lock(second):
+        if not partsOnly:
+            if dstSize < srcSize:
+                raise RuntimeError(f"Cíl {dst} ({dstSize} B) je menší než zdroj {src} ({srcSize} B)")
+            print(f"[CLONE] {src} → {dst} ({srcSize} B)")
+            r = copy_device(src, dst, srcSize, zeroSkip, verify)
+            r["dev"] = dst
+            results.append(r)
+            if dstSize > srcSize and _pttype(src) == "gpt":
+                # záložní GPT hlavička musí být na konci většího disku
+                th.run(["sgdisk", "-e", dst])
+            th.run(["partprobe", dst])
+        else:
+            parts = th.partitions_of(sname)
+            if not parts:
+                raise RuntimeError(f"Disk {src} nemá žádné partition")
+            # konec poslední partition musí být na cíli
+            end = max((int(Path(f"/sys/block/{sname}/{p}/start").read_text()) +
+                       int(Path(f"/sys/block/{sname}/{p}/size").read_text())) * 512 for p in parts.values())
+            if dstSize < end:
+                raise RuntimeError(f"Cíl {dst} ({dstSize} B) je menší než konec poslední partition ({end} B)")
+            print(f"[CLONE] Layout {src} → {dst}")
+            layout = th.check_output(["sfdisk", "-d", src])
+            th.run(["sfdisk", dst], input_bytes=layout)
+            th.run(["partprobe", dst])
+            dparts = th.partitions_of(dname)
+            for num, pname in parts.items():
+                if num not in dparts:
+                    raise RuntimeError(f"Na cíli chybí partition {num} po zápisu layoutu")
+                print(f"[CLONE] /dev/{pname} → /dev/{dparts[num]}")
+                r = copy_device(f"/dev/{pname}", f"/dev/{dparts[num]}", None, zeroSkip, verify)
+                r["dev"] = f"/dev/{dparts[num]}"
+                results.append(r)
+    return results
+
+
+def print_summary(results: list[dict]) -> bool:
+    """Vypíše souhrn klonu, vrátí True pokud vše ověřeno (nebo se neověřovalo)."""
+    ok = True
+    for r in results:
+        secs = r["seconds"] or 1e-9
+        ver = {True: "OK", False: "NESEDÍ", None: "-"}[r["verified"]]
+        print(f"[CLONE] {r['dev']}: {r['bytes'] / 1024 / 1024:.0f} MiB za {secs:.1f} s "
+              f"({r['bytes'] / secs / 1024 / 1024:.1f} MB/s), přeskočeno nul {r['skipped'] / 1024 / 1024:.0f} MiB, "
+              f"ověření {ver}")
+        if r["verified"] is False:
+            ok = False
+    return ok
@@ -0,0 +1,309 @@
+"""
+Headless daemon pro zálohy s lokálním Unix-socket API
+
+Daemon běží trvale (typicky jako root přes systemd), přijímá úlohy
+backup / bkpart / restore / verify ve formátu JSON, spouští je na poolu
+workerů a drží historii. CLI/TUI jsou pak jen tencí klienti – odpadá
+start Pythonu a detekce zařízení pro každou úlohu.
+
+Protokol: jeden JSON objekt na řádek, odpověď také jeden řádek JSON.
+
+    {"op": "ping"}
+    {"op": "submit", "job": {"mode": "backup", "disk": "sdb", "dest": "/var/backups", "compress": "adaptive"}}
+    {"op": "list"}
+    {"op": "status", "id": 3}
+    {"op": "cancel", "id": 3}
+    {"op": "watch", "id": 3}     → proud {"event": "progress", ...} až po {"event": "done", ...}
+    {"op": "history", "limit": 50}
+
+Úloha má stejný formát jako v job souboru dávky (viz libs/batch.py).
+Zrušení je kooperativní: vestavěné smyčky se přeruší na hranici bloku,
+externí nástroje (dd, gzip) doběhnou a úloha se pak označí jako zrušená.
+"""
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator
+
+import libs.toolhelp as th
+import libs.glb as glb
+from . import batch
+
+
+class c_djob:
+    """Úloha v daemonu: specifikace, stav a průběh."""
+
+    def __init__(self, jid: int, spec: dict) -> None:
+        self.id = jid
+        self.spec = spec
+        self.job = batch.c_job(jid, spec)
+        self.state = "queued"
+        self.done = 0
+        self.total: int | None = None
+        self.created = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.cancel = threading.Event()
+        self.changed = threading.Condition()
+        self._lastNotify = 0.0
+
+    def progress(self, done: int, total: int | None) -> None:
+        """Callback předávaný do datových smyček, zároveň kontrola zrušení."""
+        if self.cancel.is_set():
+            raise batch.JobCancelled(f"Úloha {self.id} zrušena")
+        self.done = done
+        self.total = total
+        now = time.monotonic()
+        # watchery budíme max. 4× za sekundu
+        if now - self._lastNotify >= 0.25:
+            self._lastNotify = now
+            with self.changed:
+                self.changed.notify_all()
+
+    def finish(self, state: str) -> None:
+        self.state = state
+        with self.changed:
+            self.changed.notify_all()
+
+    def info(self) -> dict:
+        r = self.job.report()
+        r.update({"id": self.id, "state": self.state, "done": self.done, "total": self.total,
+                  "created": self.created})
+        return r
+
+
+class c_daemon:
+    """Fronta úloh, worker pool a historie."""
+
+    def __init__(self, workers: int = 2, historyFile: str | Path = glb.DAEMON_HISTORY) -> None:
+        self.pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="imgtoold")
+        self.jobs: dict[int, c_djob] = {}
+        self.historyFile = Path(historyFile)
+        self._lock = threading.Lock()
+        self._nextId = 1
+
+    def submit(self, spec: dict) -> c_djob:
+        with self._lock:
+            jid = self._nextId
+            self._nextId += 1
+            dj = c_djob(jid, spec)
+            self.jobs[jid] = dj
+        self.pool.submit(self._run, dj)
+        print(f"[DAEMON] #{jid} přijata: {dj.job.mode} {dj.job.disk or dj.job.file}")
+        return dj
+
+    def _run(self, dj: c_djob) -> None:
+        job = dj.job
+        if dj.cancel.is_set():
+            dj.finish("cancelled")
+            self._save_history(dj)
+            return
+        job.started = time.monotonic()
+        dj.finish("running")
+        try:
+            if job.disk:
+                # na zámek disku čekáme – jiná úloha/proces s ním právě pracuje
+                with th.device_lock(job.disk, wait=True):
+                    job.output = batch.run_job(job, progress=dj.progress)
+            else:
+                job.output = batch.run_job(job, progress=dj.progress)
+            job.status = "ok"
+        except batch.JobCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            job.status = "failed"
+            job.error = f"{type(e).__name__}: {e}"
+        finally:
+            if dj.cancel.is_set() and job.status == "ok":
+                # externí nástroj doběhl, ale uživatel úlohu mezitím zrušil
+                job.status = "cancelled"
+            job.finished = time.monotonic()
+            dj.finish(job.status)
+            self._save_history(dj)
+            print(f"[DAEMON] #{dj.id} {job.status}" + (f": {job.error}" if job.error else ""))
+
+    def _save_history(self, dj: c_djob) -> None:
+        try:
+            self.historyFile.parent.mkdir(parents=True, exist_ok=True)
+            rec = dj.info()
+            rec["finished_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            with self.historyFile.open("a", encoding="utf-8") as f:
+                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"[DAEMON] Nelze zapsat historii {self.historyFile}: {e}")
+
+    def history(self, limit: int = 50) -> list[dict]:
+        if not self.historyFile.exists():
+            return []
+        lines = self.historyFile.read_text(encoding="utf-8").splitlines()
+        return [json.loads(x) for x in lines[-limit:] if x.strip()]
+
+    def cancel(self, jid: int) -> c_djob:
+        dj = self.jobs.get(jid)
+        if dj is None:
+            raise KeyError(f"Úloha {jid} neexistuje")
+        dj.cancel.set()
+        return dj
+
+    def watch(self, jid: int) -> Iterator[dict]:
+        dj = self.jobs.get(jid)
+        if dj is None:
+            raise KeyError(f"Úloha {jid} neexistuje")
+        while True:
+            info = dj.info()
+            if dj.state in ("ok", "failed", "cancelled"):
+                info["event"] = "done"
+                yield info
+                return
+            info["event"] = "progress"
+            yield info
+            with dj.changed:
+                dj.changed.wait(1.0)
+
+    def handle(self, req: dict) -> Iterator[dict]:
+        """Zpracuje jeden požadavek, vrací jednu nebo více odpovědí."""
+        op = req.get("op")
+        if op == "ping":
+            yield {"ok": True, "pid": os.getpid(), "version": glb.VERSION}
+        elif op == "submit":
+            dj = self.submit(req.get("job") or {})
+            yield {"ok": True, "id": dj.id}
+        elif op == "list":
+            yield {"ok": True, "jobs": [dj.info() for dj in self.jobs.values()]}
+        elif op == "status":
+            dj = self.jobs.get(int(req.get("id", 0)))
+            if dj is None:
+                yield {"ok": False, "error": f"Úloha {req.get('id')} neexistuje"}
+            else:
+                yield {"ok": True, "job": dj.info()}
+        elif op == "cancel":
+            dj = self.cancel(int(req.get("id", 0)))
+            yield {"ok": True, "id": dj.id, "state": dj.state}
+        elif op == "watch":
+            for ev in self.watch(int(req.get("id", 0))):
+                ev["ok"] = True
+                yield ev
+        elif op == "history":
+            yield {"ok": True, "jobs": self.history(int(req.get("limit", 50)))}
+        else:
+            yield {"ok": False, "error": f"Neznámá operace: {op}"}
+
+
+class _handler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        daemon: c_daemon = self.server.jobd  # type: ignore[attr-defined]
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                for resp in daemon.handle(json.loads(line)):
+                    self.wfile.write((json.dumps(resp, ensure_ascii=False) + "\n").encode("utf-8"))
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            except Exception as e:
+                resp = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                self.wfile.write((json.dumps(resp, ensure_ascii=False) + "\n").encode("utf-8"))
+                self.wfile.flush()
+
+
+class _server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(sockPath: str = glb.DAEMON_SOCK, workers: int = 2) -> None:
+    """Spustí daemon a obsluhuje socket do přerušení (Ctrl+C / SIGTERM)."""
+    sp = Path(sockPath)
+    if sp.exists():
+        # ověříme, že neběží jiný daemon, a smažeme starý socket
+        try:
+            request({"op": "ping"}, sockPath)
+            raise RuntimeError(f"Daemon už běží na {sockPath}")
+        except (ConnectionRefusedError, FileNotFoundError):
+            sp.unlink()
+    sp.parent.mkdir(parents=True, exist_ok=True)
+    old = os.umask(0o077)
+    try:
+        srv = _server(str(sp), _handler)
+    finally:
+        os.umask(old)
+    srv.jobd = c_daemon(workers)  # type: ignore[attr-defined]
+    print(f"[DAEMON] Naslouchám na {sockPath}, workerů: {workers}")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.server_close()
+        sp.unlink(missing_ok=True)
+        print("[DAEMON] Ukončen.")
+
+
+# ============================================================
+# Klient
+# ============================================================
+
+def _connect(sockPath: str) -> socket.socket:
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.connect(sockPath)
+    return s
+
+
+def stream(req: dict, sockPath: str = glb.DAEMON_SOCK) -> Iterator[dict]:
+    """Pošle požadavek a vrací odpovědi, dokud daemon spojení neukončí odpovědí 'done'."""
+    with _connect(sockPath) as s:
+        s.sendall((json.dumps(req) + "\n").encode("utf-8"))
+        f = s.makefile("rb")
+        for line in f:
+            resp = json.loads(line)
+            yield resp
+            if req.get("op") != "watch" or resp.get("event") == "done" or not resp.get("ok", True):
+                return
+
+
+def request(req: dict, sockPath: str = glb.DAEMON_SOCK) -> dict:
+    """Pošle požadavek a vrátí jednu odpověď."""
+    return next(stream(req, sockPath))
+
+
+def submit_and_watch(spec: dict, sockPath: str = glb.DAEMON_SOCK) -> dict:
+    """Odešle úlohu daemonu a vypisuje průběh až do konce, vrátí závěrečný stav."""
+    r = request({"op": "submit", "job": spec}, sockPath)
+    if not r.get("ok"):
+        raise RuntimeError(f"Daemon úlohu odmítl: {r.get('error')}")
+    jid = r["id"]
+    print(f"[CLIENT] Úloha #{jid} odeslána daemonu.")
+    last: dict = {}
+    try:
+        for ev in stream({"op": "watch", "id": jid}, sockPath):
+            last = ev
+            print_progress(ev)
+    except KeyboardInterrupt:
+        print(f"\n[CLIENT] Ruším úlohu #{jid}")
+        request({"op": "cancel", "id": jid}, sockPath)
+        raise
+    print()
+    return last
+
+
+def print_progress(ev: dict) -> None:
+    """Jednořádkový výpis průběhu úlohy."""
+    done = ev.get("done") or 0
+    total = ev.get("total")
+    pct = f"{done * 100 / total:5.1f}%" if total else "  ?  "
+    print(f"\r[#{ev.get('id')}] {ev.get('state'):<9} {done / 1024 / 1024:10.1f} MiB {pct}", end="", flush=True)
+
+
+def print_jobs(jobs: list[dict]) -> None:
+    """Vypíše tabulku úloh (list / history)."""
+    tit = f"{'ID':>4} | {'Režim':<7} | {'Disk':<8} | {'Stav':<9} | {'Vytvořeno':<19} | Výstup / chyba"
+    print(tit)
+    print("-" * len(tit))
+    for j in jobs:
+        info = j.get("output") if j.get("state") == "ok" else (j.get("error") or "")
+        print(f"{j.get('id', ''):>4} | {j.get('mode', ''):<7} | {j.get('disk') or '-':<8} | {j.get('state', ''):<9} | "
+              f"{j.get('created', ''):<19} | {info or ''}")
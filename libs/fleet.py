@@ -0,0 +1,270 @@
+"""
+Hromadné nahrání jednoho obrazu na více karet najednou (flash)
+
+Zdroj (.img nebo .img.gz) se čte a rozbaluje jen jednou, bloky se rozesílají
+do front jednotlivých karet a každá karta má vlastní zapisovací vlákno.
+Bloky jsou sdílené (stejný bytes objekt pro všechny karty), paměť tedy
+nezávisí na počtu karet.
+
+Pomalá karta brzdí ostatní jen do chvíle, než je vyřazena:
+  - nepřijme blok déle než STALL_TIMEOUT (zaseklá / odpojená karta)
+  - po zahřátí zapisuje pomaleji než SLOW_FACTOR × medián ostatních
+Chyba zápisu vyřadí jen danou kartu. Na konci se každá karta přečte zpět
+a porovná se SHA256 rozbaleného zdroje (paralelně).
+"""
+import os
+import queue
+import statistics
+import sys
+import threading
+import time
+from contextlib import ExitStack
+from pathlib import Path
+
+import libs.toolhelp as th
+from . import pgunzip
+from . import pipeline
+from . import throttle
+from .clone import _sha_of
+
+QUEUE_CHUNKS: int = 16
+"""Max. počet bloků ve frontě jedné karty."""
+
+STALL_TIMEOUT: float = 30.0
+"""Karta, která tak dlouho nepřijme blok, se vyřadí."""
+
+SLOW_FACTOR: float = 0.5
+"""Karta pomalejší než tento zlomek mediánu ostatních se vyřadí (0 = nevyřazovat)."""
+
+WARMUP: float = 15.0
+"""Po tuto dobu od startu se rychlost karet neposuzuje."""
+
+SYNC_TIMEOUT: float = 300.0
+"""Max. doba závěrečného fsync karty, pak se karta vyřadí."""
+
+
+class c_target:
+    """Jedna cílová karta: fronta bloků, zapisovací vlákno a stav."""
+
+    def __init__(self, disk: str) -> None:
+        self.disk = os.path.basename(disk)
+        self.dev = f"/dev/{self.disk}"
+        self.q: "queue.Queue[bytes | None]" = queue.Queue(maxsize=QUEUE_CHUNKS)
+        self.status = "pending"
+        self.error: str | None = None
+        self.written = 0
+        self.started = 0.0
+        self.finished: float | None = None
+        self.verified: bool | None = None
+        self.syncing = False
+        self.thread: threading.Thread | None = None
+        self._fd: int | None = None
+
+    @property
+    def alive(self) -> bool:
+        return self.status == "running"
+
+    def rate(self, now: float | None = None) -> float:
+        end = self.finished or now or time.monotonic()
+        return self.written / max(end - self.started, 1e-9)
+
+    def fail(self, status: str, error: str) -> None:
+        if self.status in ("running", "pending"):
+            self.status = status
+            self.error = error
+            print(f"\n[FLASH] {self.dev} vyřazena: {error}")
+        # uvolnit writer, pokud čeká na data
+        try:
+            self.q.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def start(self) -> None:
+        self._fd = os.open(self.dev, os.O_WRONLY)
+        self.status = "running"
+        self.started = time.monotonic()
+        self.thread = threading.Thread(target=self._writer, name=f"flash-{self.disk}", daemon=True)
+        self.thread.start()
+
+    def _writer(self) -> None:
+        try:
+            while self.alive:
+                data = self.q.get()
+                if data is None:
+                    break
+                mv = memoryview(data)
+                done = 0
+                while done < len(mv):
+                    done += os.write(self._fd, mv[done:])
+                self.written += len(data)
+            if self.alive:
+                self.syncing = True
+                os.fsync(self._fd)
+        except OSError as e:
+            self.fail("failed", f"chyba zápisu: {e}")
+        finally:
+            self.finished = time.monotonic()
+            os.close(self._fd)
+
+
+class c_fanout:
+    """Cíl pro pgunzip / čtecí smyčku: write() rozešle blok všem živým kartám."""
+
+    def __init__(self, targets: list[c_target], stallTimeout: float = STALL_TIMEOUT,
+                 slowFactor: float = SLOW_FACTOR) -> None:
+        self.targets = targets
+        self.stallTimeout = stallTimeout
+        self.slowFactor = slowFactor
+        self.sha = pipeline.c_sha256()
+        self.bytes = 0
+        self.t0 = time.monotonic()
+        self._lastPrint = 0.0
+
+    def _too_slow(self, t: c_target, now: float) -> bool:
+        if not self.slowFactor or now - self.t0 < WARMUP:
+            return False
+        others = [o.rate(now) for o in self.targets if o.alive and o is not t]
+        return bool(others) and t.rate(now) < self.slowFactor * statistics.median(others)
+
+    def _put(self, t: c_target, item: bytes | None) -> None:
+        """Vloží blok do fronty karty, zaseklou (nebo pomalou) kartu vyřadí."""
+        blocked = 0.0
+        while t.alive:
+            try:
+                t.q.put(item, timeout=1.0)
+                return
+            except queue.Full:
+                blocked += 1.0
+                now = time.monotonic()
+                if blocked >= self.stallTimeout:
+                    t.fail("dropped", f"nepřijala data {blocked:.0f} s")
+                elif item is not None and self._too_slow(t, now):
+                    t.fail("dropped", f"pomalá ({t.rate(now) / 1024 / 1024:.1f} MB/s)")
+
+    def write(self, data: bytes) -> int:
+        data = bytes(data)
+        self.sha(memoryview(data))
+        self.bytes += len(data)
+        for t in self.targets:
+            self._put(t, data)
+        if not any(t.alive for t in self.targets):
+            raise RuntimeError("Všechny cílové karty byly vyřazeny")
+        self.print_progress()
+        return len(data)
+
+    def finish(self) -> None:
+        for t in self.targets:
+            self._put(t, None)
+        for t in self.targets:
+            if t.thread is None:
+                continue
+            # čeká se, dokud karta zapisuje; bez pohybu déle než stallTimeout
+            # (u závěrečného fsync SYNC_TIMEOUT) se vyřadí
+            last, syncing, idle = t.written, t.syncing, 0.0
+            while t.alive and t.thread.is_alive():
+                t.thread.join(1.0)
+                if t.written != last or t.syncing != syncing:
+                    last, syncing, idle = t.written, t.syncing, 0.0
+                    continue
+                idle += 1.0
+                if idle >= (SYNC_TIMEOUT if syncing else self.stallTimeout):
+                    t.fail("dropped", f"nedokončila {'fsync' if syncing else 'zápis'} za {idle:.0f} s")
+            # zaseklá karta může viset v write() / fsync – na vyřazenou se nečeká
+            t.thread.join(1.0)
+            if t.status == "running":
+                t.status = "ok"
+
+    def print_progress(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._lastPrint < 1.0:
+            return
+        self._lastPrint = now
+        parts = []
+        for t in self.targets:
+            if t.alive:
+                parts.append(f"{t.disk} {t.written / 1024 / 1024:6.0f}M {t.rate(now) / 1024 / 1024:5.1f}MB/s")
+            else:
+                parts.append(f"{t.disk} {t.status}")
+        sys.stdout.write("\r[FLASH] " + " | ".join(parts) + " ")
+        sys.stdout.flush()
+
+
+def flash(image: str | Path, disks: list[str], verify: bool = True,
+          stallTimeout: float = STALL_TIMEOUT, slowFactor: float = SLOW_FACTOR) -> list[c_target]:
+    """Nahraje obraz na všechny disky najednou (bez dotazů – potvrzení řeší volající).
+
+    Returns:
+        list[c_target]: výsledek pro každou kartu (status ok | failed | dropped)
+    """
+    image = Path(image)
+    targets = [c_target(d) for d in dict.fromkeys(os.path.basename(d) for d in disks)]
+    with ExitStack() as stack:
+        for t in targets:
+            used = th.disk_in_use(t.disk)
+            if used:
+                t.status, t.error = "failed", f"používá se: {', '.join(used)}"
+                continue
+            try:
+                stack.enter_context(th.device_lock(t.disk, wait=False))
+                t.start()
+            except BlockingIOError:
+                t.status, t.error = "failed", "zamčená jiným procesem"
+            except OSError as e:
+                t.status, t.error = "failed", str(e)
+        if not any(t.alive for t in targets):
+            raise RuntimeError("Žádná cílová karta není k dispozici")
+
+        fan = c_fanout(targets, stallTimeout, slowFactor)
+        try:
+            with throttle.cgroup_limit([t.dev for t in targets if t.alive]):
+                if th.is_gzip(image):
+                    with image.open("rb") as fi:
+                        pgunzip.decompress_stream(fi, fan, progress=None)
+                else:
+                    with image.open("rb", buffering=0) as fi:
+                        while True:
+                            throttle.consume(pipeline.BLOCK_SIZE)
+                            data = fi.read(pipeline.BLOCK_SIZE)
+                            if not data:
+                                break
+                            fan.write(data)
+        finally:
+            fan.finish()
+            fan.print_progress(force=True)
+            print()
+
+        digest, size = fan.sha.hexdigest(), fan.bytes
+        if verify:
+            ok = [t for t in targets if t.status == "ok"]
+            print(f"[FLASH] Ověření zpětným čtením: {', '.join(t.disk for t in ok)}")
+
+            def check(t: c_target) -> None:
+                try:
+                    th.run(["blockdev", "--flushbufs", t.dev])
+                    t.verified = _sha_of(t.dev, size, progress=None) == digest
+                except Exception as e:
+                    t.verified = False
+                    t.error = f"ověření selhalo: {e}"
+                if not t.verified:
+                    t.status = "failed"
+                    t.error = t.error or "SHA256 nesedí"
+
+            threads = [threading.Thread(target=check, args=(t,), name=f"verify-{t.disk}") for t in ok]
+            for th_ in threads:
+                th_.start()
+            for th_ in threads:
+                th_.join()
+    return targets
+
+
+def print_report(targets: list[c_target]) -> None:
+    """Vypíše výsledek pro každou kartu."""
+    tit = f"{'Disk':<10} | {'Stav':<8} | {'Zapsáno':>10} | {'MB/s':>6} | {'Ověřeno':<7} | Chyba"
+    print(tit)
+    print("-" * len(tit))
+    for t in targets:
+        ver = {True: "OK", False: "NESEDÍ", None: "-"}[t.verified]
+        rate = f"{t.rate() / 1024 / 1024:.1f}" if t.started else "-"
+        print(f"{t.disk:<10} | {t.status:<8} | {t.written / 1024 / 1024:8.0f} M | {rate:>6} | {ver:<7} | {t.error or ''}")
+    ok = sum(1 for t in targets if t.status == "ok")
+    print(f"Hotovo: {ok}/{len(targets)} karet v pořádku.")
@@ -4,4 +4,13 @@ MNT_DIR:str = "/mnt"
 """Výchozí adresář pro mountpointy."""
 
 MENU_WIDTH:int = 80
-"""Šířka menu."""
\ No newline at end of file
+"""Šířka menu."""
+
+DAEMON_SOCK:str = "/run/imgtool.sock"
+"""Unix socket daemonu (imgtool daemon)."""
+
+DAEMON_HISTORY:str = "/var/lib/imgtool/jobs.jsonl"
+"""Historie dokončených úloh daemonu (JSON lines)."""
+
+CATALOG_DB:str = "/var/lib/imgtool/catalog.db"
+"""SQLite katalog záloh (imgtool catalog)."""
@@ -0,0 +1,273 @@
+"""
+Čtení tabulky oddílů (GPT, záložně MBR) přímo z obrazu nebo zařízení
+
+Bez sfdisk / parted – stačí funkce read_at(offset, délka), takže jde číst
+i z obrazu, který se právě rozbaluje (stačí mít začátek), nebo z části souboru.
+Všechny offsety a velikosti ve výsledku jsou v bajtech.
+"""
+import os
+import re
+import struct
+import uuid
+import zlib
+from pathlib import Path
+from typing import Callable
+
+SECTOR: int = 512
+"""Výchozí velikost sektoru (obrazy SD karet / USB disků)."""
+
+GPT_SIGNATURE = b"EFI PART"
+
+_HDR = struct.Struct("<8sIIIIQQQQ16sQIII")
+_ENTRY = struct.Struct("<16s16sQQQ72s")
+
+
+def _guid(raw: bytes) -> str:
+    return str(uuid.UUID(bytes_le=raw)).upper()
+
+
+def parse(read_at: Callable[[int, int], bytes], sector: int | None = None) -> dict | None:
+    """Přečte tabulku oddílů.
+
+    Args:
+        read_at: funkce (offset, délka) -> bytes
+        sector: velikost sektoru, None = zkusit 512 a 4096
+    Returns:
+        dict | None: {"type": "gpt" | "dos", "sector", "disk_guid", "first_lba", "last_lba",
+            "parts": [{"num", "start", "size", "type", "guid", "name", "attrs"}]}, None = bez tabulky
+    """
+    for sec in ([sector] if sector else [SECTOR, 4096]):
+        res = _parse_gpt(read_at, sec)
+        if res:
+            return res
+    return _parse_mbr(read_at)
+
+
+def _parse_gpt(read_at: Callable[[int, int], bytes], sec: int) -> dict | None:
+    raw = read_at(sec, sec)
+    if len(raw) < _HDR.size or raw[:8] != GPT_SIGNATURE:
+        return None
+    (sig, rev, hdrSize, hdrCrc, _res, myLba, altLba, firstLba, lastLba,
+     diskGuid, entLba, entCount, entSize, entCrc) = _HDR.unpack_from(raw)
+    hdr = bytearray(raw[:hdrSize])
+    hdr[16:20] = b"\0\0\0\0"
+    if zlib.crc32(hdr) != hdrCrc:
+        return None
+    table = read_at(entLba * sec, entCount * entSize)
+    if len(table) < entCount * entSize or zlib.crc32(table) != entCrc:
+        return None
+    parts = []
+    for i in range(entCount):
+        typ, guid, first, last, attrs, name = _ENTRY.unpack_from(table, i * entSize)
+        if typ == b"\0" * 16:
+            continue
+        parts.append({
+            "num": i + 1,
+            "start": first * sec,
+            "size": (last - first + 1) * sec,
+            "type": _guid(typ),
+            "guid": _guid(guid),
+            "name": name.decode("utf-16-le", errors="replace").rstrip("\0"),
+            "attrs": attrs,
+        })
+    return {
+        "type": "gpt",
+        "sector": sec,
+        "disk_guid": _guid(diskGuid),
+        "first_lba": firstLba,
+        "last_lba": lastLba,
+        "parts": parts,
+    }
+
+
+def _parse_mbr(read_at: Callable[[int, int], bytes]) -> dict | None:
+    mbr = read_at(0, SECTOR)
+    if len(mbr) < SECTOR or mbr[510:512] != b"\x55\xaa":
+        return None
+    parts = []
+    for i in range(4):
+        boot, _chs1, ptype, _chs2, lba, count = struct.unpack_from("<B3sB3sII", mbr, 446 + i * 16)
+        if ptype == 0 or count == 0:
+            continue
+        if ptype == 0xEE:
+            # ochranné MBR bez platné GPT – tabulka je poškozená
+            return None
+        parts.append({
+            "num": i + 1,
+            "start": lba * SECTOR,
+            "size": count * SECTOR,
+            "type": f"0x{ptype:02x}",
+            "guid": None,
+            "name": "",
+            "attrs": 0,
+        })
+    if not parts:
+        return None
+    return {"type": "dos", "sector": SECTOR, "disk_guid": None, "first_lba": None,
+            "last_lba": None, "parts": parts}
+
+
+def read_table(path: str | Path) -> dict | None:
+    """Tabulka oddílů souboru obrazu nebo blokového zařízení (viz parse)."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return parse(lambda off, n: os.pread(fd, n, off))
+    finally:
+        os.close(fd)
+
+
+def part_at(table: dict | None, off: int) -> dict | None:
+    """Partition, do které spadá bajtový offset, None = mimo partition (tabulka, volné místo)."""
+    if not table:
+        return None
+    for p in table["parts"]:
+        if p["start"] <= off < p["start"] + p["size"]:
+            return p
+    return None
+
+
+_ATTR_NAMES = {0: "RequiredPartition", 1: "NoBlockIOProtocol", 2: "LegacyBIOSBootable"}
+
+
+def _attrs_text(attrs: int) -> str:
+    names = [_ATTR_NAMES[b] for b in sorted(_ATTR_NAMES) if attrs >> b & 1]
+    guid = [str(b) for b in range(48, 64) if attrs >> b & 1]
+    if guid:
+        names.append("GUID:" + ",".join(guid))
+    return " ".join(names)
+
+
+def _attrs_value(text: str) -> int:
+    bits = {v: k for k, v in _ATTR_NAMES.items()}
+    attrs = 0
+    for tok in text.split():
+        if tok.startswith("GUID:"):
+            for b in tok[5:].split(","):
+                attrs |= 1 << int(b)
+        elif tok in bits:
+            attrs |= 1 << bits[tok]
+    return attrs
+
+
+def sfdisk_dump(table: dict, device: str) -> str:
+    """Layout ve formátu `sfdisk -d` (layout.gpt smart zálohy) z tabulky z parse().
+
+    Args:
+        device: jméno zařízení / obrazu, partition se jmenují <device><num>
+    """
+    if table["type"] != "gpt":
+        raise ValueError("sfdisk_dump umí jen GPT")
+    sec = table["sector"]
+    out = [
+        "label: gpt",
+        f"label-id: {table['disk_guid']}",
+        f"device: {device}",
+        "unit: sectors",
+        f"first-lba: {table['first_lba']}",
+        f"last-lba: {table['last_lba']}",
+        f"sector-size: {sec}",
+        "",
+    ]
+    for p in table["parts"]:
+        line = (f"{device}{p['num']} : start={p['start'] // sec:>12}, size={p['size'] // sec:>12}, "
+                f"type={p['type']}, uuid={p['guid']}")
+        if p["name"]:
+            line += f', name="{p["name"]}"'
+        if _attrs_text(p.get("attrs") or 0):
+            line += f', attrs="{_attrs_text(p["attrs"])}"'
+        out.append(line)
+    return "\n".join(out) + "\n"
+
+
+def parse_sfdisk(text: str) -> dict:
+    """Tabulka z layoutu ve formátu `sfdisk -d` (layout.gpt), stejný tvar jako parse().
+
+    Raises:
+        ValueError: nejde o GPT layout nebo má neznámý formát
+    """
+    head: dict[str, str] = {}
+    parts = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if " : " not in line:
+            key, _, val = line.partition(":")
+            head[key.strip()] = val.strip()
+            continue
+        name, _, spec = line.partition(" : ")
+        fields = {}
+        for m in re.finditer(r'(\w[\w-]*)=("[^"]*"|[^,]*)', spec):
+            fields[m.group(1)] = m.group(2).strip().strip('"')
+        num = re.search(r"(\d+)$", name.strip())
+        if not num or "start" not in fields or "size" not in fields:
+            raise ValueError(f"Neznámý řádek layoutu: {line}")
+        parts.append({"num": int(num.group(1)), "start": int(fields["start"]), "size": int(fields["size"]),
+                      "type": str(uuid.UUID(fields["type"])).upper(),
+                      "guid": str(uuid.UUID(fields["uuid"])).upper() if fields.get("uuid") else None,
+                      "name": fields.get("name", ""), "attrs": _attrs_value(fields.get("attrs", ""))})
+    if head.get("label") != "gpt":
+        raise ValueError("Layout není GPT (label: gpt)")
+    sec = int(head.get("sector-size", SECTOR))
+    for p in parts:
+        p["start"] *= sec
+        p["size"] *= sec
+    return {
+        "type": "gpt",
+        "sector": sec,
+        "disk_guid": head.get("label-id", "").upper() or None,
+        "first_lba": int(head["first-lba"]) if "first-lba" in head else None,
+        "last_lba": int(head["last-lba"]) if "last-lba" in head else None,
+        "parts": sorted(parts, key=lambda p: p["num"]),
+    }
+
+
+ENTRIES: int = 128
+"""Počet položek tabulky při zápisu (standardní GPT)."""
+
+
+def table_sectors(sector: int = SECTOR) -> int:
+    """Sektorů, které zabere pole položek (128 × 128 B)."""
+    return ENTRIES * _ENTRY.size // sector
+
+
+def write(fd: int, table: dict, diskSize: int) -> None:
+    """Zapíše ochranné MBR, primární i záložní GPT pro disk / obraz velikosti diskSize.
+
+    last_lba se přepočítá podle diskSize, chybějící GUID disku a partition se vygenerují.
+    Z MBR se přepíše jen tabulka oddílů (ochranná položka) a signatura, bajty 0–445
+    (zavaděč, signatura disku) zůstanou.
+
+    Raises:
+        ValueError: partition se do disku nevejde
+    """
+    sec = table["sector"]
+    total = diskSize // sec
+    entSec = table_sectors(sec)
+    firstLba = max(table.get("first_lba") or 0, 2 + entSec)
+    lastLba = total - 2 - entSec
+    ents = bytearray(ENTRIES * _ENTRY.size)
+    for p in table["parts"]:
+        first, last = p["start"] // sec, (p["start"] + p["size"]) // sec - 1
+        if p["num"] > ENTRIES or first < firstLba or last > lastLba:
+            raise ValueError(f"Partition {p['num']} se do {diskSize} B nevejde (LBA {first}–{last}, max {lastLba})")
+        _ENTRY.pack_into(ents, (p["num"] - 1) * _ENTRY.size, uuid.UUID(p["type"]).bytes_le,
+                         uuid.UUID(p.get("guid") or str(uuid.uuid4())).bytes_le, first, last,
+                         p.get("attrs") or 0, (p.get("name") or "").encode("utf-16-le")[:72])
+    diskGuid = uuid.UUID(table.get("disk_guid") or str(uuid.uuid4())).bytes_le
+    entCrc = zlib.crc32(ents)
+
+    def header(myLba: int, altLba: int, entLba: int) -> bytes:
+        hdr = bytearray(_HDR.pack(GPT_SIGNATURE, 0x10000, _HDR.size, 0, 0, myLba, altLba, firstLba,
+                                  lastLba, diskGuid, entLba, ENTRIES, _ENTRY.size, entCrc))
+        struct.pack_into("<I", hdr, 16, zlib.crc32(hdr))
+        return bytes(hdr) + bytes(sec - len(hdr))
+
+    mbr = bytearray(66)
+    struct.pack_into("<B3sB3sII", mbr, 0, 0, b"\0\x02\0", 0xEE, b"\xff\xff\xff", 1, min(total - 1, 0xFFFFFFFF))
+    mbr[64:66] = b"\x55\xaa"
+    os.pwrite(fd, bytes(mbr), 446)
+    os.pwrite(fd, header(1, total - 1, 2), sec)
+    os.pwrite(fd, bytes(ents), 2 * sec)
+    os.pwrite(fd, bytes(ents), (total - 1 - entSec) * sec)
+    os.pwrite(fd, header(total - 1, 1, total - 1 - entSec), (total - 1) * sec)
@@ -0,0 +1,264 @@
+"""
+Rychlé porovnání dvou obrazů / zařízení (imgtool diff A B)
+
+  - obě strany se hashují po blocích souběžně, raw obrazy paralelně (pread)
+  - díry řídkého souboru (SEEK_DATA / SEEK_HOLE) se nečtou, jejich hash je
+    hash nulového bloku
+  - .img.gz se rozbaluje přes pgunzip a hashuje za běhu
+  - rozdílné rozsahy se promítnou na partition (libs/gpt) a u ext2/3/4 na
+    skupiny bloků (block groups) podle superbloku
+
+Výstup je čitelný výpis nebo JSON (--json).
+"""
+import bisect
+import errno
+import json
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import libs.toolhelp as th
+from . import chunkhash
+from . import gpt
+from . import pgunzip
+
+HEAD: int = 1024 * 1024
+"""Kolik bajtů začátku .gz obrazu se drží pro čtení tabulky oddílů."""
+
+EXT_MAGIC = 0xEF53
+
+
+def data_extents(fd: int, size: int) -> list[tuple[int, int]] | None:
+    """Rozsahy s daty (start, konec) podle SEEK_DATA/SEEK_HOLE, None = nelze zjistit (zařízení)."""
+    if not hasattr(os, "SEEK_DATA"):
+        return None
+    out = []
+    pos = 0
+    try:
+        while pos < size:
+            try:
+                start = os.lseek(fd, pos, os.SEEK_DATA)
+            except OSError as e:
+                if e.errno == errno.ENXIO:  # za posledními daty už jsou jen díry
+                    break
+                raise
+            end = min(os.lseek(fd, start, os.SEEK_HOLE), size)
+            out.append((start, end))
+            pos = end
+    except OSError:
+        return None
+    return out
+
+
+class c_source:
+    """Jedna porovnávaná strana: raw / řídký soubor, blokové zařízení nebo .gz."""
+
+    def __init__(self, path: str | Path, chunk: int = chunkhash.CHUNK) -> None:
+        self.path = Path(path)
+        self.chunk = chunk
+        self.gz = th.is_gzip(self.path)
+        self.size = 0
+        self.hashes: list[bytes] = []
+        self.holes = 0
+        self._fd: int | None = None
+        self._head = bytearray()
+        self._buf = bytearray()
+        self._wants: dict[int, bytearray] = {}
+
+    # --- hashování ---
+
+    def hash(self, workers: int | None = None) -> None:
+        if self.gz:
+            with self.path.open("rb") as fi:
+                pgunzip.decompress_stream(fi, self, workers=workers, progress=None)
+            self.close()
+            return
+        self._fd = os.open(self.path, os.O_RDONLY)
+        self.size = os.lseek(self._fd, 0, os.SEEK_END)
+        ext = data_extents(self._fd, self.size)
+        ends = [e for _s, e in ext] if ext is not None else []
+        zero = {}
+
+        def is_hole(off: int, n: int) -> bool:
+            # první rozsah dat, který končí za off – pokud začíná až za blokem, je blok díra
+            i = bisect.bisect_right(ends, off)
+            return i >= len(ext) or ext[i][0] >= off + n
+
+        def one(off: int) -> bytes:
+            n = min(self.chunk, self.size - off)
+            if ext is not None and is_hole(off, n):
+                self.holes += 1
+                if n not in zero:
+                    zero[n] = chunkhash.digest(bytes(n))
+                return zero[n]
+            return chunkhash.digest(os.pread(self._fd, n, off))
+
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1, thread_name_prefix="imgdiff") as ex:
+            self.hashes = list(ex.map(one, range(0, self.size, self.chunk)))
+
+    # rozhraní zapisovače pro pgunzip
+    def write(self, data) -> int:
+        mv = memoryview(data)
+        self._buf += mv
+        while len(self._buf) >= self.chunk:
+            self._block(bytes(self._buf[:self.chunk]))
+            del self._buf[:self.chunk]
+        return len(mv)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        if self._buf:
+            self._block(bytes(self._buf))
+            self._buf.clear()
+
+    def _block(self, data: bytes) -> None:
+        off = self.size
+        self.hashes.append(chunkhash.digest(data))
+        # začátek obrazu kvůli tabulce oddílů, po jeho načtení superbloky partition
+        if len(self._head) < HEAD:
+            self._head += data[:HEAD - len(self._head)]
+            if len(self._head) >= HEAD:
+                for p in (gpt.parse(self._from_head) or {"parts": []})["parts"]:
+                    self._wants[p["start"] + 1024] = bytearray()
+        for wo, buf in self._wants.items():
+            lo, hi = max(wo + len(buf), off), min(wo + 1024, off + len(data))
+            if lo < hi and lo == wo + len(buf):
+                buf += data[lo - off:hi - off]
+        self.size += len(data)
+
+    # --- čtení metadat ---
+
+    def _from_head(self, off: int, n: int) -> bytes:
+        return bytes(self._head[off:off + n])
+
+    def read_at(self, off: int, n: int) -> bytes:
+        """Čtení metadat: raw přes pread, .gz jen ze zachyceného začátku a superbloků."""
+        if not self.gz:
+            return os.pread(self._fd, n, off)
+        if off + n <= len(self._head):
+            return self._from_head(off, n)
+        buf = self._wants.get(off)
+        return bytes(buf[:n]) if buf is not None else b""
+
+    def release(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def ext_geometry(read_at, start: int) -> dict | None:
+    """Geometrie ext2/3/4 z superbloku partition začínající na start, None = není ext."""
+    sb = read_at(start + 1024, 1024)
+    if len(sb) < 0x5A or struct.unpack_from("<H", sb, 0x38)[0] != EXT_MAGIC:
+        return None
+    blocksLo, = struct.unpack_from("<I", sb, 0x04)
+    firstData, logBs, _logCs, perGroup = struct.unpack_from("<IIII", sb, 0x14)
+    blockSize = 1024 << logBs
+    return {
+        "block_size": blockSize,
+        "first_data_block": firstData,
+        "blocks_per_group": perGroup,
+        "groups": (blocksLo - firstData + perGroup - 1) // perGroup if perGroup else 0,
+    }
+
+
+def _group_of(geo: dict, rel: int) -> int:
+    return max(0, (rel // geo["block_size"] - geo["first_data_block"])) // geo["blocks_per_group"]
+
+
+def diff(a: str | Path, b: str | Path, chunk: int = chunkhash.CHUNK, workers: int | None = None) -> dict:
+    """Porovná dva obrazy / zařízení.
+
+    Returns:
+        dict: {"a", "b", "size_a", "size_b", "chunk", "identical", "diff_bytes",
+            "holes_skipped", "table", "tables_differ",
+            "ranges": [{"start", "end", "length", "parts": [{"num", "name", "fs", "groups"}]}]}
+    """
+    sa, sb = c_source(a, chunk), c_source(b, chunk)
+    try:
+        # obě strany souběžně – každá má vlastní pool pro pread
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="imgdiff-side") as ex:
+            fa, fb = ex.submit(sa.hash, workers), ex.submit(sb.hash, workers)
+            fa.result()
+            fb.result()
+
+        ranges: list[list[int]] = []
+        for i in range(max(len(sa.hashes), len(sb.hashes))):
+            ha = sa.hashes[i] if i < len(sa.hashes) else None
+            hb = sb.hashes[i] if i < len(sb.hashes) else None
+            if ha == hb:
+                continue
+            start, end = i * chunk, min((i + 1) * chunk, max(sa.size, sb.size))
+            if ranges and ranges[-1][1] == start:
+                ranges[-1][1] = end
+            else:
+                ranges.append([start, end])
+
+        ta, tb = gpt.parse(sa.read_at), gpt.parse(sb.read_at)
+        geos = {}
+        for p in (ta or {"parts": []})["parts"]:
+            geos[p["num"]] = ext_geometry(sa.read_at, p["start"])
+
+        out = []
+        for start, end in ranges:
+            parts = []
+            for p in (ta or {"parts": []})["parts"]:
+                ps, pe = p["start"], p["start"] + p["size"]
+                if ps >= end or pe <= start:
+                    continue
+                geo = geos.get(p["num"])
+                groups = None
+                if geo and geo["blocks_per_group"]:
+                    groups = [_group_of(geo, max(start, ps) - ps), _group_of(geo, min(end, pe) - 1 - ps)]
+                parts.append({"num": p["num"], "name": p["name"], "fs": "ext" if geo else None, "groups": groups})
+            out.append({"start": start, "end": end, "length": end - start, "parts": parts})
+
+        strip = lambda t: [(p["start"], p["size"], p["type"]) for p in t["parts"]] if t else None
+        return {
+            "a": str(a),
+            "b": str(b),
+            "size_a": sa.size,
+            "size_b": sb.size,
+            "chunk": chunk,
+            "identical": not out and sa.size == sb.size,
+            "diff_bytes": sum(r["length"] for r in out),
+            "holes_skipped": sa.holes + sb.holes,
+            "table": ta["type"] if ta else None,
+            "tables_differ": strip(ta) != strip(tb),
+            "ranges": out,
+        }
+    finally:
+        sa.release()
+        sb.release()
+
+
+def print_diff(res: dict, asJson: bool = False, maxRanges: int = 100) -> None:
+    """Vypíše výsledek diff čitelně nebo jako JSON."""
+    if asJson:
+        print(json.dumps(res, indent=2, ensure_ascii=False))
+        return
+    mib = lambda n: f"{n / 1024 / 1024:.1f} MiB"
+    print(f"[DIFF] {res['a']} ({mib(res['size_a'])}) ↔ {res['b']} ({mib(res['size_b'])})")
+    if res["identical"]:
+        print("[DIFF] Obrazy jsou shodné.")
+        return
+    if res["size_a"] != res["size_b"]:
+        print("[DIFF] Obrazy mají různou velikost.")
+    if res["tables_differ"]:
+        print("[DIFF] Tabulka oddílů se liší (partition se mapují podle A).")
+    print(f"[DIFF] Liší se {mib(res['diff_bytes'])} v {len(res['ranges'])} rozsazích "
+          f"(bloky {mib(res['chunk'])}, přeskočeno děr {res['holes_skipped']})")
+    for r in res["ranges"][:maxRanges]:
+        where = []
+        for p in r["parts"]:
+            tx = f"p{p['num']}" + (f" {p['name']}" if p["name"] else "")
+            if p["groups"]:
+                g0, g1 = p["groups"]
+                tx += f" ext bg {g0}" + (f"–{g1}" if g1 != g0 else "")
+            where.append(tx)
+        print(f"  {r['start']:>14} – {r['end']:<14} {mib(r['length']):>12}  {', '.join(where) or 'mimo partition'}")
+    if len(res["ranges"]) > maxRanges:
+        print(f"  ... a dalších {len(res['ranges']) - maxRanges} rozsahů (celý výpis přes --json)")
@@ -0,0 +1,252 @@
+"""
+Obraz disku (.img) jako zdroj nebo cíl smart zálohy – bez losetup a bez roota
+
+  - tabulka oddílů se čte přímo ze souboru (libs/gpt)
+  - typ FS, UUID a label partition se poznají podle signatur (jako blkid)
+  - partition se čte jako rozsah souboru (c_range_reader); díry řídkého obrazu
+    (SEEK_DATA / SEEK_HOLE) se nečtou, místo nich se vrací nuly
+  - partition jsou nezávislé rozsahy jednoho souboru, takže jdou číst souběžně
+  - při obnově do obrazu se nulové bloky nezapisují (c_range_writer), obraz
+    zůstane řídký
+"""
+import os
+import stat
+import struct
+import uuid
+from pathlib import Path
+
+from . import gpt
+from . import imgdiff
+from . import pipeline
+
+_ZERO = bytes(1024 * 1024)
+
+HOLE_BLOCK: int = 64 * 1024
+"""Granularita děr při zápisu do obrazu – celý nulový blok se nezapíše."""
+
+
+def is_image(spec: str | Path) -> bool:
+    """Zdroj je soubor obrazu, ne jméno disku (sdb) ani blokové zařízení."""
+    spec = str(spec)
+    if os.path.sep not in spec and Path(f"/dev/{spec}").exists():
+        return False
+    try:
+        return stat.S_ISREG(os.stat(spec).st_mode)
+    except OSError:
+        return False
+
+
+def is_image_target(spec: str | Path) -> bool:
+    """Cíl obnovy je soubor obrazu (existující běžný soubor nebo nová cesta), ne disk.
+
+    /dev/… a bloková zařízení nejsou nikdy obraz; holé jméno (sdb) je disk.
+    """
+    spec = str(spec)
+    if os.path.abspath(spec).startswith("/dev/"):
+        return False
+    try:
+        return stat.S_ISREG(os.stat(spec).st_mode)
+    except OSError:
+        return os.path.sep in spec
+
+
+def _text(raw: bytes) -> str:
+    return raw.split(b"\0", 1)[0].decode("utf-8", errors="replace").strip()
+
+
+def sniff_fs(read_at) -> dict:
+    """Typ FS, UUID a label podle signatur na začátku partition.
+
+    Returns:
+        dict: {"fstype": "ext4" | "vfat" | "swap" | "xfs" | "btrfs" | "ntfs" | "", "uuid", "label"}
+    """
+    geo = imgdiff.ext_geometry(read_at, 0)
+    if geo:
+        sb = read_at(1024, 1024)
+        compat, incompat, roCompat = struct.unpack_from("<III", sb, 0x5C)
+        fs = "ext4" if incompat & 0x2C0 or roCompat & 0x78 else "ext3" if compat & 0x4 else "ext2"
+        return {"fstype": fs, "uuid": str(uuid.UUID(bytes=sb[0x68:0x78])), "label": _text(sb[0x78:0x88])}
+    head = read_at(0, 65536 + 4096)
+    for ps in (4096, 8192, 16384, 65536):
+        if head[ps - 10:ps] in (b"SWAPSPACE2", b"SWAP-SPACE"):
+            return {"fstype": "swap", "uuid": str(uuid.UUID(bytes=head[1024 + 0xC:1024 + 0x1C])),
+                    "label": _text(head[1024 + 0x1C:1024 + 0x2C])}
+    if head[510:512] == b"\x55\xaa" and (head[54:57] == b"FAT" or head[82:87] == b"FAT32"):
+        o = 67 if head[82:87] == b"FAT32" else 39
+        volId, = struct.unpack_from("<I", head, o)
+        label = _text(head[o + 4:o + 15])
+        return {"fstype": "vfat", "uuid": f"{volId >> 16:04X}-{volId & 0xFFFF:04X}",
+                "label": "" if label == "NO NAME" else label}
+    if head[:4] == b"XFSB":
+        return {"fstype": "xfs", "uuid": str(uuid.UUID(bytes=head[32:48])), "label": _text(head[108:120])}
+    if head[3:11] == b"NTFS    ":
+        return {"fstype": "ntfs", "uuid": None, "label": ""}
+    bt = read_at(65536, 4096)
+    if bt[0x40:0x48] == b"_BHRfS_M":
+        return {"fstype": "btrfs", "uuid": str(uuid.UUID(bytes=bt[0x20:0x30])), "label": _text(bt[0x12B:0x22B])}
+    return {"fstype": "", "uuid": None, "label": ""}
+
+
+def partitions(image: str | Path) -> tuple[dict, list[dict]]:
+    """Tabulka oddílů obrazu a jeho partition s rozpoznaným FS.
+
+    Returns:
+        tuple: (tabulka z gpt.parse, [{"num", "start", "size", "name", "guid", "fstype", "uuid", "label"}])
+    Raises:
+        RuntimeError: obraz nemá GPT
+    """
+    fd = os.open(image, os.O_RDONLY)
+    try:
+        table = gpt.parse(lambda off, n: os.pread(fd, n, off))
+        if not table or table["type"] != "gpt":
+            raise RuntimeError(f"Obraz {image} nemá GPT tabulku oddílů.")
+        out = []
+        for p in table["parts"]:
+            fs = sniff_fs(lambda off, n, s=p["start"]: os.pread(fd, n, s + off))
+            out.append({**p, **fs})
+        return table, out
+    finally:
+        os.close(fd)
+
+
+class c_range_reader:
+    """Čtení rozsahu [start, start+size) souboru obrazu jako samostatného proudu.
+
+    Díry (SEEK_HOLE) se nečtou, do bufferu se doplní nuly. Bez fileno, aby
+    pipeline nezahazovala page cache podle offsetů od začátku souboru.
+    """
+
+    def __init__(self, path: str | Path, start: int, size: int) -> None:
+        self.fd = os.open(path, os.O_RDONLY)
+        self.start = start
+        self.size = size
+        self.pos = 0
+        fileSize = os.fstat(self.fd).st_size
+        ext = imgdiff.data_extents(self.fd, fileSize)
+        # rozsahy s daty relativně k začátku partition; None = bez informace, vše jsou data
+        self.extents = None if ext is None else [
+            (max(s, start) - start, min(e, start + size) - start)
+            for s, e in ext if e > start and s < start + size]
+        self.dataBytes = size if self.extents is None else sum(e - s for s, e in self.extents)
+        try:
+            os.posix_fadvise(self.fd, start, size, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+
+    def _data_at(self, pos: int) -> tuple[bool, int]:
+        """(jsou data?, kolik bajtů od pos platí totéž)."""
+        if self.extents is None:
+            return True, self.size - pos
+        for s, e in self.extents:
+            if pos < s:
+                return False, s - pos
+            if pos < e:
+                return True, e - pos
+        return False, self.size - pos
+
+    def readinto(self, buf) -> int:
+        mv = memoryview(buf).cast("B")
+        n = min(len(mv), self.size - self.pos)
+        if n <= 0:
+            return 0
+        isData, run = self._data_at(self.pos)
+        n = min(n, run)
+        if isData:
+            n = os.preadv(self.fd, [mv[:n]], self.start + self.pos)
+            if n == 0:
+                # obraz je kratší než tabulka oddílů – zbytek jsou nuly
+                n = min(len(mv), self.size - self.pos, len(_ZERO))
+                mv[:n] = _ZERO[:n]
+        else:
+            n = min(n, len(_ZERO))
+            mv[:n] = _ZERO[:n]
+        self.pos += n
+        return n
+
+    def read(self, n: int = -1) -> bytes:
+        if n is None or n < 0:
+            n = self.size - self.pos
+        buf = bytearray(n)
+        got = self.readinto(buf)
+        return bytes(buf[:got])
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __enter__(self) -> "c_range_reader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class c_range_writer:
+    """Zápis proudu do rozsahu [start, start+size) souboru obrazu.
+
+    Bloky HOLE_BLOCK samých nul se přeskočí – v novém (řídkém) obrazu po nich
+    zůstane díra. Cíl proto musí být nově vytvořený nebo vynulovaný soubor
+    (pagecache.punch_hole), jinak sparse=False.
+    """
+
+    def __init__(self, path: str | Path, start: int, size: int, sparse: bool = True) -> None:
+        self.fd = os.open(path, os.O_WRONLY)
+        self.start = start
+        self.size = size
+        self.sparse = sparse
+        self.pos = 0
+        self.written = 0
+
+    def write(self, data) -> int:
+        mv = memoryview(data).cast("B")
+        if self.pos + len(mv) > self.size:
+            raise ValueError(f"Data jsou větší než partition ({self.size} B)")
+        for off in range(0, len(mv), HOLE_BLOCK):
+            blk = mv[off:off + HOLE_BLOCK]
+            if not self.sparse or not pipeline.is_zero(blk):
+                os.pwrite(self.fd, blk, self.start + self.pos + off)
+                self.written += len(blk)
+        self.pos += len(mv)
+        return len(mv)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.fsync(self.fd)
+            os.close(self.fd)
+            self.fd = -1
+
+    def abort(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __enter__(self) -> "c_range_writer":
+        return self
+
+    def __exit__(self, excType, exc, tb) -> None:
+        if excType is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_swap(path: str | Path, start: int, size: int, uuidStr: str | None = None,
+               label: str | None = None, pageSize: int = 4096) -> None:
+    """Hlavička swapu (jako mkswap) do partition uvnitř obrazu."""
+    pages = size // pageSize
+    if pages < 10:
+        raise ValueError(f"Swap {size} B je příliš malý")
+    hdr = bytearray(pageSize)
+    struct.pack_into("<III", hdr, 1024, 1, pages - 1, 0)
+    hdr[1024 + 0xC:1024 + 0x1C] = uuid.UUID(uuidStr).bytes if uuidStr else uuid.uuid4().bytes
+    hdr[1024 + 0x1C:1024 + 0x2C] = (label or "").encode()[:16].ljust(16, b"\0")
+    hdr[pageSize - 10:] = b"SWAPSPACE2"
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        os.pwrite(fd, hdr, start)
+    finally:
+        os.close(fd)
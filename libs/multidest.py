@@ -0,0 +1,310 @@
+"""
+Záloha do více cílových adresářů najednou (--dest d1,d2 --dest-mode)
+
+Zdroj se čte (a komprimuje) jen jednou, výstupní proud se rozesílá do front
+jednotlivých cílů a každý cíl má vlastní zapisovací vlákno:
+  - mirror: každý cíl dostane celou kopii (volitelně i se --split-size svazky)
+    a vlastní .sha256
+  - stripe: výstup se dělí na svazky --split-size a ty se střídavě (round-robin)
+    zapisují na jednotlivé cíle – disky zapisují souběžně, propustnost se sčítá;
+    každý svazek má svůj .sha256 a do každého cíle se zapíše manifest
+    <obraz>.stripe.json, podle kterého restore svazky najde
+
+Chyba zápisu nebo zaseknutí (STALL_TIMEOUT) vyřadí jen daný cíl, ostatní
+pokračují. U stripe se další svazky rozdělí mezi zbylé cíle; svazek, který se
+na vyřazeném cíli zapisoval, chybí a sada je neúplná (vypíše se).
+"""
+import hashlib
+import json
+import queue
+import threading
+import time
+from pathlib import Path
+
+import libs.toolhelp as th
+from . import pagecache
+from . import streams
+
+MODES: tuple[str, ...] = ("mirror", "stripe")
+"""Režimy rozdělení výstupu mezi cíle."""
+
+QUEUE_CHUNKS: int = 16
+"""Max. počet bloků ve frontě jednoho cíle."""
+
+STALL_TIMEOUT: float = 60.0
+"""Cíl, který tak dlouho nepřijme blok, se vyřadí."""
+
+SYNC_TIMEOUT: float = 300.0
+"""Max. doba uzavření (fsync) souboru cíle, pak se cíl vyřadí."""
+
+
+class c_dest:
+    """Jeden cílový adresář: fronta, zapisovací vlákno, sidecar."""
+
+    def __init__(self, dir: str | Path, name: str, mode: str, splitSize: int | None = None) -> None:
+        self.dir = Path(dir)
+        self.name = name
+        self.mode = mode
+        self.splitSize = splitSize
+        self.path = self.dir / name
+        self.q: "queue.Queue[tuple[str, object] | None]" = queue.Queue(maxsize=QUEUE_CHUNKS)
+        self.status = "pending"
+        self.error: str | None = None
+        self.written = 0
+        self.started = 0.0
+        self.finished: float | None = None
+        self.syncing = False
+        self.thread: threading.Thread | None = None
+        self.sha = hashlib.sha256()
+        self.volumes: dict[int, dict] = {}
+        self._sink = None
+
+    @property
+    def alive(self) -> bool:
+        return self.status == "running"
+
+    def rate(self, now: float | None = None) -> float:
+        end = self.finished or now or time.monotonic()
+        return self.written / max(end - self.started, 1e-9)
+
+    def fail(self, error: str) -> None:
+        if self.status in ("running", "pending"):
+            self.status = "failed"
+            self.error = error
+            print(f"\n[DEST] {self.dir} vyřazen: {error}")
+        try:
+            self.q.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def start(self) -> None:
+        self.dir.mkdir(parents=True, exist_ok=True)
+        if self.mode == "mirror":
+            self._sink = streams.open_sink(self.path, splitSize=self.splitSize)
+        self.status = "running"
+        self.started = time.monotonic()
+        self.thread = threading.Thread(target=self._writer, name=f"dest-{self.dir.name}", daemon=True)
+        self.thread.start()
+
+    def _writer(self) -> None:
+        vol = None
+        try:
+            while self.alive:
+                item = self.q.get()
+                if item is None:
+                    break
+                kind, val = item
+                if kind == "data":
+                    if vol is not None:
+                        vol["writer"].write(val)
+                        vol["sha"].update(val)
+                        vol["size"] += len(val)
+                    else:
+                        self._sink.write(val)
+                        self.sha.update(val)
+                    self.written += len(val)
+                elif kind == "open":
+                    path = streams.volume_path(self.path, val)
+                    vol = {"index": val, "path": path, "size": 0, "sha": hashlib.sha256(),
+                           "writer": pagecache.c_out_writer(path, self.splitSize)}
+                elif kind == "close":
+                    self.syncing = True
+                    vol["writer"].close()
+                    self.syncing = False
+                    digest = vol["sha"].hexdigest()
+                    th.write_sha256_sidecar(vol["path"], digest)
+                    self.volumes[vol["index"]] = {"index": vol["index"], "dir": str(self.dir),
+                                                  "size": vol["size"], "sha256": digest}
+                    vol = None
+            if self.alive and self._sink is not None:
+                self.syncing = True
+                self._sink.close()
+                th.write_sha256_sidecar(self.path, self.sha.hexdigest())
+        except Exception as e:
+            self.fail(f"chyba zápisu: {e}")
+        finally:
+            self.finished = time.monotonic()
+            if vol is not None:
+                vol["writer"].abort()
+            if not self.alive and self._sink is not None:
+                self._sink.abort()
+
+    def paths(self) -> list[Path]:
+        """Zapsané soubory (pro paritu / katalog)."""
+        if self.mode == "stripe":
+            return [streams.volume_path(self.path, i) for i in sorted(self.volumes)]
+        return streams.volumes(self.path) if self.splitSize else [self.path]
+
+
+class c_multi_sink:
+    """Výstup zálohy (write/flush/close/abort) rozesílaný do více cílů."""
+
+    def __init__(self, dirs: list[str | Path], name: str, mode: str = "mirror",
+                 splitSize: int | None = None, stallTimeout: float = STALL_TIMEOUT) -> None:
+        if mode not in MODES:
+            raise ValueError(f"Neznámý režim cílů: {mode} (podporováno: {', '.join(MODES)})")
+        if mode == "stripe" and not splitSize:
+            raise ValueError("stripe vyžaduje --split-size (velikost svazku)")
+        self.name = name
+        self.mode = mode
+        self.splitSize = splitSize
+        self.stallTimeout = stallTimeout
+        self.dests = [c_dest(d, name, mode, splitSize) for d in dict.fromkeys(str(d) for d in dirs)]
+        self.sha = hashlib.sha256()
+        self.bytes = 0
+        self.lost: list[int] = []
+        self._vol = -1
+        self._volPos = 0
+        self._volDest: c_dest | None = None
+        self._rr = 0
+        for d in self.dests:
+            try:
+                d.start()
+            except OSError as e:
+                d.status, d.error = "failed", str(e)
+        if not any(d.alive for d in self.dests):
+            raise RuntimeError("Žádný cílový adresář není k dispozici")
+
+    def _put(self, d: c_dest, item: tuple[str, object] | None) -> bool:
+        """Vloží položku do fronty cíle, False = cíl je (nebo byl právě) vyřazen."""
+        blocked = 0.0
+        while d.alive:
+            try:
+                d.q.put(item, timeout=1.0)
+                return True
+            except queue.Full:
+                blocked += 1.0
+                if blocked >= self.stallTimeout:
+                    d.fail(f"nepřijal data {blocked:.0f} s")
+        return False
+
+    def _next_volume(self) -> None:
+        if self._volDest is not None and not self._put(self._volDest, ("close", None)):
+            self.lost.append(self._vol)
+        self._vol += 1
+        self._volPos = 0
+        while True:
+            alive = [d for d in self.dests if d.alive]
+            if not alive:
+                raise RuntimeError("Všechny cílové adresáře byly vyřazeny")
+            self._volDest = alive[self._rr % len(alive)]
+            self._rr += 1
+            # cíl může vypadnout právě při otevření – svazek ještě nemá data, jde na další
+            if self._put(self._volDest, ("open", self._vol)):
+                return
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.sha.update(data)
+        self.bytes += len(data)
+        if self.mode == "mirror":
+            for d in self.dests:
+                self._put(d, ("data", data))
+        else:
+            done = 0
+            while done < len(data):
+                if self._volDest is None or self._volPos >= self.splitSize:
+                    self._next_volume()
+                part = data[done:done + self.splitSize - self._volPos]
+                if not self._put(self._volDest, ("data", part)) and self._vol not in self.lost:
+                    self.lost.append(self._vol)
+                self._volPos += len(part)
+                done += len(part)
+        if not any(d.alive for d in self.dests):
+            raise RuntimeError("Všechny cílové adresáře byly vyřazeny")
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def _finish(self) -> None:
+        if self.mode == "stripe":
+            if self._volDest is None:
+                # prázdný proud – jeden prázdný svazek
+                self._next_volume()
+            if not self._put(self._volDest, ("close", None)) and self._vol not in self.lost:
+                self.lost.append(self._vol)
+        for d in self.dests:
+            self._put(d, None)
+        for d in self.dests:
+            if d.thread is None:
+                continue
+            # čeká se, dokud cíl zapisuje; bez pohybu déle než stallTimeout
+            # (při uzavírání souboru SYNC_TIMEOUT) se vyřadí
+            last, syncing, idle = d.written, d.syncing, 0.0
+            while d.alive and d.thread.is_alive():
+                d.thread.join(1.0)
+                if d.written != last or d.syncing != syncing:
+                    last, syncing, idle = d.written, d.syncing, 0.0
+                    continue
+                idle += 1.0
+                if idle >= (SYNC_TIMEOUT if syncing else self.stallTimeout):
+                    d.fail(f"nedokončil {'uzavření' if syncing else 'zápis'} za {idle:.0f} s")
+            # zaseklý cíl může viset v zápisu / fsync – na vyřazený se nečeká
+            d.thread.join(1.0)
+            if d.status == "running":
+                d.status = "ok"
+        # svazky dokončené na později vyřazeném cíli platí (mají svůj sidecar);
+        # chybí jen ten rozepsaný a ty, které cíl při chybě nestihl
+        have = set().union(*(d.volumes for d in self.dests))
+        self.lost = sorted(set(self.lost) | (set(range(self._vol + 1)) - have)) if self.mode == "stripe" else []
+
+    def close(self) -> None:
+        """Dokončí zápis ve všech cílech, u stripe zapíše manifest a celkový .sha256."""
+        self._finish()
+        if self.mode != "stripe":
+            return
+        digest = self.sha.hexdigest()
+        vols = sorted((v for d in self.dests for v in d.volumes.values()),
+                      key=lambda v: v["index"])
+        manifest = {
+            "name": self.name,
+            "split_size": self.splitSize,
+            "size": self.bytes,
+            "sha256": digest,
+            "dirs": [str(d.dir) for d in self.dests],
+            "volumes": vols,
+            "lost": self.lost,
+        }
+        for d in self.dests:
+            if d.status == "ok":
+                streams.stripe_manifest(d.path).write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+                th.write_sha256_sidecar(d.path, digest)
+
+    def abort(self) -> None:
+        for d in self.dests:
+            d.fail("přerušeno")
+        for d in self.dests:
+            if d.thread is not None:
+                d.thread.join(1.0)
+
+    def __enter__(self) -> "c_multi_sink":
+        return self
+
+    def __exit__(self, excType, exc, tb) -> None:
+        if excType is None:
+            self.close()
+        else:
+            self.abort()
+
+    @property
+    def ok(self) -> list[c_dest]:
+        return [d for d in self.dests if d.status == "ok"]
+
+    @property
+    def complete(self) -> bool:
+        """Záloha je celá: mirror alespoň v jednom cíli, stripe bez chybějících svazků."""
+        return bool(self.ok) and not self.lost
+
+
+def print_report(sink: c_multi_sink) -> None:
+    """Vypíše výsledek pro každý cíl."""
+    tit = f"{'Cíl':<30} | {'Stav':<8} | {'Zapsáno':>10} | {'MB/s':>6} | Chyba"
+    print(tit)
+    print("-" * len(tit))
+    for d in sink.dests:
+        rate = f"{d.rate() / 1024 / 1024:.1f}" if d.started else "-"
+        print(f"{str(d.dir):<30} | {d.status:<8} | {d.written / 1024 / 1024:8.0f} M | {rate:>6} | {d.error or ''}")
+    print(f"Hotovo: {len(sink.ok)}/{len(sink.dests)} cílů v pořádku ({sink.mode}).")
+    if sink.lost:
+        print(f"[DEST] Sada je neúplná, chybí svazky: {', '.join(f'{i:03d}' for i in sink.lost)}")
@@ -0,0 +1,269 @@
+"""
+Šetrné zacházení s page cache při velkých přenosech
+
+Záloha 256 GB karty přes `dd` vytlačí z page cache všechno ostatní a služby
+na stejném stroji se pak minuty rozjíždějí. Datové smyčky proto:
+  - ohlásí sekvenční čtení (POSIX_FADV_SEQUENTIAL → větší read-ahead jádra)
+  - za sebou zahazují už přečtené stránky (POSIX_FADV_DONTNEED)
+  - u zápisu průběžně spouští writeback po oknech (sync_file_range) a zapsané
+    stránky také zahodí – dirty data se nehromadí a cache zůstane ostatním
+  - volitelně dočasně nastaví read_ahead_kb zdrojového disku (--read-ahead)
+
+Výstupní soubory záloh se zapisují přes c_out_writer: prealokace (fallocate),
+writeback po oknech a fsync na konci – zápis nečeká na jeden obří flush
+a soubor není fragmentovaný.
+
+Vše je jen nápověda pro jádro: chyba (roura, nepodporovaný FS) se ignoruje.
+CLI --keep-cache vypíná zahazování (např. když se obraz hned poté ověřuje),
+writeback po oknech zůstává.
+"""
+import ctypes
+import ctypes.util
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+ENABLED: bool = True
+"""False = nezahazovat stránky z cache (CLI --keep-cache)."""
+
+WINDOW: int = 32 * 1024 * 1024
+"""Po kolika bajtech se stránky zahazují / spouští writeback."""
+
+READ_AHEAD_KB: int | None = None
+"""read_ahead_kb zdrojového disku po dobu úlohy (CLI --read-ahead), None = neměnit."""
+
+SYNC_FILE_RANGE_WAIT_BEFORE = 1
+SYNC_FILE_RANGE_WRITE = 2
+SYNC_FILE_RANGE_WAIT_AFTER = 4
+FALLOC_FL_KEEP_SIZE = 1
+FALLOC_FL_PUNCH_HOLE = 2
+
+_libc = None
+
+
+def _lib():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        _libc.sync_file_range.argtypes = [ctypes.c_int, ctypes.c_int64, ctypes.c_int64, ctypes.c_uint]
+        _libc.fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+    return _libc
+
+
+def _check(rc: int) -> None:
+    if rc != 0:
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e))
+
+
+def _sync_file_range(fd: int, off: int, n: int, flags: int) -> None:
+    """sync_file_range(2) přes ctypes (os ho nenabízí)."""
+    _check(_lib().sync_file_range(fd, off, n, flags))
+
+
+def _fallocate(fd: int, mode: int, off: int, n: int) -> None:
+    """fallocate(2) přes ctypes – os.posix_fallocate při nepodpoře zapisuje nuly."""
+    _check(_lib().fallocate(fd, mode, off, n))
+
+
+def punch_hole(fd: int, off: int, n: int) -> bool:
+    """Uvolní rozsah souboru (díra, velikost se nemění), False = FS díry neumí."""
+    try:
+        _fallocate(fd, FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE, off, n)
+        return True
+    except (OSError, AttributeError):
+        return False
+
+
+def _fileno(f) -> int | None:
+    if isinstance(f, int):
+        return f
+    try:
+        return f.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def advise_sequential(f) -> None:
+    """Ohlásí jádru sekvenční čtení celého souboru / zařízení."""
+    fd = _fileno(f)
+    if fd is None:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    except OSError:
+        pass
+
+
+class c_drop_behind:
+    """Sleduje postup streamu a stránky za ním zahazuje z page cache.
+
+    Volá se s počtem právě přenesených bajtů; pracuje po oknech WINDOW.
+    U zápisu se pro aktuální okno jen spustí writeback a na dokončení se čeká
+    až u předchozího okna – zápis tak nečeká na disk po každém okně.
+    """
+
+    def __init__(self, f, write: bool = False, window: int | None = None) -> None:
+        self.write = write
+        self.window = window or WINDOW
+        # s --keep-cache se u zápisu stránky nezahazují, writeback po oknech zůstává
+        self.drop = ENABLED
+        self.fd = _fileno(f) if ENABLED or write else None
+        self.start = self.pos = self.mark = 0
+        self._prev: tuple[int, int] | None = None
+        if self.fd is not None:
+            try:
+                self.start = self.pos = self.mark = os.lseek(self.fd, 0, os.SEEK_CUR)
+            except OSError:
+                # roura / socket – není co zahazovat
+                self.fd = None
+
+    def __call__(self, n: int) -> None:
+        if self.fd is None:
+            return
+        self.pos += n
+        while self.fd is not None and self.pos - self.mark >= self.window:
+            self._drop(self.mark, self.window)
+            self.mark += self.window
+
+    def _drop(self, off: int, n: int) -> None:
+        try:
+            if self.write:
+                _sync_file_range(self.fd, off, n, SYNC_FILE_RANGE_WRITE)
+                if self._prev:
+                    poff, pn = self._prev
+                    _sync_file_range(self.fd, poff, pn, SYNC_FILE_RANGE_WAIT_BEFORE |
+                                     SYNC_FILE_RANGE_WRITE | SYNC_FILE_RANGE_WAIT_AFTER)
+                    if self.drop:
+                        os.posix_fadvise(self.fd, poff, pn, os.POSIX_FADV_DONTNEED)
+                self._prev = (off, n)
+            else:
+                os.posix_fadvise(self.fd, off, n, os.POSIX_FADV_DONTNEED)
+        except (OSError, AttributeError):
+            self.fd = None
+
+    def close(self) -> None:
+        """Dorovná zbytek za posledním oknem (u zápisu počká na writeback)."""
+        if self.fd is None:
+            return
+        try:
+            if self.write:
+                if self.pos > self.mark:
+                    _sync_file_range(self.fd, self.mark, self.pos - self.mark, SYNC_FILE_RANGE_WRITE)
+                off = self._prev[0] if self._prev else self.mark
+                if self.pos > off:
+                    _sync_file_range(self.fd, off, self.pos - off, SYNC_FILE_RANGE_WAIT_BEFORE |
+                                     SYNC_FILE_RANGE_WRITE | SYNC_FILE_RANGE_WAIT_AFTER)
+                    if self.drop:
+                        os.posix_fadvise(self.fd, off, self.pos - off, os.POSIX_FADV_DONTNEED)
+            elif self.pos > self.mark:
+                os.posix_fadvise(self.fd, self.mark, self.pos - self.mark, os.POSIX_FADV_DONTNEED)
+        except (OSError, AttributeError):
+            pass
+        self.fd = None
+
+
+class c_out_writer:
+    """Výstupní soubor zálohy: prealokace, writeback po oknech, fsync na konci.
+
+    Záměrně nemá fileno(), aby nad ním datové smyčky nezakládaly další
+    c_drop_behind – okna řeší writer sám.
+    """
+
+    def __init__(self, path: str | Path, size: int | None = None, window: int | None = None) -> None:
+        """
+        Args:
+            path: výstupní soubor (vytvoří se / zkrátí)
+            size: očekávaná velikost pro prealokaci, None = neznámá (gzip)
+        """
+        self.path = Path(path)
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        self.pos = 0
+        self.prealloc = False
+        if size:
+            try:
+                # KEEP_SIZE – velikost souboru roste až zápisem, přebytek se na konci uvolní
+                _fallocate(self.fd, FALLOC_FL_KEEP_SIZE, 0, size)
+                self.prealloc = True
+            except (OSError, AttributeError):
+                pass
+        self._wb = c_drop_behind(self.fd, write=True, window=window)
+
+    def write(self, data) -> int:
+        mv = memoryview(data)
+        done = 0
+        while done < len(mv):
+            done += os.write(self.fd, mv[done:])
+        self.pos += done
+        self._wb(done)
+        return done
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        """Dopíše poslední okno, uvolní nevyužitou prealokaci a provede fsync."""
+        if self.fd is None:
+            return
+        try:
+            self._wb.close()
+            if self.prealloc:
+                os.ftruncate(self.fd, self.pos)
+            os.fsync(self.fd)
+        finally:
+            os.close(self.fd)
+            self.fd = None
+
+    def abort(self) -> None:
+        """Zavře bez fsync (po chybě, soubor se stejně zahodí)."""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self) -> "c_out_writer":
+        return self
+
+    def __exit__(self, excType, exc, tb) -> None:
+        if excType is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def _queue_dir(dev: str | Path) -> Path | None:
+    """Adresář queue/ v sysfs pro disk (u partition nadřazený disk), None pro soubor."""
+    name = Path(os.path.realpath(dev)).name
+    sysBlk = Path("/sys/class/block") / name
+    if not sysBlk.exists():
+        return None
+    if (sysBlk / "partition").exists():
+        sysBlk = Path(os.path.realpath(sysBlk)).parent
+    q = sysBlk / "queue"
+    return q if (q / "read_ahead_kb").exists() else None
+
+
+@contextmanager
+def read_ahead(dev: str | Path, kb: int | None = None) -> Iterator[None]:
+    """Dočasně nastaví read_ahead_kb disku, po skončení vrátí původní hodnotu.
+
+    Args:
+        kb: požadovaná hodnota, default READ_AHEAD_KB (None = nic neměnit)
+    """
+    kb = kb if kb is not None else READ_AHEAD_KB
+    q = _queue_dir(dev) if kb else None
+    old = None
+    if q is not None:
+        try:
+            old = (q / "read_ahead_kb").read_text().strip()
+            (q / "read_ahead_kb").write_text(str(kb))
+        except OSError:
+            old = None
+    try:
+        yield
+    finally:
+        if old is not None:
+            try:
+                (q / "read_ahead_kb").write_text(old)
+            except OSError:
+                pass
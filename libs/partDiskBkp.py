@@ -6,13 +6,29 @@ výhoda je v tom že záloha zabere méně místa a je rychlejší
 nevýhoda je v tom že restore musí být na stejný nebo větší disk než byl zálohovaný
 """
 import json
+import os
 import re
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
-from ..libs import toolhelp as th
-from ..libs.JBLibs.input import confirm
+from typing import Callable, Optional
+from . import toolhelp as th
+from . import adaptgz as agz
+from . import catalog
+from . import chunkhash
+from . import gpt
+from . import imgsrc
+from . import partfp
+from . import pgunzip
+from . import reflink
+from . import streams
+from . import throttle
+from . import pipeline
+from . import postrestore
+from . import zcopy
+from .JBLibs.input import confirm
 
 def verify_sha256_sidecar(path: Path) -> bool:
     """
@@ -27,12 +43,142 @@ def verify_sha256_sidecar(path: Path) -> bool:
     th.run(["sha256sum", "-c", str(sidecar)])
     return True
 
-def diskImgLikeBackup(disk: str, destDir: str, name: Optional[str] = None) -> str:
+
+SWAP_MAGICS: tuple[bytes, ...] = (b"SWAPSPACE2", b"SWAP-SPACE")
+"""Signatura swapu na konci první stránky (pagesize - 10)."""
+
+
+def has_swap_signature(pdev: str) -> bool:
+    """Swap podle signatury (lsblk FSTYPE nemusí být vyplněný), stránky 4K až 64K."""
+    try:
+        with open(pdev, "rb") as f:
+            head = f.read(65536)
+    except OSError:
+        return False
+    return any(head[ps - 10:ps] in SWAP_MAGICS for ps in (4096, 8192, 16384, 65536))
+
+
+def _is_scratch(scratch: list, pnum: int, pname: str, label: str) -> bool:
+    return any(str(s) in (str(pnum), pname, label) for s in scratch if str(s))
+
+
+def _recreate_cmd(p: dict, pdev: str) -> Optional[list[str]]:
+    """Příkaz pro znovuvytvoření partition s původním UUID a labelem, None = není jak."""
+    fs = (p.get("fstype") or "").lower()
+    uuid = p.get("uuid")
+    label = p.get("label")
+    if fs == "swap":
+        cmd = ["mkswap"]
+        cmd += ["-U", uuid] if uuid else []
+        cmd += ["-L", label] if label else []
+    elif fs in ("ext2", "ext3", "ext4"):
+        cmd = [f"mkfs.{fs}", "-F", "-q"]
+        cmd += ["-U", uuid] if uuid else []
+        cmd += ["-L", label] if label else []
+    elif fs in ("vfat", "fat"):
+        cmd = ["mkfs.vfat"]
+        cmd += ["-i", uuid.replace("-", "")] if uuid else []
+        cmd += ["-n", label] if label else []
+    elif fs == "xfs":
+        cmd = ["mkfs.xfs", "-f"]
+        cmd += ["-m", f"uuid={uuid}"] if uuid else []
+        cmd += ["-L", label] if label else []
+    elif fs:
+        cmd = [f"mkfs.{fs}"]
+    else:
+        return None
+    return cmd + [pdev]
+
+def _previous_parts(baseDest: Path, disk: str, ident: dict) -> tuple[Optional[Path], dict[int, dict]]:
+    """Poslední dobrá sada stejné karty v baseDest a její partition z manifest.json podle čísla."""
+    try:
+        rows = catalog.list_sets(root=baseDest, disk=disk, serial=ident["serial"], ptuuid=ident["ptuuid"],
+                                 kind="imgtool-disk-backup", good=True)
+    except Exception as e:
+        print(f"[WARN] Katalog nedostupný, partition se čtou celé: {e}")
+        return None, {}
+    for r in rows:
+        prevDir = Path(r["path"])
+        try:
+            m = json.loads((prevDir / "manifest.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        return prevDir, {p["num"]: p for p in m.get("partitions", [])}
+    return None, {}
+
+
+def _reuse_part(old: Optional[dict], prevDir: Optional[Path], img_path: Path, fp: Optional[str],
+                size_bytes: int, codec: str) -> bool:
+    """Převezme obraz partition z předchozí sady, pokud sedí otisk, velikost a kodek."""
+    if not fp or not old or old.get("fingerprint") != fp:
+        return False
+    if old.get("size_bytes") != size_bytes or old.get("codec", "raw") != codec:
+        return False
+    src = prevDir / old["filename"]
+    digest = reflink.sidecar_digest(src)
+    if digest is None or not src.is_file():
+        return False
+    how = reflink.share_file(src, img_path)
+    th.write_sha256_sidecar(img_path, digest)
+    print(f"[REUSE] {img_path.name} beze změny od {prevDir.name} ({how}), partition se nečte")
+    return True
+
+
+def _read_part(pdev: str, img_path: Path, adaptive: bool, workers: Optional[int],
+               rng: Optional[tuple[str, int, int]] = None, progress: bool = True,
+               report: Optional[Callable[[int], None]] = None) -> str:
+    """Přečte partition do .part / .part.gz a zapíše sidecar.
+
+    Args:
+        rng: (obraz, start, délka) – partition uvnitř souboru obrazu, None = zařízení pdev
+        progress: vypisovat průběh na terminál
+        report: callback(přečteno B) místo výpisu (daemon), výjimka čtení přeruší
+    """
+    gzProgress = agz.print_progress if progress else None
+    rawProgress = pipeline.print_progress if progress else None
+    if report is not None:
+        gzProgress = lambda d, t, r, l: report(d)
+        rawProgress = lambda d, t, r, b: report(d)
+    if rng is None:
+        with throttle.cgroup_limit([pdev]):
+            if adaptive:
+                stats = agz.compress_file(pdev, img_path, workers=workers, progress=gzProgress)
+                agz.print_summary(stats)
+                digest = stats["sha256"]
+            else:
+                digest = pipeline.copy_file(pdev, img_path, hashOut=True, progress=rawProgress)["sha256"]
+    else:
+        with imgsrc.c_range_reader(*rng) as src:
+            if adaptive:
+                with streams.open_sink(img_path) as fo:
+                    stats = agz.compress_stream(src, fo, src.size, workers=workers, progress=gzProgress)
+                agz.print_summary(stats)
+                digest = stats["sha256"]
+            else:
+                sha = pipeline.c_sha256()
+                with streams.open_sink(img_path, src.size) as fo:
+                    pipeline.run(src, fo, src.size, [sha], progress=rawProgress)
+                digest = sha.hexdigest()
+            if src.extents is not None and src.dataBytes < src.size:
+                print(f"[HOLE] {pdev}: {(src.size - src.dataBytes) / 1024 / 1024:.1f} MiB děr se nečetlo")
+
+    # SHA256 sidecar
+    th.write_sha256_sidecar(img_path, digest)
+    return digest
+
+
+def diskImgLikeBackup(disk: str, destDir: str, name: Optional[str] = None, adaptive: bool = False,
+                      interactive: bool = True, workers: Optional[int] = None, reuse: bool = True,
+                      scratch: Optional[list] = None, parallel: Optional[int] = None,
+                      progress: Optional[Callable[[int, Optional[int]], None]] = None) -> str:
     """
     Vytvoří „disk image like“ zálohu:
       - uloží GPT layout (sfdisk -d)
       - uloží RAW obrazy všech partition (dd, bez komprese)
+        nebo s adaptive=True adaptivní gzip (.part.gz)
       - vygeneruje SHA256 sidecar pro každou partition
+      - swap a scratch partition se nekopírují, v manifestu jsou jako
+        "action": "recreate" (fstype, UUID, label) a restore je vytvoří znovu
       - vytvoří manifest.json
 
     Struktura:
@@ -43,32 +189,59 @@ def diskImgLikeBackup(disk: str, destDir: str, name: Optional[str] = None) -> st
           p1_...part.sha256
           ...
 
+    Zdroj může být i soubor obrazu disku (vendor .img) – tabulka oddílů se čte
+    přímo ze souboru (libs/gpt), typ FS podle signatur a partition se čtou jako
+    rozsahy souboru bez děr (SEEK_DATA), souběžně a bez losetup / roota.
+
     Args:
-        disk: název disku bez /dev (např. "sdf").
+        disk: název disku bez /dev (např. "sdf") nebo cesta k obrazu disku.
         destDir: cílový adresář, ve kterém se vytvoří subdir pro backup.
         name: volitelné jméno backupu; pokud None, zeptá se uživatele.
+        adaptive: komprimovat partition adaptivním gzipem (úroveň podle rychlosti čtení).
+        interactive: False = na nic se neptá (dávka/daemon), zálohují se všechny partition
+            a závěrečná SHA256 kontrola se přeskočí.
+        workers: počet kompresních vláken pro adaptive (None = počet CPU).
+        reuse: partition se stejným otiskem (libs/partfp) jako v poslední dobré
+            sadě stejné karty se nečtou, obraz se převezme (reflink/hardlink).
+        scratch: partition (čísla nebo labely), jejichž obsah se nezálohuje –
+            restore na nich jen vytvoří prázdný FS (mkfs) s původním UUID a labelem.
+        parallel: počet souběžně čtených partition, jen u obrazu (None = podle CPU).
+        progress: callback(done, total) přes všechny čtené partition (daemon) místo
+            výpisu; vyhozená výjimka (JobCancelled) zálohu přeruší.
 
     Returns:
         Cesta k vytvořenému backup adresáři (str).
     """
-    dev = f"/dev/{disk}"
     base_dest = Path(destDir).resolve()
     base_dest.mkdir(parents=True, exist_ok=True)
 
-    # Ověřit, že disk existuje
-    try:
-        th.run(["lsblk", "-dn", dev])
-    except Exception as e:
-        raise RuntimeError(f"Disk {dev} neexistuje nebo není dostupný") from e
+    image = imgsrc.is_image(disk)
+    if image:
+        # obraz disku: GPT i FS se čtou přímo ze souboru (imgsrc.partitions ověří GPT)
+        imgPath = Path(disk).resolve()
+        dev = str(imgPath)
+        disk = imgPath.name
+        table, imgParts = imgsrc.partitions(imgPath)
+        default_name = imgPath.name.split(".")[0]
+    else:
+        dev = f"/dev/{disk}"
+        default_name = disk
 
-    # Ověřit, že je GPT (bod 4 – jen GPT)
-    parted_out = th.runRet(["parted", "-s", dev, "print"])
-    if "Partition Table: gpt" not in parted_out:
-        raise RuntimeError(f"Disk {dev} není GPT (Partition Table: gpt).")
+        # Ověřit, že disk existuje
+        try:
+            th.run(["lsblk", "-dn", dev])
+        except Exception as e:
+            raise RuntimeError(f"Disk {dev} neexistuje nebo není dostupný") from e
+
+        # Ověřit, že je GPT (bod 4 – jen GPT)
+        parted_out = th.runRet(["parted", "-s", dev, "print"])
+        if "Partition Table: gpt" not in parted_out:
+            raise RuntimeError(f"Disk {dev} není GPT (Partition Table: gpt).")
 
     # Jméno backupu
+    if name is None and not interactive:
+        name = default_name
     if name is None:
-        default_name = disk
         entered = input(f"Zadej název backupu (bez timestampu, prázdné = {default_name}): ").strip()
         if not entered:
             entered = default_name
@@ -82,86 +255,188 @@ def diskImgLikeBackup(disk: str, destDir: str, name: Optional[str] = None) -> st
 
     # 1) Uložit GPT layout
     layout_path = backup_dir / "layout.gpt"
-    layout_text = th.runRet(["sfdisk", "-d", dev])
+    layout_text = gpt.sfdisk_dump(table, dev) if image else th.runRet(["sfdisk", "-d", dev])
     layout_path.write_text(layout_text, encoding="utf-8")
     print(f"[INFO] Uložen layout: {layout_path}")
 
-    # 2) Najít partition přes lsblk (JSON)
-    lsblk_json = th.runRet(["lsblk", "-J", "-b", "-o", "NAME,TYPE,FSTYPE,LABEL,SIZE", dev])
-    data = json.loads(lsblk_json)
-
+    # 2) Najít partition přes lsblk (JSON), u obrazu z tabulky oddílů
     parts = []
-    for node in data.get("blockdevices", []):
-        if node.get("type") == "disk":
-            for ch in node.get("children", []):
-                if ch.get("type") == "part":
-                    parts.append(ch)
+    if image:
+        for p in imgParts:
+            parts.append({"name": f"{disk}{p['num']}", "num": p["num"], "size": p["size"],
+                          "fstype": p["fstype"], "label": p["label"], "uuid": p["uuid"],
+                          "range": (str(imgPath), p["start"], p["size"])})
+    else:
+        lsblk_json = th.runRet(["lsblk", "-J", "-b", "-o", "NAME,TYPE,FSTYPE,LABEL,UUID,SIZE", dev])
+        data = json.loads(lsblk_json)
+        for node in data.get("blockdevices", []):
+            if node.get("type") == "disk":
+                for ch in node.get("children", []):
+                    if ch.get("type") == "part":
+                        parts.append(ch)
 
     if not parts:
         raise RuntimeError(f"Disk {dev} neobsahuje žádné partition, není co zálohovat.")
 
+    # identita karty pro katalog (jiné sdX po přepojení je pořád tatáž karta)
+    if image:
+        ident = {"serial": None, "ptuuid": table["disk_guid"].lower(),
+                 "partuuids": {f"{disk}{p['num']}": p["guid"].lower() for p in imgParts}}
+    else:
+        try:
+            ident = catalog.disk_identity(dev)
+        except Exception as e:
+            print(f"[WARN] Nelze zjistit serial/PTUUID {dev}: {e}")
+            ident = {"serial": None, "ptuuid": None, "partuuids": {}}
+
     manifest = {
         "type": "imgtool-disk-backup",
         "version": 1,
         "source_disk": disk,
+        "serial": ident["serial"],
+        "ptuuid": ident["ptuuid"],
         "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         "partitions": []
     }
+    if image:
+        manifest["source_image"] = dev
+
+    prevDir, prevParts = _previous_parts(base_dest, disk, ident) if reuse else (None, {})
 
     # 3) Pro každou partition dd → .part + SHA256
+    todo = []
     for part in parts:
         pname = part["name"]          # např. sdf1
-        pdev = f"/dev/{pname}"
+        rng = part.get("range")
+        pdev = f"{dev}:p{part['num']}" if rng else f"/dev/{pname}"
         size_bytes = int(part.get("size", 0))
         fstype = part.get("fstype") or ""
         label = part.get("label") or ""
 
         # číslo partition z názvu
-        m = re.match(r"^([a-zA-Z]+)(\d+)$", pname)
-        if not m:
-            raise RuntimeError(f"Neznámý formát názvu partition: {pname}")
-        pnum = int(m.group(2))
+        if rng:
+            pnum = part["num"]
+        else:
+            m = re.match(r"^([a-zA-Z]+)(\d+)$", pname)
+            if not m:
+                raise RuntimeError(f"Neznámý formát názvu partition: {pname}")
+            pnum = int(m.group(2))
 
         # název souboru: p<num>_<label_or_name>.part
         base_part_name = label if label else pname
         img_name = f"p{pnum}_{base_part_name}.part"
+        if adaptive:
+            img_name += ".gz"
         img_path = backup_dir / img_name
 
+        # swap / scratch – jen metadata, obsah se při restore vytvoří znovu
+        swap = fstype == "swap" or (not rng and has_swap_signature(pdev))
+        if swap or _is_scratch(scratch or [], pnum, pname, label):
+            manifest["partitions"].append({
+                "num": pnum,
+                "name": base_part_name,
+                "devname": pname,
+                "partuuid": ident["partuuids"].get(pname),
+                "fstype": "swap" if swap else fstype,
+                "size_bytes": size_bytes,
+                "action": "recreate",
+                "uuid": part.get("uuid"),
+                "label": label or None,
+            })
+            print(f"[{'SWAP' if swap else 'SCRATCH'}] {pdev} ({size_bytes} B) se nekopíruje, "
+                  f"restore ho vytvoří znovu (UUID {part.get('uuid') or '-'})")
+            continue
+
         print(f"[PART] {pdev} ({fstype or 'unknown'}, {size_bytes} B) → {img_name}")
-        if not confirm(f"Zálohovat partition {pdev} do {img_name}?"):
+        if interactive and not confirm(f"Zálohovat partition {pdev} do {img_name}?"):
             print(f"[SKIP] {pdev}")
             continue
 
-        th.run([
-            "dd",
-            f"if={pdev}",
-            f"of={str(img_path)}",
-            "bs=4M",
-            "status=progress"
-        ])
-
-        # SHA256 sidecar
-        th.write_sha256_sidecar(img_path)
-
-        manifest["partitions"].append({
+        codec = "gzip" if adaptive else "raw"
+        try:
+            if not reuse:
+                fp = None
+            elif rng:
+                fp = partfp.fingerprint(rng[0], fstype, start=rng[1], length=rng[2])
+            else:
+                fp = partfp.fingerprint(pdev, fstype)
+        except OSError as e:
+            print(f"[WARN] Otisk {pdev} nelze zjistit: {e}")
+            fp = None
+        reused = _reuse_part(prevParts.get(pnum), prevDir, img_path, fp, size_bytes, codec)
+
+        if not reused:
+            todo.append((pdev, img_path, rng, size_bytes))
+
+        entry = {
             "num": pnum,
             "name": base_part_name,
             "devname": pname,
+            "partuuid": ident["partuuids"].get(pname),
             "fstype": fstype,
             "size_bytes": size_bytes,
-            "filename": img_name
-        })
+            "filename": img_name,
+            "codec": codec,
+            "fingerprint": fp
+        }
+        if reused:
+            entry["reused_from"] = prevDir.name
+        manifest["partitions"].append(entry)
+
+    # partition obrazu jsou nezávislé rozsahy souboru – čtou se souběžně
+    if image and parallel is None:
+        parallel = min(len(todo), os.cpu_count() or 1)
+    total = sum(t[3] for t in todo)
+    partDone: dict[Path, int] = {}
+    doneLock = threading.Lock()
+
+    def reporter(img_path: Path) -> Optional[Callable[[int], None]]:
+        if progress is None:
+            return None
+
+        def report(done: int) -> None:
+            with doneLock:
+                partDone[img_path] = done
+                sumDone = sum(partDone.values())
+            progress(sumDone, total)
+        return report
+
+    if not image or (parallel or 1) <= 1 or len(todo) <= 1:
+        for pdev, img_path, rng, size_bytes in todo:
+            if progress is not None:
+                progress(sum(partDone.values()), total)
+            _read_part(pdev, img_path, adaptive, workers, rng, progress is None, reporter(img_path))
+    else:
+        print(f"[PART] Čtení {len(todo)} partition souběžně ({parallel} vláken)")
+        with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix="bkpart") as ex:
+            futs = {ex.submit(_read_part, pdev, img_path, adaptive, workers, rng, False, reporter(img_path)): img_path
+                    for pdev, img_path, rng, size_bytes in todo}
+            for f in futs:
+                f.result()
+                print(f"[PART] Hotovo: {futs[f].name}")
+    if progress is not None:
+        progress(total, total)
 
     # 4) Uložit manifest
     manifest_path = backup_dir / "manifest.json"
     manifest_path.write_text(json.dumps(manifest, indent=2, ensure_ascii=False), encoding="utf-8")
     print(f"[INFO] Uložen manifest: {manifest_path}")
+    catalog.register_set(backup_dir)
+
+    # nezměněné partition sdílí data s předchozí generací (reflink, na ext4 hardlink)
+    try:
+        st = reflink.dedupe_against_previous(backup_dir)
+        if st["bytes"]:
+            print(f"[DEDUP] Sdíleno s předchozí zálohou: {st['bytes'] / 1024 / 1024:.1f} MiB")
+    except Exception as e:
+        print(f"[WARN] Sdílení s předchozí zálohou selhalo: {e}")
 
     # 5) Dotaz na kontrolu SHA256 všech IMG po záloze (bod 5)
-    if confirm("Provést kontrolu SHA256 všech IMG souborů v backupu?"):
+    if interactive and confirm("Provést kontrolu SHA256 všech IMG souborů v backupu?"):
         for p in manifest["partitions"]:
-            img_path = backup_dir / p["filename"]
-            verify_sha256_sidecar(img_path)
+            if p.get("filename"):
+                verify_sha256_sidecar(backup_dir / p["filename"])
+        catalog.set_hash_status(backup_dir, "ok")
         print("[INFO] SHA256 kontrola všech partition úspěšná.")
     else:
         print("[INFO] SHA256 kontrola přeskočena na žádost uživatele.")
@@ -169,7 +444,119 @@ def diskImgLikeBackup(disk: str, destDir: str, name: Optional[str] = None) -> st
     print(f"[DONE] Disk backup hotov: {backup_dir}")
     return str(backup_dir)
 
-def diskImgLikeRestore(src: str, destDisk: str, verifySha: bool = True) -> None:
+def _recreate_in_image(p: dict, target: Path, start: int, size: int) -> None:
+    """Swap / scratch partition uvnitř obrazu: hlavička swapu přímo, FS přes mkfs s offsetem."""
+    fs = (p.get("fstype") or "").lower()
+    uuid, label = p.get("uuid"), p.get("label")
+    if fs == "swap":
+        imgsrc.write_swap(target, start, size, uuid, label)
+    elif fs in ("ext2", "ext3", "ext4"):
+        cmd = [f"mkfs.{fs}", "-F", "-q", "-E", f"offset={start}"]
+        cmd += ["-U", uuid] if uuid else []
+        cmd += ["-L", label] if label else []
+        th.run(cmd + [str(target), f"{size // 1024}k"])
+    elif fs in ("vfat", "fat"):
+        cmd = ["mkfs.vfat", "--offset", str(start // 512)]
+        cmd += ["-i", uuid.replace("-", "")] if uuid else []
+        cmd += ["-n", label] if label else []
+        th.run(cmd + [str(target), str(size // 1024)])
+    else:
+        print(f"[SKIP] p{p['num']} ({fs or 'bez FS'}) – v obrazu zůstane prázdná")
+        return
+    print(f"[RECREATE] p{p['num']} {fs} (UUID {uuid or '-'})")
+
+
+def _restore_into_image(backup_dir: Path, parts: list[dict], layout_path: Path, target: Path,
+                        imageSize: Optional[int] = None) -> None:
+    """Obnova sady do nového řídkého obrazu disku (bez losetup a bez roota).
+
+    GPT se zapíše přímo (libs/gpt), partition na své offsety a nulové bloky se
+    nezapisují. e2fsck běží přímo nad "obraz?offset=N". Volitelně se poslední
+    ext4 partition zvětší na konec obrazu – resize2fs ale běžný soubor zkracuje
+    na velikost FS, takže ta partition roste v dočasném řídkém souboru a do
+    obrazu se nakopíruje až po resize.
+    """
+    table = gpt.parse_sfdisk(layout_path.read_text(encoding="utf-8"))
+    sec = table["sector"]
+    tail = (gpt.table_sectors(sec) + 1) * sec
+    need = max((p["start"] + p["size"] for p in table["parts"]), default=0) + tail
+    orig = (table["last_lba"] + 1) * sec + tail if table.get("last_lba") else need
+    size = (imageSize or max(orig, need)) // sec * sec
+    if size < need:
+        raise RuntimeError(f"Obraz {size} B je menší, než layout potřebuje ({need} B).")
+
+    # poslední partition (podle umístění) lze roztáhnout na konec obrazu
+    layoutParts = {p["num"]: p for p in table["parts"]}
+    manParts = {p["num"]: p for p in parts}
+    last = max(table["parts"], key=lambda p: p["start"], default=None)
+    end = size - tail
+    grow = (last is not None and last["start"] + last["size"] < end
+            and (manParts.get(last["num"], {}).get("fstype") or "") == "ext4"
+            and manParts[last["num"]].get("action") != "recreate"
+            and confirm(f"Zvětšit poslední ext4 partition p{last['num']} na konec obrazu "
+                        f"(+{(end - last['start'] - last['size']) / 1024 / 1024:.0f} MiB)?"))
+    growFile = None
+    if grow:
+        growFile = target.with_name(f"{target.name}.p{last['num']}.tmp")
+        origSize = last["size"]
+        last["size"] = end - last["start"]
+
+    print(f"[LAYOUT] Nový řídký obraz {target} ({size} B), GPT zapsán přímo")
+    with open(target, "wb") as f:
+        f.truncate(size)
+    fd = os.open(target, os.O_WRONLY)
+    try:
+        gpt.write(fd, table, size)
+    finally:
+        os.close(fd)
+
+    for p in parts:
+        lp = layoutParts.get(p["num"])
+        if lp is None:
+            raise RuntimeError(f"Partition {p['num']} z manifestu chybí v layout.gpt")
+        if p.get("action") == "recreate":
+            _recreate_in_image(p, target, lp["start"], lp["size"])
+            continue
+        img_path = backup_dir / p["filename"]
+        print(f"[RESTORE] {img_path.name} → {target.name} @ {lp['start']}")
+        out = (target, lp["start"], lp["size"])
+        if growFile is not None and lp is last:
+            with open(growFile, "wb") as f:
+                f.truncate(origSize)
+            out = (growFile, 0, lp["size"])
+        with imgsrc.c_range_writer(*out) as fo:
+            if p.get("codec") == "gzip":
+                with img_path.open("rb") as fi:
+                    pgunzip.print_summary(pgunzip.decompress_stream(fi, fo, img_path.stat().st_size))
+            else:
+                with img_path.open("rb", buffering=0) as fi:
+                    pipeline.run(fi, fo, img_path.stat().st_size)
+        print(f"[HOLE] p{p['num']}: zapsáno {fo.written / 1024 / 1024:.1f} MiB z {lp['size'] / 1024 / 1024:.1f} MiB")
+
+    ext4 = [{"num": p["num"], "dev": f"{target}?offset={layoutParts[p['num']]['start']}", "fstype": "ext4"}
+            for p in parts if p.get("fstype") == "ext4" and p.get("action") != "recreate"]
+    for e in ext4:
+        if growFile is not None and e["num"] == last["num"]:
+            e.update(dev=str(growFile), size=last["size"])
+    fsck = bool(ext4) and confirm("Spustit e2fsck -f na ext4 partition v obrazu?")
+    try:
+        if fsck or grow:
+            steps = postrestore.plan(str(target), ext4, fsck=fsck, resize=[last["num"]] if grow else False)
+            wall = postrestore.run(steps)
+            if not postrestore.print_report(steps, wall):
+                print("[WARN] Některé kroky selhaly – zkontroluj partition ručně (e2fsck -f).")
+        if growFile is not None:
+            print(f"[RESIZE] p{last['num']} → {target.name} @ {last['start']}")
+            with imgsrc.c_range_reader(growFile, 0, last["size"]) as fi, \
+                    imgsrc.c_range_writer(target, last["start"], last["size"]) as fo:
+                pipeline.run(fi, fo, last["size"], progress=None)
+    finally:
+        if growFile is not None:
+            growFile.unlink(missing_ok=True)
+
+
+def diskImgLikeRestore(src: str, destDisk: str, verifySha: bool = True, delta: bool = False,
+                       imageSize: Optional[int] = None) -> None:
     """
     Obnoví disk z adresářové zálohy vytvořené diskImgLikeBackup().
 
@@ -181,17 +568,27 @@ def diskImgLikeRestore(src: str, destDisk: str, verifySha: bool = True) -> None:
       - volitelně nabídne:
           - e2fsck -f na ext4 partition
           - resize2fs na ext4 partition (rozšíření na velikost partition)
+        (obojí běží přes libs/postrestore – partition souběžně)
 
     Args:
         src: cesta k adresáři s backupem.
-        destDisk: cílový disk (bez /dev, např. "sdf").
+        destDisk: cílový disk (bez /dev, např. "sdf") nebo cesta k novému souboru
+            obrazu (řídký, GPT a partition se zapíšou bez losetup / roota).
         verifySha: zda nabídnout před restore kontrolu SHA256.
+        delta: na partition zapsat jen bloky, které se liší (karta s podobnou zálohou).
+        imageSize: velikost cílového obrazu v bajtech, None = velikost původního disku.
     """
     backup_dir = Path(src).resolve()
     if not backup_dir.is_dir():
         raise RuntimeError(f"Backup adresář neexistuje: {backup_dir}")
 
-    dev = f"/dev/{destDisk}"
+    toImage = imgsrc.is_image_target(destDisk)
+    if toImage and delta:
+        raise ValueError("Delta obnova do nového obrazu nemá smysl (obraz je prázdný).")
+    if not toImage:
+        # --disk /dev/sdb i sdb
+        destDisk = os.path.basename(destDisk)
+    dev = str(Path(destDisk).resolve()) if toImage else f"/dev/{destDisk}"
 
     manifest_path = backup_dir / "manifest.json"
     layout_path = backup_dir / "layout.gpt"
@@ -220,12 +617,17 @@ def diskImgLikeRestore(src: str, destDisk: str, verifySha: bool = True) -> None:
     # Volitelná SHA256 kontrola všech IMG před zápisem
     if verifySha and confirm("Provést SHA256 kontrolu všech IMG souborů před obnovou?"):
         for p in parts:
-            img_path = backup_dir / p["filename"]
-            verify_sha256_sidecar(img_path)
+            if p.get("filename"):
+                verify_sha256_sidecar(backup_dir / p["filename"])
         print("[INFO] SHA256 kontrola všech IMG proběhla v pořádku.")
     else:
         print("[INFO] Předběžná SHA256 kontrola přeskočena.")
 
+    if toImage:
+        _restore_into_image(backup_dir, parts, layout_path, Path(dev), imageSize)
+        print(f"[DONE] Obnova do obrazu dokončena: {dev}")
+        return
+
     # 1) Obnova GPT layoutu
     print(f"[LAYOUT] Obnova GPT layoutu na {dev}")
     layout_text = layout_path.read_text(encoding="utf-8")
@@ -244,52 +646,55 @@ def diskImgLikeRestore(src: str, destDisk: str, verifySha: bool = True) -> None:
     # 2) Obnova jednotlivých partition
     for p in parts:
         pnum = p["num"]
-        fname = p["filename"]
         fstype = p.get("fstype") or ""
-        img_path = backup_dir / fname
 
         # pro /dev/sdX formát stačí /dev/sdX + číslo
         pdev = f"{dev}{pnum}"
 
+        if p.get("action") == "recreate":
+            cmd = _recreate_cmd(p, pdev)
+            if cmd is None:
+                print(f"[SKIP] {pdev} – scratch partition bez FS, nechává se prázdná")
+            elif confirm(f"Vytvořit znovu {fstype} na {pdev} ({' '.join(cmd[:-1])})?"):
+                th.run(cmd)
+            else:
+                print(f"[SKIP] {pdev}")
+            continue
+
+        img_path = backup_dir / p["filename"]
+
         print(f"[RESTORE] {img_path.name} → {pdev}")
         if not confirm(f"Obnovit IMG {img_path.name} na {pdev}?"):
             print(f"[SKIP] {pdev}")
             continue
 
-        th.run([
-            "dd",
-            f"if={str(img_path)}",
-            f"of={pdev}",
-            "bs=4M",
-            "status=progress"
-        ])
+        if delta:
+            with throttle.cgroup_limit([pdev]):
+                chunkhash.print_report(chunkhash.delta_restore(img_path, pdev))
+        elif p.get("codec") == "gzip":
+            with throttle.cgroup_limit([pdev]):
+                pgunzip.print_summary(pgunzip.decompress_file(img_path, pdev))
+        else:
+            with throttle.cgroup_limit([pdev]):
+                zcopy.copy_file(img_path, pdev)
 
         # Po zápisu můžeme volitelně ověřit SHA proti sidecar ještě jednou
         # (ale většinou stačí předběžná kontrola)
 
-    # 3) Nabídnout kontrolu ext4 filesystemů
-    ext4_parts = [p for p in parts if (p.get("fstype") or "") == "ext4"]
-    if ext4_parts and confirm("Spustit e2fsck -f na ext4 partition po obnově?"):
-        for p in ext4_parts:
-            pnum = p["num"]
-            pdev = f"{dev}{pnum}"
-            print(f"[FSCK] e2fsck -f {pdev}")
-            # Bez -y, aby ses mohl rozhodnout, co opravit
-            th.run(["e2fsck", "-f", pdev])
-    else:
-        if ext4_parts:
-            print("[INFO] Kontrola e2fsck na ext4 partition přeskočena.")
-
-    # 4) Nabídnout rozšíření ext4 filesystemů na velikost partition
-    if ext4_parts and confirm("Rozšířit ext4 filesystem(y) na plnou velikost partition (resize2fs)?"):
-        for p in ext4_parts:
-            pnum = p["num"]
-            pdev = f"{dev}{pnum}"
-            print(f"[RESIZE] resize2fs {pdev}")
-            th.run(["resize2fs", pdev])
-    else:
-        if ext4_parts:
-            print("[INFO] Rozšíření ext4 partition přeskočeno.")
+    # 3) Kontrola a rozšíření ext4 filesystemů, partition souběžně
+    ext4_parts = [p for p in parts if (p.get("fstype") or "") == "ext4" and p.get("action") != "recreate"]
+    fsck = bool(ext4_parts) and confirm("Spustit e2fsck -f na ext4 partition po obnově?")
+    if ext4_parts and not fsck:
+        print("[INFO] Kontrola e2fsck na ext4 partition přeskočena.")
+    resize = bool(ext4_parts) and confirm("Rozšířit ext4 filesystem(y) na plnou velikost partition (resize2fs)?")
+    if ext4_parts and not resize:
+        print("[INFO] Rozšíření ext4 partition přeskočeno.")
+    if fsck or resize:
+        steps = postrestore.plan(destDisk, [{"num": p["num"], "dev": f"{dev}{p['num']}", "fstype": p.get("fstype")}
+                                            for p in ext4_parts], fsck=fsck, resize=resize)
+        wall = postrestore.run(steps)
+        if not postrestore.print_report(steps, wall):
+            print("[WARN] Některé kroky selhaly – zkontroluj partition ručně (e2fsck -f).")
 
     print("[DONE] Disk obnova dokončena.")
 
@@ -0,0 +1,103 @@
+"""
+Rychlý otisk (fingerprint) partition pro přeskočení nezměněných partition
+
+Místo čtení celé partition se přečte jen pár desítek KiB až jednotky MiB:
+  - ext2/3/4: čítače ze superbloku (čas zápisu a mountu, počet mountů,
+    zapsané KiB, volné bloky / inody, UUID) a hash tabulky deskriptorů skupin
+    (volné bloky a inody každé skupiny – změní se při každé alokaci)
+  - k tomu hash začátku partition a SAMPLES vzorků rozložených po celé ploše
+
+Otisk je jen pro FS, které změny zapisují do metadat; u ostatních a u partition
+připojené pro zápis (čítače v paměti jádra ještě nemusí být na disku) se vrátí
+None a partition se čte celá. Patří sem i FAT – přepsání souboru stejné velikosti
+nezmění FAT tabulku ani kořenový adresář, jen položku v podadresáři, takže by
+změněná partition mohla mít stejný otisk.
+"""
+import hashlib
+import os
+import struct
+from pathlib import Path
+
+from . import imgdiff
+
+SAMPLES: int = 64
+"""Počet vzorků rozložených po partition."""
+
+SAMPLE_SIZE: int = 64 * 1024
+"""Velikost jednoho vzorku."""
+
+HEAD: int = 1024 * 1024
+"""Začátek partition, který se hashuje celý (boot sektor, superblok, první skupina)."""
+
+VERSION = "fp1"
+
+EXT_FS: tuple[str, ...] = ("ext2", "ext3", "ext4")
+
+
+def _h(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def mounted_rw(dev: str) -> bool:
+    """True pokud je zařízení připojené pro zápis."""
+    name = os.path.basename(os.path.realpath(dev))
+    try:
+        with open("/proc/mounts", encoding="utf-8") as f:
+            for line in f:
+                cols = line.split()
+                if len(cols) >= 4 and cols[0].startswith("/dev/") \
+                        and os.path.basename(os.path.realpath(cols[0])) == name \
+                        and "rw" in cols[3].split(","):
+                    return True
+    except OSError:
+        pass
+    return False
+
+
+def ext_meta(read_at) -> bytes | None:
+    """Metadata ext2/3/4 rozhodující o změně, None = není ext."""
+    geo = imgdiff.ext_geometry(read_at, 0)
+    if not geo:
+        return None
+    sb = read_at(1024, 1024)
+    fields = b"".join(sb[o:o + n] for o, n in (
+        (0x0C, 4), (0x10, 4), (0x2C, 4), (0x30, 4), (0x34, 2), (0x3A, 2),
+        (0x40, 4), (0x68, 16), (0x158, 4), (0x178, 8)))
+    incompat, = struct.unpack_from("<I", sb, 0x60)
+    descSize = struct.unpack_from("<H", sb, 0xFE)[0] if incompat & 0x80 else 32
+    gdtOff = (geo["first_data_block"] + 1) * geo["block_size"]
+    gdt = read_at(gdtOff, geo["groups"] * max(descSize, 32))
+    return fields + _h(gdt)
+
+
+def fingerprint(dev: str | Path, fstype: str | None = None, samples: int = SAMPLES,
+                start: int = 0, length: int | None = None) -> str | None:
+    """Otisk partition (nebo obrazu partition).
+
+    Args:
+        dev: partition / soubor
+        fstype: typ FS z lsblk (ext4, vfat, …), None = poznat podle obsahu
+        start, length: partition uvnitř obrazu disku (libs/imgsrc), None = celý dev
+    Returns:
+        str | None: otisk, None = pro tuto partition nejde spolehlivě určit
+    """
+    if length is None and mounted_rw(str(dev)):
+        return None
+    fstype = (fstype or "").lower()
+    fd = os.open(dev, os.O_RDONLY)
+    try:
+        size = os.lseek(fd, 0, os.SEEK_END) if length is None else length
+        read_at = lambda off, n: os.pread(fd, n, start + off)
+        meta = ext_meta(read_at) if fstype in EXT_FS or not fstype else None
+        if meta is None:
+            return None
+        h = hashlib.blake2b(digest_size=20)
+        h.update(f"ext:{size}:".encode())
+        h.update(meta)
+        h.update(read_at(0, HEAD))
+        for i in range(samples):
+            off = (size * i // samples) // 4096 * 4096
+            h.update(read_at(off, SAMPLE_SIZE))
+        return f"{VERSION}:ext:{h.hexdigest()}"
+    finally:
+        os.close(fd)
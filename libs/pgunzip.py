@@ -0,0 +1,306 @@
+"""
+Paralelní rozbalení gzip pro restore, extract a decompress
+
+gunzip běží v jednom vlákně a na NVMe cíli nestíhá. Vícečlenný gzip, jehož
+membery nesou v hlavičce svou délku (adaptivní komprese imgtool – subfield "IG",
+nebo BGZF – subfield "BC"), se dá rozdělit na membery bez rozbalování
+a ty rozbalovat ve více vláknech (zlib uvolňuje GIL); zápis je vždy v pořadí.
+
+Ostatní gzip (gzip, pigz – jeden member bez délky) se rozbaluje v samostatném
+vlákně, které běží souběžně se zápisem, takže se aspoň překrývá CPU a I/O.
+"""
+import hashlib
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Callable, Optional
+
+from . import pagecache
+from . import throttle
+from .adaptgz import SIZE_SUBFIELD
+
+READ_SIZE: int = 1024 * 1024
+"""Velikost čtení komprimovaných dat v sekvenčním režimu."""
+
+QUEUE_CHUNKS: int = 8
+"""Max. počet rozbalených bloků čekajících na zápis v sekvenčním režimu."""
+
+_FEXTRA = 4
+_GZIP_MAGIC = b"\x1f\x8b"
+
+
+def _member_size(head: bytes) -> int | None:
+    """Z hlavičky memberu (min. 12 B + XLEN) vrátí celkovou délku memberu nebo None.
+
+    Args:
+        head: začátek memberu včetně celého FEXTRA pole
+    """
+    if len(head) < 12 or head[0] != 0x1F or head[1] != 0x8B or head[2] != 8 or not head[3] & _FEXTRA:
+        return None
+    xlen = struct.unpack_from("<H", head, 10)[0]
+    extra = head[12:12 + xlen]
+    pos = 0
+    while pos + 4 <= len(extra):
+        si = extra[pos:pos + 2]
+        ln = struct.unpack_from("<H", extra, pos + 2)[0]
+        val = extra[pos + 4:pos + 4 + ln]
+        if si == SIZE_SUBFIELD and ln == 4:
+            return struct.unpack("<I", val)[0]
+        if si == b"BC" and ln == 2:
+            # BGZF: BSIZE = celková délka bloku - 1
+            return struct.unpack("<H", val)[0] + 1
+        pos += 4 + ln
+    return None
+
+
+def _read_exact(src: BinaryIO, n: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = src.read(n - len(buf))
+        if not chunk:
+            break
+        buf += chunk
+    return bytes(buf)
+
+
+def _read_member(src: BinaryIO) -> tuple[bytes, bool]:
+    """Přečte další member se známou délkou.
+
+    Returns:
+        (data, indexed): indexed=False → member délku nenese, data jsou jen
+        přečtený začátek a zbytek se musí rozbalit sekvenčně
+    """
+    head = _read_exact(src, 12)
+    if len(head) < 12:
+        return head, False
+    if not head[3] & _FEXTRA:
+        return head, False
+    xlen = struct.unpack_from("<H", head, 10)[0]
+    head += _read_exact(src, xlen)
+    size = _member_size(head)
+    if size is None or size < len(head):
+        return head, False
+    return head + _read_exact(src, size - len(head)), True
+
+
+def _inflate_member(member: bytes) -> bytes:
+    """Rozbalí jeden celý member, zlib zkontroluje CRC32 i ISIZE."""
+    d = zlib.decompressobj(31)
+    out = d.decompress(member)
+    if not d.eof:
+        raise zlib.error("Zkrácený gzip member")
+    if d.unused_data:
+        raise zlib.error("Délka memberu v hlavičce nesouhlasí s daty")
+    return out
+
+
+def is_indexed(path: str | Path) -> bool:
+    """True pokud první member nese délku (lze rozbalit paralelně)."""
+    with open(path, "rb") as f:
+        head = f.read(12)
+        if len(head) < 12:
+            return False
+        xlen = struct.unpack_from("<H", head, 10)[0] if head[3] & _FEXTRA else 0
+        return _member_size(head + f.read(xlen)) is not None
+
+
+def print_progress(done: int, total: int | None, rate: float, mode: str) -> None:
+    """Výchozí výpis průběhu, done/total jsou komprimované bajty."""
+    pct = f"{done * 100 / total:5.1f}%" if total else "  ?  "
+    sys.stdout.write(f"\r[GUNZIP] {done / 1024 / 1024 / 1024:8.2f} GiB {pct}  zápis {rate / 1024 / 1024:7.1f} MB/s  ({mode}) ")
+    sys.stdout.flush()
+
+
+class _chain_reader:
+    """Čtení přes již přečtený začátek a zbytek streamu (přechod do sekvenčního režimu)."""
+
+    def __init__(self, head: bytes, src: BinaryIO) -> None:
+        self.head = head
+        self.src = src
+
+    def read(self, n: int) -> bytes:
+        if self.head:
+            out, self.head = self.head[:n], self.head[n:]
+            return out
+        return self.src.read(n)
+
+
+def decompress_stream(
+    src: BinaryIO,
+    dst: BinaryIO,
+    total: int | None = None,
+    workers: int | None = None,
+    progress: Optional[Callable[[int, int | None, float, str], None]] = print_progress,
+) -> dict:
+    """Rozbalí gzip `src` do `dst`.
+
+    Dokud membery nesou délku, rozbalují se paralelně; od prvního memberu bez
+    délky (nebo od začátku u běžného gzip) se pokračuje sekvenčně ve vlákně
+    souběžném se zápisem.
+
+    Args:
+        total: velikost komprimovaného vstupu, jen pro výpis průběhu
+        workers: počet vláken pro paralelní režim, default počet CPU
+        progress: callback(doneIn, total, writeRate, mode), None = bez výpisu
+    Returns:
+        dict: {"bytes_in", "bytes_out", "sha256", "seconds", "mode": parallel | sequential | mixed, "members"}
+    """
+    if workers is None:
+        workers = max(1, os.cpu_count() or 1)
+    sha = hashlib.sha256()
+    st = {"in": 0, "out": 0, "members": 0}
+    t0 = time.monotonic()
+    lastPrint = 0.0
+    lastIn = 0
+    pagecache.advise_sequential(src)
+    dropIn = pagecache.c_drop_behind(src)
+    dropOut = pagecache.c_drop_behind(dst, write=True)
+
+    def write(data: bytes, mode: str) -> None:
+        nonlocal lastPrint, lastIn
+        throttle.consume(len(data))
+        dst.write(data)
+        sha.update(data)
+        st["out"] += len(data)
+        dropOut(len(data))
+        dropIn(st["in"] - lastIn)
+        lastIn = st["in"]
+        if progress:
+            now = time.monotonic()
+            if now - lastPrint >= 0.5:
+                lastPrint = now
+                progress(st["in"], total, st["out"] / max(now - t0, 1e-9), mode)
+
+    # 1) paralelní režim po memberech se známou délkou
+    rest = b""
+    pending: deque[Future] = deque()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pgunzip") as ex:
+        while True:
+            member, indexed = _read_member(src)
+            if not indexed:
+                rest = member
+                break
+            st["in"] += len(member)
+            st["members"] += 1
+            pending.append(ex.submit(_inflate_member, member))
+            while len(pending) > workers * 2:
+                write(pending.popleft().result(), "parallel")
+        while pending:
+            write(pending.popleft().result(), "parallel")
+
+    parallel = st["members"] > 0
+    # 2) sekvenční režim pro zbytek (běžný gzip / member bez délky)
+    try:
+        if rest:
+            _inflate_sequential(_chain_reader(rest, src), st, write)
+            mode = "mixed" if parallel else "sequential"
+        else:
+            mode = "parallel" if parallel else "sequential"
+    finally:
+        dropIn.close()
+        dropOut.close()
+
+    if progress:
+        progress(st["in"], total, st["out"] / max(time.monotonic() - t0, 1e-9), mode)
+        sys.stdout.write("\n")
+    return {
+        "bytes_in": st["in"],
+        "bytes_out": st["out"],
+        "sha256": sha.hexdigest(),
+        "seconds": time.monotonic() - t0,
+        "mode": mode,
+        "members": st["members"],
+    }
+
+
+def _inflate_sequential(src, st: dict, write: Callable[[bytes, str], None]) -> None:
+    """Rozbalení ve vlákně, které běží souběžně se zápisem (vícečlenný gzip podporován)."""
+    chunks: "queue.Queue[bytes | BaseException | None]" = queue.Queue(maxsize=QUEUE_CHUNKS)
+    stop = threading.Event()
+
+    def inflater() -> None:
+        try:
+            d = zlib.decompressobj(31)
+            started = False
+            # na hranici memberu (i hned po paralelních memberech) smí začít jen další member
+            boundary = st["members"] > 0
+            zeros = 0
+            while not stop.is_set():
+                data = src.read(READ_SIZE)
+                if not data:
+                    break
+                st["in"] += len(data)
+                while data:
+                    if zeros or (boundary and not _GZIP_MAGIC.startswith(data[:2])):
+                        # nulová výplň za koncem gzip (dd, páska) – gunzip ji ignoruje, my taky
+                        if data.strip(b"\0"):
+                            raise zlib.error("Za koncem gzip dat jsou nenulová data (poškozený soubor?)")
+                        zeros += len(data)
+                        break
+                    if d.eof:
+                        # další member
+                        d = zlib.decompressobj(31)
+                    out = d.decompress(data)
+                    started = True
+                    boundary = d.eof
+                    data = d.unused_data if d.eof else b""
+                    if out:
+                        chunks.put(out)
+            if started and not d.eof:
+                raise zlib.error("Neočekávaný konec gzip dat (zkrácený soubor?)")
+            if zeros:
+                print(f"\n[WARN] Za koncem gzip dat je {zeros} B nulové výplně, ignoruje se.")
+        except BaseException as e:
+            chunks.put(e)
+            return
+        chunks.put(None)
+
+    t = threading.Thread(target=inflater, name="pgunzip-seq", daemon=True)
+    t.start()
+    try:
+        while True:
+            out = chunks.get()
+            if out is None:
+                break
+            if isinstance(out, BaseException):
+                raise out
+            write(out, "sequential")
+    finally:
+        stop.set()
+        while t.is_alive():
+            try:
+                chunks.get_nowait()
+            except queue.Empty:
+                t.join(0.05)
+
+
+def decompress_file(src: str | Path, out: str | Path, workers: int | None = None,
+                    progress: Optional[Callable[[int, int | None, float, str], None]] = print_progress) -> dict:
+    """Rozbalí .gz soubor do souboru nebo na blokové zařízení a provede fsync.
+
+    Returns:
+        dict: viz decompress_stream
+    """
+    src, out = Path(src), Path(out)
+    total = src.stat().st_size
+    # blokové zařízení se nesmí zkracovat ani znovu vytvářet
+    mode = "r+b" if out.exists() and not out.is_file() else "wb"
+    with src.open("rb") as fi, open(out, mode) as fo:
+        stats = decompress_stream(fi, fo, total, workers, progress)
+        fo.flush()
+        os.fsync(fo.fileno())
+    return stats
+
+
+def print_summary(stats: dict) -> None:
+    """Vypíše souhrn rozbalení."""
+    secs = stats["seconds"] or 1e-9
+    print(f"[GUNZIP] {stats['bytes_in']} B → {stats['bytes_out']} B za {secs:.1f} s "
+          f"({stats['bytes_out'] / secs / 1024 / 1024:.1f} MB/s), režim {stats['mode']}, memberů {stats['members']}")
@@ -0,0 +1,263 @@
+"""
+Vláknová pipeline čtení → zpracování → zápis s pevným stropem paměti
+
+`dd` střídá čtení a zápis – když se zapisuje na kartu, ze zdroje se nečte
+a naopak. Tady běží čtení, zpracování (hash, kontrola nul) a zápis každé
+ve svém vlákně a bloky si předávají přes fronty. Bloky jsou předalokované
+(readinto do memoryview) a po zápisu se vrací do poolu, takže paměť je
+omezena na MEM_LIMIT bez ohledu na rychlost zařízení (vhodné i pro SBC s 1 GB).
+
+Zpracování jen čte data bloku (hash, porovnání), délku bloku nemění.
+Rozbalování má vlastní pipeline v libs/pgunzip.
+"""
+import hashlib
+import os
+import queue
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import BinaryIO, Callable, Optional
+
+from . import pagecache
+from . import streams
+from . import throttle
+
+BLOCK_SIZE: int = 4 * 1024 * 1024
+"""Velikost jednoho bloku (bufferu) pipeline."""
+
+MEM_LIMIT: int = 64 * 1024 * 1024
+"""Strop paměti pro buffery pipeline, nastavuje CLI --mem-limit."""
+
+_POLL = 0.1
+
+
+class c_buf_pool:
+    """Pool předalokovaných bufferů stejné velikosti."""
+
+    def __init__(self, bufSize: int, count: int) -> None:
+        self.bufSize = bufSize
+        self.count = count
+        self._free: "queue.Queue[bytearray]" = queue.Queue()
+        for _ in range(count):
+            self._free.put(bytearray(bufSize))
+
+    def get(self, stop: threading.Event) -> bytearray | None:
+        """Vrátí volný buffer, None pokud byla pipeline zastavena."""
+        while not stop.is_set():
+            try:
+                return self._free.get(timeout=_POLL)
+            except queue.Empty:
+                continue
+        return None
+
+    def put(self, buf: bytearray) -> None:
+        self._free.put(buf)
+
+
+def pool_for(memLimit: int | None = None, blockSize: int = BLOCK_SIZE) -> c_buf_pool:
+    """Pool podle stropu paměti, vždy aspoň dva buffery (double buffering)."""
+    memLimit = memLimit or MEM_LIMIT
+    blockSize = max(64 * 1024, min(blockSize, memLimit // 2))
+    return c_buf_pool(blockSize, max(2, memLimit // blockSize))
+
+
+_ZERO = bytes(BLOCK_SIZE)
+
+
+def is_zero(mv: memoryview) -> bool:
+    """True pokud blok obsahuje jen nuly (porovnání přes memcmp, ~GB/s)."""
+    n = len(mv)
+    return mv.tobytes() == (_ZERO if n == len(_ZERO) else bytes(n))
+
+
+class c_sha256:
+    """Zpracování bloku: průběžný SHA256 přenášených dat."""
+
+    def __init__(self) -> None:
+        self.h = hashlib.sha256()
+
+    def __call__(self, mv: memoryview) -> None:
+        self.h.update(mv)
+
+    def hexdigest(self) -> str:
+        return self.h.hexdigest()
+
+
+def print_progress(done: int, total: int | None, rate: float, bottleneck: str) -> None:
+    """Výchozí výpis průběhu na jeden řádek."""
+    pct = f"{done * 100 / total:5.1f}%" if total else "  ?  "
+    sys.stdout.write(f"\r[PIPE] {done / 1024 / 1024 / 1024:8.2f} GiB {pct}  {rate / 1024 / 1024:7.1f} MB/s  brzdí: {bottleneck:<6} ")
+    sys.stdout.flush()
+
+
+def _write_all(dst: BinaryIO, mv: memoryview) -> None:
+    done = 0
+    while done < len(mv):
+        n = dst.write(mv[done:])
+        done += n if n is not None else len(mv) - done
+
+
+def run(src: BinaryIO, dst: BinaryIO | None, total: int | None = None,
+        stages: list[Callable[[memoryview], None]] | None = None,
+        pool: c_buf_pool | None = None,
+        progress: Optional[Callable[[int, int | None, float, str], None]] = print_progress) -> dict:
+    """Přenese src → dst přes vlákna čtení, zpracování a zápisu.
+
+    Args:
+        src: zdroj s readinto (soubor / zařízení otevřené binárně, ideálně buffering=0)
+        dst: cíl s write, None = jen čtení a zpracování (např. hash nebo porovnání)
+        total: velikost zdroje, jen pro výpis průběhu
+        stages: funkce volané postupně nad každým blokem (memoryview jen pro čtení)
+        pool: pool bufferů, default podle MEM_LIMIT
+        progress: callback(done, total, rate, bottleneck), může vyhodit výjimku pro přerušení
+    Returns:
+        dict: {"bytes", "seconds", "read_wait", "write_wait", "bottleneck"}
+            read_wait = jak dlouho čtení čekalo na volný buffer (brzdí zápis),
+            write_wait = jak dlouho zápis čekal na data (brzdí čtení)
+    """
+    pool = pool or pool_for()
+    stages = stages or []
+    stop = threading.Event()
+    errors: list[BaseException] = []
+    toStage: "queue.Queue[tuple[bytearray, int] | None]" = queue.Queue()
+    toWrite: "queue.Queue[tuple[bytearray, int] | None]" = queue.Queue()
+    st = {"read": 0, "written": 0, "read_wait": 0.0, "write_wait": 0.0}
+    t0 = time.monotonic()
+    # přečtené i zapsané stránky za sebou zahazujeme z page cache
+    pagecache.advise_sequential(src)
+    dropIn = pagecache.c_drop_behind(src)
+    dropOut = pagecache.c_drop_behind(dst, write=True) if dst is not None else None
+
+    def fail(e: BaseException) -> None:
+        errors.append(e)
+        stop.set()
+
+    def qget(q: queue.Queue):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=_POLL)
+            except queue.Empty:
+                continue
+        return None
+
+    def reader() -> None:
+        try:
+            while not stop.is_set():
+                tw = time.monotonic()
+                buf = pool.get(stop)
+                st["read_wait"] += time.monotonic() - tw
+                if buf is None:
+                    return
+                throttle.consume(pool.bufSize)
+                n = src.readinto(buf)
+                if not n:
+                    pool.put(buf)
+                    break
+                st["read"] += n
+                dropIn(n)
+                toStage.put((buf, n))
+        except BaseException as e:
+            fail(e)
+        toStage.put(None)
+
+    def stager() -> None:
+        try:
+            while True:
+                item = qget(toStage)
+                if item is None:
+                    break
+                buf, n = item
+                mv = memoryview(buf)[:n]
+                for fn in stages:
+                    fn(mv)
+                toWrite.put(item)
+        except BaseException as e:
+            fail(e)
+        toWrite.put(None)
+
+    def bottleneck() -> str:
+        if st["read_wait"] > st["write_wait"] * 1.2:
+            return "zápis"
+        if st["write_wait"] > st["read_wait"] * 1.2:
+            return "čtení"
+        return "-"
+
+    threads = [threading.Thread(target=reader, name="pipe-read", daemon=True),
+               threading.Thread(target=stager, name="pipe-stage", daemon=True)]
+    for t in threads:
+        t.start()
+    lastPrint = 0.0
+    # zápis běží v hlavním vlákně, aby se výjimka z progress (zrušení) dostala ven
+    try:
+        while True:
+            tw = time.monotonic()
+            item = qget(toWrite)
+            st["write_wait"] += time.monotonic() - tw
+            if item is None:
+                break
+            buf, n = item
+            if dst is not None:
+                _write_all(dst, memoryview(buf)[:n])
+                dropOut(n)
+            st["written"] += n
+            pool.put(buf)
+            now = time.monotonic()
+            if progress and now - lastPrint >= 0.5:
+                lastPrint = now
+                progress(st["written"], total, st["written"] / max(now - t0, 1e-9), bottleneck())
+    except BaseException as e:
+        fail(e)
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+        dropIn.close()
+        if dropOut is not None:
+            dropOut.close()
+    if errors:
+        # první chyba z kteréhokoli vlákna (včetně zrušení z progress callbacku)
+        raise errors[0]
+    if progress:
+        progress(st["written"], total, st["written"] / max(time.monotonic() - t0, 1e-9), bottleneck())
+        sys.stdout.write("\n")
+    return {
+        "bytes": st["written"],
+        "seconds": time.monotonic() - t0,
+        "read_wait": round(st["read_wait"], 2),
+        "write_wait": round(st["write_wait"], 2),
+        "bottleneck": bottleneck(),
+    }
+
+
+def copy_file(src: str | Path, dst: str | Path, hashOut: bool = False,
+              progress: Optional[Callable[[int, int | None, float, str], None]] = print_progress,
+              splitSize: int | None = None) -> dict:
+    """Zkopíruje soubor / zařízení přes pipeline, volitelně se SHA256 během přenosu.
+
+    Cílové blokové zařízení se nezkracuje, cílový soubor se prealokuje na velikost
+    zdroje (pagecache.c_out_writer). Na konci proběhne fsync. dst může být i "-"
+    (stdout), roura nebo už otevřený výstup, splitSize rozdělí výstup na svazky
+    (libs/streams).
+
+    Returns:
+        dict: viz run(), navíc "sha256" pokud hashOut
+    """
+    sha = c_sha256() if hashOut else None
+    isFile = streams.is_sink(dst) or streams.is_stream(dst) or not Path(dst).exists() or Path(dst).is_file()
+    with open(src, "rb", buffering=0) as fi, pagecache.read_ahead(src):
+        try:
+            total = os.lseek(fi.fileno(), 0, os.SEEK_END)
+            os.lseek(fi.fileno(), 0, os.SEEK_SET)
+        except OSError:
+            total = None
+        if isFile:
+            with streams.open_sink(dst, total, splitSize) as fo:
+                stats = run(fi, fo, total, [sha] if sha else None, progress=progress)
+        else:
+            with open(dst, "r+b", buffering=0) as fo:
+                stats = run(fi, fo, total, [sha] if sha else None, progress=progress)
+                os.fsync(fo.fileno())
+    if sha:
+        stats["sha256"] = sha.hexdigest()
+    return stats
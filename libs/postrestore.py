@@ -0,0 +1,146 @@
+"""
+Dokončení obnovy: zvětšení partition, kontrola a zvětšení filesystemu
+
+Po obnově se pro každou ext partition sestaví řetěz kroků
+    growpart → e2fsck -f → resize2fs
+a kroky různých partition běží souběžně (jsou na sobě nezávislé). Jediná
+výjimka je growpart – mění tabulku oddílů celého disku, takže growpart
+na stejném disku běží vždy jen jeden (řetězí se za sebe).
+
+e2fsck běží v režimu -p (preen): bezpečné opravy provede sám, nic se neptá.
+Pokud najde chybu, kterou je třeba řešit ručně, krok skončí chybou a
+navazující resize2fs se přeskočí. Na konci se vypíšou časy jednotlivých kroků.
+"""
+import subprocess
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Iterable
+
+EXT_FS: tuple[str, ...] = ("ext2", "ext3", "ext4")
+"""Filesystemy, pro které má smysl e2fsck / resize2fs."""
+
+FSCK_OK: tuple[int, ...] = (0, 1, 2)
+"""Návratové kódy e2fsck, které znamenají čistý (nebo automaticky opravený) FS."""
+
+
+class c_step:
+    """Jeden krok grafu (příkaz), běží až po úspěšném dokončení všech deps."""
+
+    def __init__(self, kind: str, dev: str, cmd: list[str], deps: list["c_step"] | None = None,
+                 okCodes: Iterable[int] = (0,)) -> None:
+        self.kind = kind
+        self.dev = dev
+        self.cmd = cmd
+        self.deps = deps or []
+        self.okCodes = tuple(okCodes)
+        self.status = "pending"
+        self.seconds = 0.0
+        self.rc: int | None = None
+        self.output = ""
+
+    def __repr__(self) -> str:
+        return f"c_step({self.kind} {self.dev} {self.status})"
+
+    def run(self) -> None:
+        t0 = time.monotonic()
+        try:
+            r = subprocess.run(self.cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            self.rc = r.returncode
+            self.output = r.stdout.decode(errors="replace")
+            self.status = "ok" if r.returncode in self.okCodes else "failed"
+        except OSError as e:
+            self.output = str(e)
+            self.status = "failed"
+        self.seconds = time.monotonic() - t0
+
+
+def plan(disk: str, parts: list[dict], grow: Iterable[int] = (), fsck: bool = True,
+         resize: bool | Iterable[int] = True) -> list[c_step]:
+    """Sestaví graf kroků pro obnovené partition.
+
+    Args:
+        disk: cílový disk (sdb nebo /dev/sdb)
+        parts: [{"num", "dev", "fstype"}] obnovené partition; volitelně "size" v bajtech
+            = cílová velikost pro resize2fs (partition v obrazu, dev "obraz?offset=N")
+        grow: čísla partition, které se mají nejdřív zvětšit na volné místo (growpart)
+        fsck: spustit e2fsck -f -p na ext partition
+        resize: True = resize2fs všech ext partition, jinak jen uvedená čísla
+    Returns:
+        list[c_step]: kroky v pořadí, ve kterém byly naplánovány
+    """
+    diskDev = disk if disk.startswith("/dev/") else f"/dev/{disk}"
+    grow = set(grow)
+    steps: list[c_step] = []
+    lastGrow: c_step | None = None
+    for p in sorted(parts, key=lambda x: int(x["num"])):
+        num, dev = int(p["num"]), p["dev"]
+        isExt = (p.get("fstype") or "").lower() in EXT_FS
+        prev: c_step | None = None
+        if num in grow:
+            # growpart mění tabulku celého disku → na jednom disku vždy jen jeden
+            prev = c_step("grow", dev, ["growpart", diskDev, str(num)],
+                          [lastGrow] if lastGrow else [], okCodes=(0, 1))
+            lastGrow = prev
+            steps.append(prev)
+        if not isExt:
+            continue
+        if fsck:
+            prev = c_step("fsck", dev, ["e2fsck", "-f", "-p", dev], [prev] if prev else [], okCodes=FSCK_OK)
+            steps.append(prev)
+        if resize is True or (resize and num in set(resize)):
+            cmd = ["resize2fs", dev] + ([f"{int(p['size']) // 1024}K"] if p.get("size") else [])
+            steps.append(c_step("resize", dev, cmd, [prev] if prev else []))
+    return steps
+
+
+def run(steps: list[c_step], workers: int | None = None) -> float:
+    """Provede graf kroků, nezávislé kroky souběžně.
+
+    Krok, jehož předchůdce selhal, se přeskočí (status "skipped").
+
+    Returns:
+        float: celková doba (wall clock) v sekundách
+    """
+    t0 = time.monotonic()
+    pending = list(steps)
+    running: dict[Future, c_step] = {}
+    with ThreadPoolExecutor(max_workers=workers or max(1, len(steps)), thread_name_prefix="postrestore") as ex:
+        while pending or running:
+            for s in list(pending):
+                if any(d.status in ("failed", "skipped") for d in s.deps):
+                    s.status = "skipped"
+                    pending.remove(s)
+                elif all(d.status == "ok" for d in s.deps):
+                    print(f"[POST] {s.kind:<6} {s.dev}: {' '.join(s.cmd)}")
+                    s.status = "running"
+                    running[ex.submit(s.run)] = s
+                    pending.remove(s)
+            if not running:
+                # nic neběží a nic nejde spustit – zbytek čeká na neexistující předchůdce
+                for s in pending:
+                    s.status = "skipped"
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for f in done:
+                s = running.pop(f)
+                f.result()
+                mark = "OK" if s.status == "ok" else f"CHYBA (rc={s.rc})"
+                print(f"[POST] {s.kind:<6} {s.dev}: {mark} za {s.seconds:.1f} s")
+                if s.status != "ok" and s.output:
+                    print("\n".join("       " + ln for ln in s.output.strip().splitlines()[-10:]))
+    return time.monotonic() - t0
+
+
+def print_report(steps: list[c_step], wall: float) -> bool:
+    """Vypíše časy kroků, vrátí True pokud vše proběhlo."""
+    if not steps:
+        return True
+    tit = f"{'Krok':<7} | {'Zařízení':<16} | {'Stav':<8} | {'Čas':>8}"
+    print(tit)
+    print("-" * len(tit))
+    for s in steps:
+        secs = f"{s.seconds:.1f} s" if s.status in ("ok", "failed") else "-"
+        print(f"{s.kind:<7} | {s.dev:<16} | {s.status:<8} | {secs:>8}")
+    total = sum(s.seconds for s in steps)
+    print(f"Celkem {wall:.1f} s (sériově by to bylo {total:.1f} s)")
+    return all(s.status == "ok" for s in steps)
@@ -0,0 +1,251 @@
+"""
+Neinteraktivní jádro RAW zálohy celého disku
+
+Používá ho interaktivní `imgtool backup` i dávkový / daemon režim – tady se
+už na nic neptá, jen čte zdroj, zapisuje výstup a SHA256 sidecar.
+"""
+import datetime
+import hashlib
+import os
+import subprocess
+from pathlib import Path
+from typing import Callable, Optional
+
+import libs.toolhelp as th
+from . import adaptgz as agz
+from . import catalog
+from . import multidest
+from . import chunkhash
+from . import pagecache
+from . import parity as par
+from . import pgunzip
+from . import pipeline
+from . import streams
+from . import throttle
+from . import zcopy
+
+CODECS: dict[str, str] = {
+    "none": ".img",
+    "fast": ".img.gz",
+    "max": ".img.gz",
+    "adaptive": ".img.gz",
+}
+"""Podporované kodeky RAW zálohy a přípona výstupu."""
+
+
+def generate_base_name(disk: str, base: str | None, autoprefix: bool) -> str:
+    """
+    Vygeneruje základ jména souboru.
+    - pokud base je zadané, použije se
+    - jinak 'disk'
+    - autoprefix -> YYYY-MM-DD-HHMM_disk_base
+    """
+    if not base:
+        base = disk
+    if autoprefix:
+        prefix = datetime.datetime.now().strftime("%Y-%m-%d-%H%M")
+        return f"{prefix}_{base}"
+    return base
+
+
+def codec_from_flags(fast: bool, maxC: bool, adaptive: bool) -> str:
+    """Převede CLI přepínače na název kodeku."""
+    if adaptive:
+        return "adaptive"
+    if fast:
+        return "fast"
+    if maxC:
+        return "max"
+    return "none"
+
+
+def dd_gzip(src: str | Path, out: str | Path, level: str = "-6", splitSize: int | None = None) -> str:
+    """
+    `dd if=src | gzip level > out`, výstup jde přes streams.open_sink
+    (soubor s writebackem po oknech a fsync, stdout, roura, svazky nebo už
+    otevřený výstup, např. multidest.c_multi_sink), ne přímo z gzip do souboru.
+
+    Returns:
+        str: SHA256 výstupu (spočítaný při zápisu)
+    Raises:
+        RuntimeError: pokud dd nebo gzip skončí chybou
+    """
+    dd = ["dd", f"if={src}", "bs=4M", "status=progress"]
+    if pagecache.ENABLED:
+        # dd za sebou zahazuje přečtené stránky (POSIX_FADV_DONTNEED)
+        dd.append("iflag=nocache")
+    gz = ["gzip", level]
+    sha = hashlib.sha256()
+    with streams.open_sink(out, splitSize=splitSize) as fo:
+        p1 = subprocess.Popen(dd, stdout=subprocess.PIPE)
+        p2 = subprocess.Popen(gz, stdin=p1.stdout, stdout=subprocess.PIPE)
+        p1.stdout.close()
+        try:
+            while True:
+                data = p2.stdout.read(1024 * 1024)
+                if not data:
+                    break
+                # gzip čte z roury jen tak rychle, jak odebíráme výstup – limit platí i pro dd
+                throttle.consume(len(data))
+                sha.update(data)
+                fo.write(data)
+        finally:
+            p2.stdout.close()
+            p2.wait()
+            p1.wait()
+        if p1.returncode or p2.returncode:
+            raise RuntimeError(f"Komprese {src} selhala (dd={p1.returncode}, gzip={p2.returncode})")
+    return sha.hexdigest()
+
+
+def backup_raw(dev: str, base_name: str, codec: str = "none", workers: int | None = None,
+               progress: Optional[Callable[[int, int | None], None]] = None,
+               parity: float | None = None, splitSize: int | None = None,
+               dests: list[str] | None = None, destMode: str = "mirror") -> Path:
+    """
+    RAW záloha blokového zařízení do <base_name>.img / .img.gz + SHA256 sidecar.
+
+    base_name "-" (stdout) nebo roura se použije tak, jak je (bez přípony a
+    sidecar, SHA256 se jen vypíše); se splitSize vznikne sada svazků.
+
+    Args:
+        dev: zdrojové zařízení (/dev/sdX) nebo soubor
+        base_name: cesta k výstupu bez přípony
+        codec: none | fast | max | adaptive
+        workers: počet kompresních vláken pro adaptive (None = počet CPU)
+        progress: callback(done, total) pro daemon; průběžně hlásí vestavěné cesty
+            (none, adaptive), u dd/gzip se volá jen na konci
+        parity: redundance paritního sidecar <obraz>.par v %, None = bez parity
+            (u svazků pro každý svazek)
+        splitSize: velikost svazku v bajtech, None = jeden soubor
+        dests: cílové adresáře (libs/multidest) – zdroj se čte jednou a výstup jde
+            do všech; z base_name se pak použije jen jméno souboru
+        destMode: mirror (celá kopie v každém cíli) | stripe (svazky round-robin)
+    Returns:
+        Path: cesta k vytvořenému obrazu (u více cílů v prvním úspěšném)
+    Raises:
+        RuntimeError: u více cílů, pokud záloha není celá (mirror: v žádném cíli,
+            stripe: chybí svazek)
+    """
+    if codec not in CODECS:
+        raise ValueError(f"Neznámý kodek: {codec} (podporováno: {', '.join(CODECS)})")
+    stream = streams.is_stream(base_name)
+    out = Path(base_name if stream else base_name + CODECS[codec])
+    digest = None
+    multi = None
+    target = out
+    if dests:
+        if stream:
+            raise ValueError("Více cílů (--dest) nejde kombinovat se stdout ani s rourou")
+        multi = target = multidest.c_multi_sink(dests, out.name, destMode, splitSize)
+
+    try:
+        if codec == "adaptive":
+            with throttle.cgroup_limit([dev]), pagecache.read_ahead(dev):
+                stats = agz.compress_file(dev, target, workers=workers,
+                                          progress=(lambda d, t, r, l: progress(d, t)) if progress else agz.print_progress,
+                                          splitSize=splitSize)
+            agz.print_summary(stats)
+            digest = stats["sha256"]
+        elif codec in ("fast", "max"):
+            with throttle.cgroup_limit([dev]), pagecache.read_ahead(dev):
+                digest = dd_gzip(dev, target, "-1" if codec == "fast" else "-9", splitSize)
+        else:
+            # čtení, SHA256 a zápis souběžně v jednom průchodu (sidecar se nemusí číst znovu)
+            with throttle.cgroup_limit([dev]):
+                stats = pipeline.copy_file(dev, target, hashOut=True,
+                                           progress=(lambda d, t, r, b: progress(d, t)) if progress else pipeline.print_progress,
+                                           splitSize=splitSize)
+            digest = stats["sha256"]
+    except BaseException:
+        if multi is not None:
+            multi.abort()
+        raise
+
+    if multi is not None:
+        # sidecar si zapsal každý cíl sám
+        multi.close()
+        multidest.print_report(multi)
+        if not multi.complete:
+            raise RuntimeError("Záloha není kompletní (viz výpis cílů)")
+        for d in multi.ok:
+            if parity:
+                for p in d.paths():
+                    par.create(p, parity, progress=None if progress else par.print_progress)
+            if destMode == "mirror" and not splitSize:
+                catalog.register_raw(d.path, dev)
+        out = multi.ok[0].path
+    elif stream:
+        print(f"[SHA256] {digest}  {out}")
+    else:
+        # u svazků je <obraz>.sha256 hash celého proudu (cat <obraz>.* | sha256sum)
+        th.write_sha256_sidecar(out, digest)
+        if parity:
+            for p in streams.volumes(out) if splitSize else [out]:
+                par.create(p, parity, progress=None if progress else par.print_progress)
+        if not splitSize:
+            catalog.register_raw(out, dev)
+    if progress:
+        size = streams.size(out)
+        progress(size or 0, size)
+    return out
+
+
+def restore_raw(image: Path, dev: str, progress: Optional[Callable[[int, int | None], None]] = None,
+                delta: bool = False, dryRun: bool = False) -> int:
+    """
+    Neinteraktivní obnova .img / .img.gz na zařízení (bez dotazů a bez SHA kontroly).
+
+    Args:
+        image: zdrojový obraz, "-" (stdin), roura nebo základ sady svazků <image>.000, …
+        dev: cílové zařízení (/dev/sdX)
+        progress: callback(done, total), může vyhodit výjimku pro přerušení
+        delta: zapsat jen bloky, které se na cíli liší (libs/chunkhash)
+        dryRun: u delta nic nezapisovat, jen vypsat rozdílné rozsahy
+    Returns:
+        int: počet zapsaných bajtů
+    """
+    image = Path(image)
+    if delta:
+        with throttle.cgroup_limit([dev]):
+            res = chunkhash.delta_restore(
+                image, dev, dryRun=dryRun,
+                progress=(lambda d, t, r, m: progress(d, t)) if progress else chunkhash.print_progress)
+        chunkhash.print_report(res)
+        return res["written"]
+
+    if streams.is_stream(image) or not image.exists():
+        with throttle.cgroup_limit([dev]):
+            return _restore_stream(image, dev, progress)
+
+    if th.is_gzip(image):
+        # paralelní rozbalení (membery s délkou), jinak rozbalování souběžně se zápisem
+        with throttle.cgroup_limit([dev]):
+            stats = pgunzip.decompress_file(
+                image, dev,
+                progress=(lambda d, t, r, m: progress(d, t)) if progress else pgunzip.print_progress)
+        pgunzip.print_summary(stats)
+        return stats["bytes_out"]
+
+    with throttle.cgroup_limit([dev]):
+        stats = zcopy.copy_file(image, dev, progress=(lambda d, t, r, m: progress(d, t)) if progress else zcopy.print_progress)
+    return stats["bytes"]
+
+
+def _restore_stream(image: Path, dev: str, progress: Optional[Callable[[int, int | None], None]] = None) -> int:
+    """Obnova ze stdin / roury / sady svazků – čte se jako jeden souvislý proud."""
+    total = streams.size(image)
+    # blokové zařízení se nesmí zkracovat ani znovu vytvářet
+    mode = "r+b" if Path(dev).exists() and not Path(dev).is_file() else "wb"
+    with streams.open_source(image) as src, open(dev, mode, buffering=0) as fo:
+        if streams.is_gzip(image, src):
+            stats = pgunzip.decompress_stream(
+                src, fo, total,
+                progress=(lambda d, t, r, m: progress(d, t)) if progress else pgunzip.print_progress)
+            pgunzip.print_summary(stats)
+            n = stats["bytes_out"]
+        else:
+            n = pipeline.run(src, fo, total,
+                             progress=(lambda d, t, r, b: progress(d, t)) if progress else pipeline.print_progress)["bytes"]
+        os.fsync(fo.fileno())
+    return n
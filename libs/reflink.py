@@ -0,0 +1,216 @@
+"""
+Reflink kopie, sdílení nezměněných partition mezi generacemi a retence záloh
+
+Na btrfs / XFS (reflink=1) je kopie přes FICLONE okamžitá a nezabírá místo,
+dokud se data nezmění (copy-on-write). Na ext4 reflink není:
+  - neměnné soubory záloh se sdílí hardlinkem (záloha se nikdy neupravuje)
+  - kopie pro úpravy (loop mount) se musí zkopírovat celá, hardlink by měnil originál
+"""
+import errno
+import fcntl
+import json
+import os
+import re
+import shutil
+from datetime import datetime
+from pathlib import Path
+
+import libs.toolhelp as th
+from . import catalog
+
+FICLONE: int = 0x40049409
+"""ioctl: dst_fd sdílí všechny extenty src_fd (linux/fs.h)."""
+
+_NO_REFLINK = (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EPERM)
+
+
+def clone_file(src: str | Path, dst: str | Path) -> bool:
+    """Vytvoří dst jako reflink kopii src.
+
+    Returns:
+        bool: True pokud FS reflink podporuje, False jinak (dst se nevytvoří)
+    """
+    with open(src, "rb") as fi:
+        fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            fcntl.ioctl(fd, FICLONE, fi.fileno())
+        except OSError as e:
+            os.close(fd)
+            os.unlink(dst)
+            if e.errno in _NO_REFLINK:
+                return False
+            raise
+        os.close(fd)
+    shutil.copystat(src, dst)
+    return True
+
+
+def share_file(src: str | Path, dst: str | Path, mutable: bool = False) -> str:
+    """Zpřístupní obsah src jako dst co nejlevněji.
+
+    Args:
+        mutable: dst se bude upravovat → nelze hardlink (změnil by i src)
+    Returns:
+        str: použitá metoda reflink | hardlink | copy
+    """
+    src, dst = Path(src), Path(dst)
+    if clone_file(src, dst):
+        return "reflink"
+    if not mutable:
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+    shutil.copy2(src, dst)
+    return "copy"
+
+
+def _replace_with_shared(src: Path, dst: Path) -> str:
+    """Atomicky nahradí existující dst sdílenou kopií src."""
+    tmp = dst.with_name(dst.name + ".share-tmp")
+    tmp.unlink(missing_ok=True)
+    how = share_file(src, tmp)
+    os.replace(tmp, dst)
+    return how
+
+
+def sidecar_digest(path: str | Path) -> str | None:
+    """sha256 ze sidecaru <path>.sha256, None = sidecar chybí nebo je prázdný."""
+    sc = Path(str(path) + ".sha256")
+    try:
+        return sc.read_text(encoding="utf-8").split()[0]
+    except (OSError, IndexError):
+        return None
+
+
+def copy_image(src: str | Path, dst: str | Path, forEdit: bool = True) -> str:
+    """Kopie obrazu (např. golden .img pro úpravy přes loop mount) včetně sidecar.
+
+    Returns:
+        str: použitá metoda reflink | hardlink | copy
+    """
+    src, dst = Path(src), Path(dst)
+    if dst.exists():
+        raise FileExistsError(f"Cíl už existuje: {dst}")
+    how = share_file(src, dst, mutable=forEdit)
+    sc = Path(str(src) + ".sha256")
+    if sc.exists():
+        # sidecar obsahuje jméno souboru → přepíšeme na nové jméno
+        th.write_sha256_sidecar(dst, sidecar_digest(src))
+    print(f"[COPY] {src.name} → {dst} ({how})")
+    return how
+
+
+def dedupe_against_previous(setDir: str | Path) -> dict[str, int]:
+    """Nahradí partition obrazy, které se od předchozí generace nezměnily, sdílenou kopií.
+
+    Předchozí generace = poslední dobrá sada stejné karty (serial/PTUUID,
+    jinak jméno disku) ve stejném nadřazeném adresáři, hledá se v katalogu.
+    Shoda se posuzuje podle SHA256 ze sidecar a velikosti.
+
+    Returns:
+        dict: počty {"reflink": n, "hardlink": n, "copy": n, "bytes": sdílených bajtů}
+    """
+    setDir = Path(setDir).resolve()
+    manifest = json.loads((setDir / "manifest.json").read_text(encoding="utf-8"))
+    stats = {"reflink": 0, "hardlink": 0, "copy": 0, "bytes": 0}
+    prev = [r for r in catalog.list_sets(root=setDir.parent, disk=manifest.get("source_disk"),
+                                         serial=manifest.get("serial"), ptuuid=manifest.get("ptuuid"),
+                                         kind=manifest.get("type"), good=True)
+            if r["path"] != str(setDir)]
+    if not prev:
+        return stats
+    prevDir = Path(prev[0]["path"])
+    prevParts = {(p["num"], p.get("codec")): p for p in catalog.parts_of(prev[0]["id"])}
+
+    for p in manifest.get("partitions", []):
+        old = prevParts.get((p["num"], p.get("codec", "raw")))
+        if not old or not old.get("filename") or not p.get("filename"):
+            continue
+        newFile = setDir / p["filename"]
+        oldFile = prevDir / old["filename"]
+        if not oldFile.is_file() or not newFile.is_file():
+            continue
+        if oldFile.stat().st_size != newFile.stat().st_size:
+            continue
+        d = sidecar_digest(newFile)
+        if d is None or d != sidecar_digest(oldFile):
+            continue
+        if os.path.samefile(oldFile, newFile):
+            continue
+        how = _replace_with_shared(oldFile, newFile)
+        if how == "copy":
+            # jiný FS – nic neušetříme, ale obsah je stejný
+            continue
+        stats[how] += 1
+        stats["bytes"] += newFile.stat().st_size
+        print(f"[DEDUP] {p['filename']} beze změny od {prevDir.name} → {how}")
+    return stats
+
+
+def select_keep(rows: list[dict], keepDaily: int, keepWeekly: int, keepLast: int = 1) -> set[str]:
+    """Vybere cesty sad, které se ponechají (rows seřazené od nejnovější).
+
+    Ponechá keepLast nejnovějších, nejnovější sadu z každého z posledních
+    keepDaily dnů se zálohou a z každého z posledních keepWeekly týdnů (ISO).
+    """
+    keep: set[str] = set(r["path"] for r in rows[:keepLast])
+    days: list[str] = []
+    weeks: list[tuple[int, int]] = []
+    for r in rows:
+        dt = datetime.strptime(r["created"], "%Y-%m-%d %H:%M:%S")
+        day = dt.strftime("%Y-%m-%d")
+        week = tuple(dt.isocalendar())[:2]
+        if day not in days and len(days) < keepDaily:
+            days.append(day)
+            keep.add(r["path"])
+        if week not in weeks and len(weeks) < keepWeekly:
+            weeks.append(week)
+            keep.add(r["path"])
+    return keep
+
+
+def _remove_set(row: dict) -> None:
+    p = Path(row["path"])
+    if p.is_dir():
+        shutil.rmtree(p)
+    else:
+        p.unlink(missing_ok=True)
+        Path(str(p) + ".sha256").unlink(missing_ok=True)
+        Path(str(p) + ".par").unlink(missing_ok=True)
+
+
+def prune(root: str | Path, keepDaily: int = 7, keepWeekly: int = 4, keepLast: int = 1,
+          dryRun: bool = False) -> list[dict]:
+    """Retence: pro každou kartu (serial/PTUUID, jinak disk) ponechá denní a týdenní sady.
+
+    Protože nezměněné partition sdílí extenty (reflink/hardlink), smazání
+    staré generace uvolní jen data, která se od té doby změnila.
+
+    Returns:
+        list[dict]: smazané (nebo při dryRun ke smazání určené) sady
+    """
+    root = Path(root).resolve()
+    catalog.rebuild(root)
+    groups: dict[tuple, list[dict]] = {}
+    for r in catalog.list_sets(root=root):
+        # bez identity karty seskupíme podle jména bez časového prefixu (2025-01-31-1200_opi.img.gz → opi.img.gz)
+        key = (r["kind"], r["serial"] or r["ptuuid"] or re.sub(r"^\d{4}-\d{2}-\d{2}-\d{4}_", "", r["name"] or ""))
+        groups.setdefault(key, []).append(r)
+
+    removed: list[dict] = []
+    for key, rows in groups.items():
+        keep = select_keep(rows, keepDaily, keepWeekly, keepLast)
+        for r in rows:
+            if r["path"] in keep:
+                continue
+            removed.append(r)
+            print(f"[PRUNE] {'(dry-run) ' if dryRun else ''}{r['created']} {r['path']}")
+            if not dryRun:
+                _remove_set(r)
+    if removed and not dryRun:
+        catalog.rebuild(root)
+    print(f"[PRUNE] {len(removed)} sad {'by bylo ' if dryRun else ''}odstraněno.")
+    return removed
@@ -0,0 +1,160 @@
+"""
+Zmenšení obrazu disku na minimum jedním příkazem (imgtool shrink)
+
+Místo ruční cesty losetup → e2fsck → resize2fs → úprava partition → truncate:
+  - poslední partition obrazu (podle umístění) musí být ext2/3/4
+  - zkopíruje se do dočasného řídkého souboru (resize2fs běžný soubor zkracuje
+    na velikost FS a offset uvnitř obrazu nezná, proto ne přímo v obrazu)
+  - e2fsck -f, minimum podle resize2fs -P (+ rezerva MARGIN), zmenšení FS
+  - zmenšený FS se zapíše zpět, uvolněný konec partition se dírou (PUNCH_HOLE);
+    pokud zápis zpět selže, dočasný soubor se ponechá (jediná dobrá kopie)
+  - partition se zkrátí, soubor se ořízne a na nový konec se zapíše záložní
+    GPT hlavička (libs/gpt), .sha256 se přepočítá
+
+Bez losetup a bez roota, ostatní partition se nemění.
+"""
+import os
+import re
+import subprocess
+from pathlib import Path
+
+import libs.toolhelp as th
+from . import gpt
+from . import imgdiff
+from . import imgsrc
+from . import pagecache
+from . import pipeline
+from . import postrestore
+
+MARGIN: float = 0.05
+"""Rezerva nad minimem z resize2fs -P (metadata, journal, pár souborů navíc)."""
+
+ALIGN: int = 1024 * 1024
+"""Zarovnání nové velikosti partition."""
+
+_MIN_RE = re.compile(r"minimum size of the filesystem:\s*(\d+)", re.I)
+
+
+def _align_up(n: int, a: int = ALIGN) -> int:
+    return (n + a - 1) // a * a
+
+
+def _copy(src: str | Path, srcOff: int, dst: str | Path, dstOff: int, size: int, sparse: bool = True) -> None:
+    with imgsrc.c_range_reader(src, srcOff, size) as fi, \
+            imgsrc.c_range_writer(dst, dstOff, size, sparse=sparse) as fo:
+        pipeline.run(fi, fo, size, progress=None)
+
+
+def min_size(dev: str | Path) -> int:
+    """Minimální velikost ext FS v bajtech (resize2fs -P)."""
+    out = th.check_output(["resize2fs", "-P", str(dev)]).decode(errors="replace")
+    m = _MIN_RE.search(out)
+    if not m:
+        raise RuntimeError(f"resize2fs -P nevrátil minimální velikost: {out.strip()}")
+    fd = os.open(dev, os.O_RDONLY)
+    try:
+        geo = imgdiff.ext_geometry(lambda off, n: os.pread(fd, n, off), 0)
+    finally:
+        os.close(fd)
+    return int(m.group(1)) * geo["block_size"]
+
+
+def shrink_image(path: str | Path, targetSize: int | None = None, dryRun: bool = False) -> dict:
+    """Zmenší poslední ext partition, tabulku oddílů i soubor obrazu.
+
+    Args:
+        path: soubor obrazu s GPT
+        targetSize: požadovaná velikost obrazu v bajtech, None = co nejmenší
+        dryRun: jen spočítat a vypsat, nic neměnit
+    Returns:
+        dict: {"file", "part", "old_size", "new_size", "fs_min", "old_fs", "new_fs", "changed"}
+    Raises:
+        RuntimeError: obraz nemá GPT, poslední partition není ext, FS má chyby
+            nebo se nevejde do targetSize
+    """
+    path = Path(path)
+    table, parts = imgsrc.partitions(path)
+    if not parts:
+        raise RuntimeError(f"Obraz {path} nemá žádnou partition.")
+    last = max(parts, key=lambda p: p["start"])
+    if last["fstype"] not in postrestore.EXT_FS:
+        raise RuntimeError(f"Poslední partition p{last['num']} je {last['fstype'] or 'neznámý FS'}, "
+                           f"zmenšit jde jen ext2/3/4.")
+    sec = table["sector"]
+    tail = (gpt.table_sectors(sec) + 1) * sec
+    oldSize = path.stat().st_size
+    start, oldFs = last["start"], last["size"]
+    res = {"file": str(path), "part": last["num"], "old_size": oldSize, "new_size": oldSize,
+           "fs_min": None, "old_fs": oldFs, "new_fs": oldFs, "changed": False}
+
+    tmp = path.with_name(f"{path.name}.shrink.tmp")
+    if tmp.exists():
+        raise RuntimeError(f"{tmp} zůstal po nedokončeném zmenšení – nejdřív ho zapiš zpět nebo smaž.")
+    keepTmp = False
+    try:
+        print(f"[SHRINK] p{last['num']} ({last['fstype']}) → {tmp.name}")
+        with open(tmp, "wb") as f:
+            f.truncate(oldFs)
+        _copy(path, start, tmp, 0, oldFs)
+        r = subprocess.run(["e2fsck", "-f", "-p", str(tmp)], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        if r.returncode not in postrestore.FSCK_OK:
+            raise RuntimeError(f"e2fsck na p{last['num']} skončil kódem {r.returncode}, "
+                               f"oprav FS ručně (e2fsck -f):\n{r.stdout.decode(errors='replace')}")
+        fsMin = min_size(tmp)
+        res["fs_min"] = fsMin
+        if targetSize:
+            newFs = (targetSize - start - tail) // ALIGN * ALIGN
+            if newFs < fsMin:
+                raise RuntimeError(f"Do {targetSize / 1024 ** 3:.2f} GiB se FS nevejde, "
+                                   f"minimum obrazu je {(start + _align_up(fsMin) + tail) / 1024 ** 3:.2f} GiB.")
+        else:
+            newFs = _align_up(int(fsMin * (1 + MARGIN)))
+        if newFs >= oldFs:
+            print(f"[SHRINK] p{last['num']} už je menší nebo rovna {newFs / 1024 / 1024:.0f} MiB, nic se nemění.")
+            return res
+        newSize = start + newFs + tail
+        res.update(new_fs=newFs, new_size=newSize, changed=not dryRun)
+        if dryRun:
+            return res
+
+        th.run(["resize2fs", str(tmp), f"{newFs // 1024}K"])
+        print(f"[SHRINK] p{last['num']} {oldFs / 1024 / 1024:.0f} → {newFs / 1024 / 1024:.0f} MiB zpět do {path.name}")
+        # od teď je jediná dobrá kopie FS v tmp – při chybě se nesmaže
+        keepTmp = True
+        # celý FS se přepíše včetně nul (starý obsah partition se nesmí nechat),
+        # díra až za nový konec FS
+        _copy(tmp, 0, path, start, newFs, sparse=False)
+        fd = os.open(path, os.O_RDWR)
+        try:
+            pagecache.punch_hole(fd, start + newFs, oldFs - newFs)
+            next(p for p in table["parts"] if p["num"] == last["num"])["size"] = newFs
+            os.ftruncate(fd, newSize)
+            gpt.write(fd, table, newSize)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        keepTmp = False
+    finally:
+        if keepTmp:
+            print(f"[ERR] Zmenšení p{last['num']} nedokončeno, zmenšený FS zůstal v {tmp} – "
+                  f"zapiš ho ručně na offset {start} obrazu {path.name} (dd seek={start} oflag=seek_bytes conv=notrunc).")
+        else:
+            tmp.unlink(missing_ok=True)
+
+    sidecar = Path(f"{path}.sha256")
+    if sidecar.exists():
+        th.write_sha256_sidecar(path)
+    if Path(f"{path}.par").exists():
+        print(f"[WARN] {path.name}.par patří k původnímu obrazu, vytvoř ji znovu (imgtool parity).")
+    return res
+
+
+def print_report(res: dict) -> None:
+    """Vypíše výsledek zmenšení."""
+    mib = lambda n: f"{n / 1024 / 1024:.0f} MiB"
+    print(f"Obraz:      {res['file']}")
+    print(f"Partition:  p{res['part']} {mib(res['old_fs'])} → {mib(res['new_fs'])}"
+          + (f" (minimum FS {mib(res['fs_min'])})" if res["fs_min"] else ""))
+    print(f"Soubor:     {mib(res['old_size'])} → {mib(res['new_size'])}")
+    if not res["changed"] and res["new_size"] < res["old_size"]:
+        print("[DRY] Nic se nezměnilo (--dry-run).")
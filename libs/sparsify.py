@@ -0,0 +1,161 @@
+"""
+Zpětné „zředění“ existujícího obrazu (imgtool sparsify)
+
+Plně alokovaný .img zabírá místo i tam, kde jsou jen nuly nebo uvolněné bloky FS:
+  - volitelně (--trim) se obraz připojí přes loop (discard je u loop nad
+    souborem zapnutý – jádro díry dělá samo), každá partition se známým FS se
+    dočasně připojí a pustí se na ni fstrim; uvolněné bloky FS se tak stanou
+    dírami, i když na nich zůstala stará data
+  - pak se projdou jen rozsahy s daty (SEEK_DATA / SEEK_HOLE) po blocích
+    pipeline.BLOCK_SIZE: celý blok se porovná s nulami najednou (memcmp),
+    teprve nenulový blok se prochází po BLOCK; souvislé nulové rozsahy se
+    uvolní přes fallocate(PUNCH_HOLE) – obsah souboru se nemění
+
+Obraz nesmí být během toho připojený (zápis FS do právě uvolňovaného rozsahu
+by se ztratil).
+"""
+import json
+import os
+import re
+import tempfile
+from pathlib import Path
+
+import libs.toolhelp as th
+from . import imgdiff
+from . import pagecache
+from . import pipeline
+
+BLOCK: int = 4096
+"""Nejmenší uvolňovaný rozsah (blok FS)."""
+
+TRIM_FS: tuple[str, ...] = ("ext2", "ext3", "ext4", "vfat", "xfs", "btrfs", "f2fs")
+"""Filesystemy, které se při --trim připojí a projdou fstrim."""
+
+_TRIM_RE = re.compile(r"\((\d+) bytes\)")
+
+
+def zero_runs(fd: int, size: int, block: int = BLOCK):
+    """Souvislé nulové rozsahy (start, délka) v datech souboru, díry se nečtou."""
+    chunk = pipeline.BLOCK_SIZE
+    buf = bytearray(chunk)
+    mv = memoryview(buf)
+    for s, e in imgdiff.data_extents(fd, size) or [(0, size)]:
+        runStart = runEnd = s
+        pos = s
+        while pos < e:
+            n = os.preadv(fd, [mv[:min(chunk, e - pos)]], pos)
+            if n <= 0:
+                break
+            if pipeline.is_zero(mv[:n]):
+                if runEnd != pos:
+                    runStart = pos
+                runEnd = pos + n
+            else:
+                for off in range(0, n, block):
+                    if pipeline.is_zero(mv[off:min(off + block, n)]):
+                        if runEnd != pos + off:
+                            runStart = pos + off
+                        runEnd = min(pos + off + block, pos + n)
+                    elif runEnd > runStart:
+                        yield runStart, runEnd - runStart
+                        runStart = runEnd
+            pos += n
+        if runEnd > runStart:
+            yield runStart, runEnd - runStart
+
+
+def attached_loops(path: str | Path) -> list[str]:
+    """Loop zařízení, ke kterým je obraz připojený (losetup -j)."""
+    out = th.check_output(["losetup", "-j", str(Path(path).resolve())]).decode(errors="replace")
+    return [line.split(":", 1)[0] for line in out.splitlines() if line.strip()]
+
+
+def trim(path: str | Path) -> dict[str, int]:
+    """Připojí obraz přes loop a pustí fstrim na každý FS, vrací {partition: uvolněno B}."""
+    loop = th.check_output(["losetup", "--find", "--show", "--partscan", str(path)]).decode().strip()
+    out: dict[str, int] = {}
+    try:
+        data = json.loads(th.check_output(["lsblk", "-J", "-o", "PATH,TYPE,FSTYPE", loop]))
+        nodes = data.get("blockdevices", [])
+        parts = [ch for n in nodes for ch in n.get("children", []) if ch.get("type") == "part"] or nodes
+        for p in parts:
+            if not p.get("fstype"):
+                # bez udev lsblk FS nezná, zeptat se přímo blkid
+                try:
+                    p["fstype"] = th.check_output(["blkid", "-o", "value", "-s", "TYPE", p["path"]]).decode().strip()
+                except Exception:
+                    continue
+            if p["fstype"].lower() not in TRIM_FS:
+                continue
+            mnt = tempfile.mkdtemp(prefix="imgtool-trim-")
+            try:
+                th.run(["mount", p["path"], mnt])
+                try:
+                    res = th.check_output(["fstrim", "-v", mnt]).decode(errors="replace")
+                    m = _TRIM_RE.search(res)
+                    out[p["path"]] = int(m.group(1)) if m else 0
+                    print(f"[TRIM] {p['path']} ({p['fstype']}): {out[p['path']] / 1024 / 1024:.1f} MiB")
+                finally:
+                    th.run(["umount", mnt])
+            except Exception as e:
+                print(f"[WARN] fstrim {p['path']} selhal: {e}")
+            finally:
+                os.rmdir(mnt)
+    finally:
+        th.run(["losetup", "-d", loop])
+    return out
+
+
+def sparsify(path: str | Path, trimFs: bool = False, dryRun: bool = False, block: int = BLOCK) -> dict:
+    """Uvolní nulové (a s trimFs i nepoužité) bloky obrazu, obsah se nezmění.
+
+    Args:
+        path: soubor obrazu (disk nebo samotná partition)
+        trimFs: nejdřív fstrim přes loop (vyžaduje roota)
+        dryRun: jen spočítat nulové rozsahy, nic neměnit
+        block: nejmenší uvolňovaný rozsah
+    Returns:
+        dict: {"file", "size", "alloc_before", "alloc_after", "zero_bytes", "runs", "trimmed"}
+    Raises:
+        RuntimeError: obraz je připojený přes loop nebo FS díry neumí
+    """
+    path = Path(path)
+    if not path.is_file():
+        raise RuntimeError(f"{path} není soubor obrazu.")
+    loops = attached_loops(path)
+    if loops:
+        raise RuntimeError(f"Obraz {path} je připojený ({', '.join(loops)}), nejdřív ho odpoj.")
+    st = path.stat()
+    res = {"file": str(path), "size": st.st_size, "alloc_before": st.st_blocks * 512,
+           "alloc_after": st.st_blocks * 512, "zero_bytes": 0, "runs": 0, "trimmed": {}}
+    if trimFs and not dryRun:
+        res["trimmed"] = trim(path)
+
+    fd = os.open(path, os.O_RDONLY if dryRun else os.O_RDWR)
+    try:
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+        for off, n in zero_runs(fd, st.st_size, block):
+            if not dryRun and not pagecache.punch_hole(fd, off, n):
+                raise RuntimeError(f"FS se souborem {path} neumí díry (fallocate PUNCH_HOLE).")
+            res["zero_bytes"] += n
+            res["runs"] += 1
+        if not dryRun:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+    res["alloc_after"] = path.stat().st_blocks * 512
+    return res
+
+
+def print_report(res: dict, dryRun: bool = False) -> None:
+    """Vypíše výsledek zředění."""
+    mib = lambda n: f"{n / 1024 / 1024:.1f} MiB"
+    print(f"Obraz:      {res['file']} ({mib(res['size'])})")
+    for dev, n in res["trimmed"].items():
+        print(f"fstrim:     {dev} {mib(n)}")
+    print(f"Nulové:     {mib(res['zero_bytes'])} v {res['runs']} rozsazích"
+          + (" (--dry-run, nic se neuvolnilo)" if dryRun else ""))
+    print(f"Alokováno:  {mib(res['alloc_before'])} → {mib(res['alloc_after'])}")
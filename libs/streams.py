@@ -0,0 +1,366 @@
+"""
+Zdroje a cíle záloh mimo běžné soubory: stdin/stdout, pojmenované roury, svazky
+
+  - "-" = stdout při záloze, stdin při obnově (vlastní přenos, páska, ssh …)
+  - pojmenovaná roura (mkfifo) se použije tak, jak je, bez přípony a prefixu
+  - --split-size rozdělí výstup na svazky <obraz>.000, .001, … (pro FAT32 např.
+    4000M – 4G je o bajt víc, než FAT32 unese); každý svazek má vlastní .sha256
+    a <obraz>.sha256 je hash celého proudu; obnova čte svazky za sebou jako
+    jeden souvislý proud
+
+Při výstupu na stdout jdou všechny výpisy (průběh, [TAG] hlášky) na stderr,
+aby se nemíchaly s daty.
+"""
+import contextlib
+import hashlib
+import json
+import os
+import stat
+import sys
+from pathlib import Path
+from typing import BinaryIO
+
+import libs.toolhelp as th
+from . import pagecache
+
+STDIO: str = "-"
+"""Jméno pro stdout (záloha) / stdin (obnova)."""
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+_claimed: dict[str, BinaryIO] = {}
+
+
+def is_stdio(spec: str | Path | None) -> bool:
+    return str(spec) == STDIO
+
+
+def is_sink(spec) -> bool:
+    """Už otevřený výstup (objekt s write), ne jméno."""
+    return not isinstance(spec, (str, Path)) and hasattr(spec, "write")
+
+
+def is_fifo(spec: str | Path) -> bool:
+    if not isinstance(spec, (str, Path)):
+        return False
+    try:
+        return stat.S_ISFIFO(os.stat(spec).st_mode)
+    except OSError:
+        return False
+
+
+def is_stream(spec: str | Path | None) -> bool:
+    """stdin/stdout nebo roura – nejde v ní přetáčet, sidecar se k ní nepíše."""
+    return spec is not None and (is_stdio(spec) or is_fifo(spec))
+
+
+def volume_path(base: str | Path, i: int) -> Path:
+    return Path(f"{base}.{i:03d}")
+
+
+def volumes(base: str | Path) -> list[Path]:
+    """Svazky <base>.000, .001, … v pořadí, [] = nejde o sadu svazků."""
+    out = []
+    while volume_path(base, len(out)).exists():
+        out.append(volume_path(base, len(out)))
+    return out
+
+
+def stripe_manifest(base: str | Path) -> Path:
+    """Manifest sady svazků rozložené do více adresářů (libs/multidest, stripe)."""
+    return Path(str(base) + ".stripe.json")
+
+
+def set_volumes(base: str | Path) -> list[Path]:
+    """Svazky sady v pořadí – podle manifestu stripe (i z jiných adresářů), jinak volumes().
+
+    Raises:
+        FileNotFoundError: svazek ze stripe sady chybí
+    """
+    man = stripe_manifest(base)
+    if not man.exists():
+        return volumes(base)
+    m = json.loads(man.read_text(encoding="utf-8"))
+    base = Path(base)
+    have = {v["index"]: v for v in m["volumes"]}
+    missing = sorted(set(range(max(have, default=-1) + 1)) - set(have)) + m.get("lost", [])
+    if missing:
+        raise FileNotFoundError(f"Sada {base.name} je neúplná, chybí svazky: "
+                                f"{', '.join(f'{i:03d}' for i in sorted(set(missing)))}")
+    out = []
+    for i in sorted(have):
+        name = volume_path(base.name, i).name
+        cands = [Path(have[i]["dir"]) / name, base.parent / name] + [Path(d) / name for d in m["dirs"]]
+        p = next((c for c in cands if c.exists()), None)
+        if p is None:
+            raise FileNotFoundError(f"Chybí svazek {name} (zapsán do {have[i]['dir']})")
+        out.append(p)
+    return out
+
+
+def exists(spec: str | Path) -> bool:
+    """Obraz jde číst: stdin, roura, soubor nebo sada svazků."""
+    return (is_stdio(spec) or Path(spec).exists() or bool(volumes(spec))
+            or stripe_manifest(spec).exists())
+
+
+def size(spec: str | Path) -> int | None:
+    """Velikost obrazu (součet svazků), None = proud neznámé délky."""
+    if is_stream(spec):
+        return None
+    vols = set_volumes(spec) if not Path(spec).exists() else []
+    if vols:
+        return sum(v.stat().st_size for v in vols)
+    try:
+        with open(spec, "rb") as f:
+            return os.lseek(f.fileno(), 0, os.SEEK_END)
+    except OSError:
+        return None
+
+
+def claim_stdout() -> BinaryIO:
+    """Binární stdout pro data; textový sys.stdout i fd 1 se přesměrují na stderr.
+
+    Data jdou přes duplikát původního fd 1, fd 1 se pak přesměruje na stderr –
+    do proudu tak nezapíše ani podproces (clear, dd status, …).
+    Volá se co nejdřív (před prvním výpisem), opakované volání vrátí totéž.
+    """
+    if "out" not in _claimed:
+        sys.stdout.flush()
+        _claimed["out"] = os.fdopen(os.dup(1), "wb")
+        os.dup2(2, 1)
+        sys.stdout = sys.stderr
+    return _claimed["out"]
+
+
+def claim_stdin() -> BinaryIO:
+    """Binární stdin pro data; dotazy (confirm) se čtou z terminálu, je-li k dispozici."""
+    if "in" not in _claimed:
+        _claimed["in"] = sys.stdin.buffer
+        try:
+            sys.stdin = open("/dev/tty", "r")
+        except OSError:
+            sys.stdin = open(os.devnull, "r")
+    return _claimed["in"]
+
+
+class c_pipe_sink:
+    """Zápis na stdout nebo do roury; stdout se nezavírá, jen dopíše buffer."""
+
+    def __init__(self, out: BinaryIO, own: bool = False) -> None:
+        self.out = out
+        self.own = own
+        self.pos = 0
+
+    def write(self, data) -> int:
+        n = self.out.write(data)
+        n = len(data) if n is None else n
+        self.pos += n
+        return n
+
+    def flush(self) -> None:
+        self.out.flush()
+
+    def close(self) -> None:
+        self.out.flush()
+        if self.own:
+            # čtenář roury dostane EOF
+            self.out.close()
+
+    def abort(self) -> None:
+        if self.own:
+            self.out.close()
+
+    def __enter__(self) -> "c_pipe_sink":
+        return self
+
+    def __exit__(self, excType, exc, tb) -> None:
+        if excType is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class c_split_writer:
+    """Zápis do svazků <base>.000, .001, … po splitSize bajtech.
+
+    Každý svazek je pagecache.c_out_writer (prealokace na splitSize, fsync) a po
+    uzavření dostane .sha256; sha256 celého proudu je v atributu sha256.
+    """
+
+    def __init__(self, base: str | Path, splitSize: int) -> None:
+        if splitSize <= 0:
+            raise ValueError("Velikost svazku musí být kladná")
+        self.base = Path(base)
+        self.splitSize = splitSize
+        self.paths: list[Path] = []
+        self.pos = 0
+        self._cur: pagecache.c_out_writer | None = None
+        self._curSha = None
+        self._curPos = 0
+        self._sha = hashlib.sha256()
+        # zbytky předchozí sady se stejným jménem by se při obnově přečetly taky
+        for old in volumes(self.base):
+            old.unlink()
+            Path(str(old) + ".sha256").unlink(missing_ok=True)
+
+    @property
+    def sha256(self) -> str:
+        return self._sha.hexdigest()
+
+    def _next(self) -> None:
+        self._finish()
+        path = volume_path(self.base, len(self.paths))
+        self._cur = pagecache.c_out_writer(path, self.splitSize)
+        self._curSha = hashlib.sha256()
+        self._curPos = 0
+        self.paths.append(path)
+
+    def _finish(self) -> None:
+        if self._cur is None:
+            return
+        self._cur.close()
+        th.write_sha256_sidecar(self._cur.path, self._curSha.hexdigest())
+        self._cur = None
+
+    def write(self, data) -> int:
+        mv = memoryview(data).cast("B")
+        self._sha.update(mv)
+        done = 0
+        while done < len(mv):
+            if self._cur is None or self._curPos >= self.splitSize:
+                self._next()
+            part = mv[done:done + self.splitSize - self._curPos]
+            self._cur.write(part)
+            self._curSha.update(part)
+            self._curPos += len(part)
+            done += len(part)
+        self.pos += done
+        return done
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        """Uzavře poslední svazek (prázdný proud = jeden prázdný svazek)."""
+        if not self.paths:
+            self._next()
+        self._finish()
+
+    def abort(self) -> None:
+        if self._cur is not None:
+            self._cur.abort()
+            self._cur = None
+
+    def __enter__(self) -> "c_split_writer":
+        return self
+
+    def __exit__(self, excType, exc, tb) -> None:
+        if excType is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class c_split_reader:
+    """Čtení sady svazků jako jednoho souvislého proudu (read / readinto)."""
+
+    def __init__(self, paths: list[Path]) -> None:
+        if not paths:
+            raise FileNotFoundError("Sada svazků je prázdná")
+        self.paths = paths
+        self._i = 0
+        self._f = open(paths[0], "rb", buffering=0)
+        pagecache.advise_sequential(self._f)
+        self._drop = pagecache.c_drop_behind(self._f)
+
+    def _advance(self) -> bool:
+        self._drop.close()
+        self._f.close()
+        self._i += 1
+        if self._i >= len(self.paths):
+            self._f = None
+            return False
+        self._f = open(self.paths[self._i], "rb", buffering=0)
+        pagecache.advise_sequential(self._f)
+        self._drop = pagecache.c_drop_behind(self._f)
+        return True
+
+    def readinto(self, buf) -> int:
+        while self._f is not None:
+            n = self._f.readinto(buf)
+            if n:
+                self._drop(n)
+                return n
+            if not self._advance():
+                break
+        return 0
+
+    def read(self, n: int = -1) -> bytes:
+        if n is None or n < 0:
+            return b"".join(iter(lambda: self.read(1024 * 1024), b""))
+        buf = bytearray(n)
+        got = self.readinto(buf)
+        return bytes(buf[:got])
+
+    def close(self) -> None:
+        if self._f is not None:
+            self._drop.close()
+            self._f.close()
+            self._f = None
+
+    def __enter__(self) -> "c_split_reader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def open_sink(spec: str | Path, size: int | None = None, splitSize: int | None = None):
+    """Cíl zálohy s write/flush/close/abort a context managerem.
+
+    Args:
+        spec: "-" = stdout, roura, jinak soubor; už otevřený výstup (např.
+            multidest.c_multi_sink) se vrátí tak, jak je – zavírá ho ten, kdo ho otevřel
+        size: očekávaná velikost pro prealokaci běžného souboru
+        splitSize: rozdělit na svazky <spec>.000, … (jen pro soubory)
+    """
+    if is_sink(spec):
+        return contextlib.nullcontext(spec)
+    if is_stream(spec):
+        if splitSize:
+            raise ValueError("--split-size nejde kombinovat se stdout ani s rourou")
+        if is_stdio(spec):
+            return c_pipe_sink(claim_stdout())
+        return c_pipe_sink(open(spec, "wb"), own=True)
+    if splitSize:
+        return c_split_writer(spec, splitSize)
+    return pagecache.c_out_writer(spec, size)
+
+
+def open_source(spec: str | Path):
+    """Zdroj obnovy s read/readinto: "-" = stdin, roura, soubor nebo sada svazků."""
+    if is_stdio(spec):
+        return claim_stdin()
+    if not Path(spec).exists():
+        vols = set_volumes(spec)
+        if vols:
+            return c_split_reader(vols)
+    return open(spec, "rb", buffering=0 if not is_fifo(spec) else -1)
+
+
+def is_gzip(spec: str | Path, src=None) -> bool:
+    """gzip podle přípony, u proudu podle prvních bajtů (src musí umět peek)."""
+    if not is_stream(spec):
+        return th.is_gzip(Path(spec))
+    peek = getattr(src, "peek", None)
+    return bool(peek) and peek(2)[:2] == GZIP_MAGIC
+
+
+def verify_volumes(base: str | Path) -> bool:
+    """Ověří .sha256 všech svazků sady."""
+    vols = set_volumes(base)
+    ok = bool(vols)
+    for v in vols:
+        ok = th.verify_sha256_sidecar(v) and ok
+    return ok
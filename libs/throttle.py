@@ -0,0 +1,341 @@
+"""
+Omezení I/O pro zálohy na vytížených strojích
+
+  - token bucket (MB/s a/nebo IOPS) pro vestavěné čtecí a zápisové smyčky
+  - I/O priorita procesu (ionice), dědí ji i spuštěné dd/gzip
+  - cgroup v2 `io.max` pro celý proces včetně potomků (dd, gunzip, partclone)
+  - časový rozvrh, např. přes den 20 MB/s a v noci bez omezení
+
+Aktivní politika je uložena v modulu (ACTIVE), nastaví ji CLI a datové smyčky
+jen volají consume(). Bez nastavené politiky je vše no-op.
+"""
+import atexit
+import os
+import re
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator
+
+import libs.toolhelp as th
+
+CGROUP_ROOT: Path = Path("/sys/fs/cgroup")
+
+_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def parse_rate(tx: str | int | None) -> int:
+    """Převede '20M', '512K', '1G' nebo číslo na bajty/s. 0 = bez omezení."""
+    if tx is None:
+        return 0
+    if isinstance(tx, int):
+        return max(0, tx)
+    m = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([KMG]?)i?B?(?:/s)?\s*$", str(tx), re.IGNORECASE)
+    if not m:
+        raise ValueError(f"Neplatná rychlost: {tx} (očekáváno např. 20M, 512K, 1G)")
+    return int(float(m.group(1)) * _UNITS[m.group(2).upper()])
+
+
+class c_io_window:
+    """Časové okno rozvrhu s vlastními limity (minuty od půlnoci, konec exkluzivně)."""
+
+    def __init__(self, start: int, end: int, rate: int, iops: int) -> None:
+        self.start = start
+        self.end = end
+        self.rate = rate
+        self.iops = iops
+
+    def contains(self, minute: int) -> bool:
+        if self.start <= self.end:
+            return self.start <= minute < self.end
+        # okno přes půlnoc, např. 22:00-06:00
+        return minute >= self.start or minute < self.end
+
+
+def parse_schedule(tx: str | None) -> list[c_io_window]:
+    """Rozparsuje rozvrh ve formátu 'HH:MM-HH:MM=rychlost[:iops],...'.
+
+    Např. '08:00-18:00=20M:200,18:00-22:00=80M', rychlost 0 = bez omezení.
+    Mimo všechna okna platí výchozí --bwlimit / --iops.
+    """
+    windows: list[c_io_window] = []
+    if not tx:
+        return windows
+    for part in tx.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        m = re.match(r"^(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})=([^:]+)(?::(\d+))?$", part)
+        if not m:
+            raise ValueError(f"Neplatné okno rozvrhu: {part} (očekáváno HH:MM-HH:MM=20M[:iops])")
+        h1, m1, h2, m2 = (int(m.group(i)) for i in range(1, 5))
+        if m1 > 59 or m2 > 59 or any(h > 24 or (h == 24 and mm) for h, mm in ((h1, m1), (h2, m2))):
+            raise ValueError(f"Neplatný čas v okně rozvrhu: {part}")
+        windows.append(c_io_window(h1 * 60 + m1, h2 * 60 + m2, parse_rate(m.group(5)), int(m.group(6) or 0)))
+    return windows
+
+
+class c_io_throttle:
+    """I/O politika: token bucket pro bajty i operace, rozvrh, cgroup a ionice."""
+
+    def __init__(self, rate: int = 0, iops: int = 0, schedule: list[c_io_window] | None = None,
+                 useCgroup: bool = False, ioprio: str | None = None) -> None:
+        self.rate = rate
+        self.iops = iops
+        self.schedule = schedule or []
+        self.useCgroup = useCgroup
+        self.ioprio = ioprio
+        self._lock = threading.Lock()
+        self._t = time.monotonic()
+        self._bytes = 0.0
+        self._ops = 0.0
+
+    def limits(self, now: datetime | None = None) -> tuple[int, int]:
+        """Vrátí (bajty/s, iops) platné pro daný čas, 0 = bez omezení."""
+        if self.schedule:
+            now = now or datetime.now()
+            minute = now.hour * 60 + now.minute
+            for w in self.schedule:
+                if w.contains(minute):
+                    return (w.rate, w.iops)
+        return (self.rate, self.iops)
+
+    def consume(self, nbytes: int, ops: int = 1) -> None:
+        """Počká, dokud není k dispozici dost tokenů pro nbytes / ops."""
+        rate, iops = self.limits()
+        if not rate and not iops:
+            return
+        with self._lock:
+            now = time.monotonic()
+            dt = now - self._t
+            self._t = now
+            wait = 0.0
+            if rate:
+                # burst max 1/4 s, ale vždy aspoň jeden požadavek
+                cap = max(rate / 4, nbytes)
+                self._bytes = min(cap, self._bytes + dt * rate) - nbytes
+                if self._bytes < 0:
+                    wait = -self._bytes / rate
+            if iops:
+                cap = max(iops / 4, ops)
+                self._ops = min(cap, self._ops + dt * iops) - ops
+                if self._ops < 0:
+                    wait = max(wait, -self._ops / iops)
+        if wait > 0:
+            time.sleep(wait)
+
+
+ACTIVE: c_io_throttle | None = None
+"""Aktuální politika, nastavuje activate()."""
+
+
+def activate(policy: c_io_throttle | None) -> None:
+    """Nastaví politiku pro celý proces a aplikuje I/O prioritu."""
+    global ACTIVE
+    ACTIVE = policy
+    if policy and policy.ioprio:
+        set_ioprio(policy.ioprio)
+
+
+def consume(nbytes: int, ops: int = 1) -> None:
+    """Zkrácené volání pro datové smyčky, bez aktivní politiky nic nedělá."""
+    if ACTIVE is not None:
+        ACTIVE.consume(nbytes, ops)
+
+
+def ionice_args(ioprio: str) -> list[str]:
+    """Převede 'idle', 'be:7', 'rt:0' na parametry pro ionice."""
+    m = re.match(r"^(idle|be|rt)(?::([0-7]))?$", ioprio.strip().lower())
+    if not m:
+        raise ValueError(f"Neplatná I/O priorita: {ioprio} (idle, be[:0-7], rt[:0-7])")
+    cls = {"rt": "1", "be": "2", "idle": "3"}[m.group(1)]
+    args = ["-c", cls]
+    if m.group(2) is not None and cls != "3":
+        args += ["-n", m.group(2)]
+    return args
+
+
+def set_ioprio(ioprio: str, pid: int | None = None) -> None:
+    """Nastaví I/O prioritu procesu (default sebe), potomci ji zdědí."""
+    pid = pid or os.getpid()
+    th.run(["ionice", *ionice_args(ioprio), "-p", str(pid)])
+
+
+def _whole_disk(devPath: str) -> str:
+    """Pro partition vrátí nadřazený disk (io.max přijímá jen celé disky)."""
+    name = Path(os.path.realpath(devPath)).name
+    sysBlk = Path("/sys/class/block") / name
+    if (sysBlk / "partition").exists():
+        return Path(os.path.realpath(sysBlk)).parent.name
+    return name
+
+
+def _dev_numbers(devPath: str) -> str:
+    """Vrátí 'MAJ:MIN' celého disku pro dané zařízení."""
+    disk = _whole_disk(devPath)
+    return (Path("/sys/class/block") / disk / "dev").read_text(encoding="utf-8").strip()
+
+
+class c_cgroup_io:
+    """cgroup v2 procesu s io.max – proces se do ní přesune jednou (z main).
+
+    Souběžné úlohy (batch, daemon, flash) v ní jen přidávají a odebírají svoje
+    disky (počítadlo referencí); io.max se přepíše při každém startu a konci
+    úlohy. --bwlimit / --iops je rozpočet celého procesu (stejně jako token
+    bucket), každá běžící úloha dostane na svoje disky rovný díl.
+    """
+
+    def __init__(self, policy: c_io_throttle) -> None:
+        self.policy = policy
+        self.path = CGROUP_ROOT / f"imgtool-{os.getpid()}"
+        self._orig: Path | None = None
+        self._devs: dict[str, int] = {}
+        self._jobs = 0
+        self._applied: dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _write_limits(self) -> None:
+        """Zapíše io.max podle aktuálních disků a úloh, volá se pod self._lock."""
+        rate, iops = self.policy.limits()
+        want = {}
+        for dev, n in self._devs.items():
+            r = str(max(1, rate * n // self._jobs)) if rate else "max"
+            i = str(max(1, iops * n // self._jobs)) if iops else "max"
+            want[dev] = f"rbps={r} wbps={r} riops={i} wiops={i}"
+        for dev in self._applied.keys() - want.keys():
+            # disk už žádná úloha nepoužívá – limit zrušit
+            want[dev] = "rbps=max wbps=max riops=max wiops=max"
+        changed = [dev for dev, val in want.items() if self._applied.get(dev) != val]
+        for dev in changed:
+            (self.path / "io.max").write_text(f"{dev} {want[dev]}\n")
+        self._applied = {dev: val for dev, val in want.items() if dev in self._devs}
+        if changed and self._devs:
+            print(f"[THROTTLE] io.max {', '.join(f'{d} {v}' for d, v in sorted(self._applied.items()))}")
+
+    def _refresher(self) -> None:
+        while not self._stop.wait(30):
+            try:
+                with self._lock:
+                    self._write_limits()
+            except OSError as e:
+                print(f"[THROTTLE] Aktualizace io.max selhala: {e}")
+
+    def add(self, devs: list[str]) -> list[str]:
+        """Úloha začíná používat disky, vrací jejich MAJ:MIN pro remove()."""
+        nums = sorted({_dev_numbers(d) for d in devs})
+        with self._lock:
+            self._jobs += 1
+            for n in nums:
+                self._devs[n] = self._devs.get(n, 0) + 1
+            try:
+                self._write_limits()
+            except OSError as e:
+                print(f"[THROTTLE] Aktualizace io.max selhala: {e}")
+        return nums
+
+    def remove(self, nums: list[str]) -> None:
+        """Úloha skončila, její disky se uvolní a limity ostatních přepočítají."""
+        with self._lock:
+            self._jobs -= 1
+            for n in nums:
+                self._devs[n] -= 1
+                if not self._devs[n]:
+                    del self._devs[n]
+            try:
+                self._write_limits()
+            except OSError as e:
+                print(f"[THROTTLE] Aktualizace io.max selhala: {e}")
+
+    def enter(self) -> None:
+        if not (CGROUP_ROOT / "cgroup.controllers").exists():
+            raise RuntimeError("cgroup v2 není připojena v /sys/fs/cgroup")
+        if "io" not in (CGROUP_ROOT / "cgroup.controllers").read_text():
+            raise RuntimeError("cgroup v2 nemá dostupný io controller")
+        ctl = CGROUP_ROOT / "cgroup.subtree_control"
+        if "io" not in ctl.read_text():
+            ctl.write_text("+io")
+        for line in Path("/proc/self/cgroup").read_text().splitlines():
+            if line.startswith("0::"):
+                self._orig = CGROUP_ROOT / line[3:].lstrip("/")
+        self.path.mkdir(exist_ok=True)
+        (self.path / "cgroup.procs").write_text(str(os.getpid()))
+        if self.policy.schedule:
+            self._thread = threading.Thread(target=self._refresher, name="cgroup-io", daemon=True)
+            self._thread.start()
+
+    def leave(self) -> None:
+        self._stop.set()
+        try:
+            if self._orig is not None:
+                (self._orig / "cgroup.procs").write_text(str(os.getpid()))
+            self.path.rmdir()
+        except OSError as e:
+            print(f"[THROTTLE] Úklid cgroup {self.path} selhal: {e}")
+
+
+CGROUP: c_cgroup_io | None = None
+"""cgroup procesu, nastavuje cgroup_enter() (jednou z main)."""
+
+
+def cgroup_enter() -> None:
+    """Přesune proces do vlastní cgroup, pokud aktivní politika chce --cgroup.
+
+    Volá se jednou na proces; úklid (návrat do původní cgroup, rmdir) proběhne
+    při ukončení procesu. Pokud cgroup nelze vytvořit, vypíše varování
+    a pokračuje bez ní (platí dál token bucket).
+    """
+    global CGROUP
+    pol = ACTIVE
+    if pol is None or not pol.useCgroup or CGROUP is not None:
+        return
+    try:
+        cg = c_cgroup_io(pol)
+        cg.enter()
+    except (OSError, RuntimeError) as e:
+        print(f"[THROTTLE] cgroup io.max nelze použít: {e}")
+        return
+    CGROUP = cg
+    atexit.register(cgroup_leave)
+
+
+def cgroup_leave() -> None:
+    """Vrátí proces do původní cgroup a smaže tu vlastní."""
+    global CGROUP
+    if CGROUP is not None:
+        CGROUP.leave()
+        CGROUP = None
+
+
+@contextmanager
+def cgroup_limit(devs: list[str]) -> Iterator[None]:
+    """Po dobu bloku omezí I/O na disky devs přes io.max cgroup procesu.
+
+    No-op, pokud proces není v cgroup (cgroup_enter). Disky se počítají
+    referencemi, takže souběžné úlohy si limity navzájem neruší.
+    """
+    cg = CGROUP
+    nums = None
+    if cg is not None:
+        try:
+            nums = cg.add(devs)
+        except (OSError, RuntimeError) as e:
+            print(f"[THROTTLE] cgroup io.max nelze použít: {e}")
+    try:
+        yield
+    finally:
+        if nums is not None:
+            cg.remove(nums)
+
+
+def from_args(bwlimit: str | None, iops: int | None, schedule: str | None,
+              useCgroup: bool, ioprio: str | None) -> c_io_throttle | None:
+    """Sestaví politiku z CLI parametrů, vrátí None pokud není nic omezeno."""
+    rate = parse_rate(bwlimit)
+    windows = parse_schedule(schedule)
+    if not rate and not iops and not windows and not ioprio:
+        return None
+    return c_io_throttle(rate, iops or 0, windows, useCgroup, ioprio)
@@ -1,10 +1,13 @@
 import os,datetime
 import subprocess
 import json,re
+import fcntl
+from contextlib import contextmanager
 from typing import List,Optional,Union,Any
 import hashlib
 from pathlib import Path
 import libs.toolhelp as th
+from libs import pagecache
 from .JBLibs.input import select_item, select, anyKey,cls
 from .JBLibs.helper import run
 from .JBLibs.c_menu import c_menu_block_items
@@ -348,10 +351,11 @@ def check_output(cmd: List[str]) -> bytes:
     print(f"[CMD] {' '.join(cmd)}")
     return subprocess.check_output(cmd)
 
-def verify_sha256_sidecar(path: Path) -> bool:
+def verify_sha256_sidecar(path: Path, progress=None) -> bool:
     """
     Zkontroluje, zda soubor odpovídá uloženému SHA256.
     Očekává <soubor>.sha256.
+    progress: volitelný callback(done, total) – viz sha256_file
     """
     sidecar = path.with_suffix(path.suffix + ".sha256")
     if not sidecar.exists():
@@ -364,7 +368,7 @@ def verify_sha256_sidecar(path: Path) -> bool:
         return False
 
     expected = content.split()[0]
-    actual = sha256_file(path)
+    actual = sha256_file(path, progress=progress)
     if actual == expected:
         print(f"[SHA256] OK: {path.name}")
         return True
@@ -374,10 +378,111 @@ def verify_sha256_sidecar(path: Path) -> bool:
     print(f"   actual  : {actual}")
     return False
 
+def sha256_file(path: Path, bufSize: int = 4 * 1024 * 1024, progress=None) -> str:
+    """Spočítá SHA256 souboru (hex).
+    progress: volitelný callback(done, total), může vyhodit výjimku pro přerušení
+    """
+    h = hashlib.sha256()
+    total = os.path.getsize(path)
+    done = 0
+    with Path(path).open("rb") as f:
+        # ověření velkého obrazu nemá vytlačit page cache ostatním
+        pagecache.advise_sequential(f)
+        drop = pagecache.c_drop_behind(f)
+        while True:
+            data = f.read(bufSize)
+            if not data:
+                break
+            h.update(data)
+            done += len(data)
+            drop(len(data))
+            if progress:
+                progress(done, total)
+        drop.close()
+    return h.hexdigest()
+
+def write_sha256_sidecar(path: Path, digest: str|None = None) -> Path:
+    """
+    Zapíše <soubor>.sha256 ve formátu sha256sum.
+    Pokud je zadán digest (např. spočítaný už při zápisu), soubor se znovu nečte.
+    """
+    path = Path(path)
+    if digest is None:
+        digest = sha256_file(path)
+    sidecar = path.with_suffix(path.suffix + ".sha256")
+    sidecar.write_text(f"{digest}  {path.name}\n", encoding="utf-8")
+    print(f"[SHA256] {sidecar.name}")
+    return sidecar
+
 def is_gzip(path: Path) -> bool:
     """Detekce gzip podle přípony."""
     return path.suffix == ".gz" or path.name.endswith(".img.gz")
 
+LOCK_DIR:str = "/run/lock"
+"""Adresář pro zámky zařízení (imgtool-<disk>.lock)."""
+
+@contextmanager
+def device_lock(disk:str, wait:bool=True):
+    """Exkluzivní zámek na disk (flock), aby dvě úlohy nikdy nepracovaly se stejným diskem.
+    Zámek je meziprocesový, platí i mezi více běžícími imgtool.
+    Args:
+        disk (str): název disku (sdb) nebo cesta (/dev/sdb)
+        wait (bool): True = čekat na uvolnění, False = hned vyhodit BlockingIOError
+    """
+    name = os.path.basename(str(disk))
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    fd = os.open(os.path.join(LOCK_DIR, f"imgtool-{name}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        yield
+    finally:
+        os.close(fd)
+
+def usb_bus_of(disk:str) -> str|None:
+    """Vrátí identifikaci USB sběrnice (např. 'usb2') pro disk, nebo None pokud disk není na USB."""
+    name = os.path.basename(str(disk))
+    try:
+        path = os.path.realpath(f"/sys/block/{name}")
+    except OSError:
+        return None
+    m = re.search(r"/(usb\d+)/", path)
+    return m.group(1) if m else None
+
+def disk_size(disk:str) -> int:
+    """Velikost disku v bajtech podle /sys/block/<disk>/size (sektory po 512 B)."""
+    name = os.path.basename(str(disk))
+    with open(f"/sys/block/{name}/size", encoding="utf-8") as f:
+        return int(f.read().strip()) * 512
+
+def partitions_of(disk:str) -> dict[int,str]:
+    """Vrátí {číslo partition: název zařízení} podle /sys/block, např. {1: 'mmcblk0p1'}."""
+    name = os.path.basename(str(disk))
+    parts = {}
+    for ent in os.listdir(f"/sys/block/{name}"):
+        pf = f"/sys/block/{name}/{ent}/partition"
+        if os.path.isfile(pf):
+            with open(pf, encoding="utf-8") as f:
+                parts[int(f.read().strip())] = ent
+    return dict(sorted(parts.items()))
+
+def disk_in_use(disk:str) -> list[str]:
+    """Vrátí seznam připojených/aktivních (mount, swap) zařízení na daném disku."""
+    name = os.path.basename(str(disk))
+    devs = {name, *partitions_of(name).values()}
+    used = []
+    for fn, col in (("/proc/mounts", 0), ("/proc/swaps", 0)):
+        try:
+            with open(fn, encoding="utf-8") as f:
+                for line in f:
+                    dev = line.split()[col] if line.strip() else ""
+                    if dev.startswith("/dev/") and os.path.basename(os.path.realpath(dev)) in devs:
+                        used.append(dev)
+        except OSError:
+            continue
+    return used
+
 def getNewDir(baseDir:str, prefix:str)-> str:
     """Vytvoří nový adresář s inkrementálním číslem v zadaném baseDir s daným prefixem.
     Např. prefix="smart-backup" → smart-backup-001, smart-backup-002, ...
@@ -0,0 +1,179 @@
+"""
+RAW kopie bez průchodu dat přes user space
+
+Místo `dd` (read + write přes buffer v procesu) se data kopírují v jádře:
+  1. copy_file_range – soubor ↔ soubor (na btrfs/XFS/NFS i reflink nebo server-side copy)
+  2. splice přes rouru se zvětšeným bufferem (F_SETPIPE_SZ) – blokové zařízení ↔ soubor
+  3. sendfile – obecný in-kernel přenos
+  4. readinto / write – poslední možnost
+
+Metoda se volí automaticky: pokud první volání skončí chybou "nepodporováno",
+zkusí se další. Kopíruje se po blocích, takže funguje token bucket (--bwlimit),
+průběh i přerušení přes progress callback.
+"""
+import errno
+import fcntl
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+from . import pagecache
+from . import throttle
+
+CHUNK: int = 8 * 1024 * 1024
+"""Kolik bajtů se přenese jedním voláním (a jedním consume token bucketu)."""
+
+PIPE_SIZE: int = 1024 * 1024
+"""Požadovaná velikost roury pro splice (omezeno /proc/sys/fs/pipe-max-size)."""
+
+_UNSUPPORTED = (errno.EINVAL, errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EBADF, errno.ENOTSUP)
+
+
+def _pipe_max() -> int:
+    try:
+        return int(Path("/proc/sys/fs/pipe-max-size").read_text().strip())
+    except (OSError, ValueError):
+        return PIPE_SIZE
+
+
+def _cfr(fi: int, fo: int, n: int) -> int:
+    return os.copy_file_range(fi, fo, n)
+
+
+def _sendfile(fi: int, fo: int, n: int) -> int:
+    return os.sendfile(fo, fi, None, n)
+
+
+class _splicer:
+    """splice src → roura → dst, roura se drží po celou dobu kopie."""
+
+    def __init__(self) -> None:
+        self.r, self.w = os.pipe()
+        self.size = 64 * 1024
+        if hasattr(fcntl, "F_SETPIPE_SZ"):
+            try:
+                self.size = fcntl.fcntl(self.w, fcntl.F_SETPIPE_SZ, min(PIPE_SIZE, _pipe_max()))
+            except OSError:
+                pass
+
+    def __call__(self, fi: int, fo: int, n: int) -> int:
+        got = os.splice(fi, self.w, min(n, self.size))
+        left = got
+        while left:
+            left -= os.splice(self.r, fo, left)
+        return got
+
+    def close(self) -> None:
+        os.close(self.r)
+        os.close(self.w)
+
+
+def _readwrite(buf: bytearray) -> Callable[[int, int, int], int]:
+    mv = memoryview(buf)
+
+    def rw(fi: int, fo: int, n: int) -> int:
+        got = os.readv(fi, [mv[:min(n, len(buf))]])
+        done = 0
+        while done < got:
+            done += os.write(fo, mv[done:got])
+        return got
+    return rw
+
+
+def print_progress(done: int, total: int | None, rate: float, method: str) -> None:
+    """Výchozí výpis průběhu na jeden řádek."""
+    pct = f"{done * 100 / total:5.1f}%" if total else "  ?  "
+    sys.stdout.write(f"\r[ZCOPY] {done / 1024 / 1024 / 1024:8.2f} GiB {pct}  {rate / 1024 / 1024:7.1f} MB/s  ({method}) ")
+    sys.stdout.flush()
+
+
+def copy_fd(fi: int, fo: int, total: int | None = None,
+            progress: Optional[Callable[[int, int | None, float, str], None]] = print_progress) -> dict:
+    """Zkopíruje vše od aktuální pozice fi na aktuální pozici fo.
+
+    Returns:
+        dict: {"bytes", "seconds", "method"}
+    """
+    sp = None
+    methods: list[tuple[str, Callable[[int, int, int], int]]] = [("copy_file_range", _cfr)]
+    if hasattr(os, "splice"):
+        try:
+            sp = _splicer()
+            methods.append(("splice", sp))
+        except OSError:
+            sp = None
+    methods.append(("sendfile", _sendfile))
+    methods.append(("read/write", _readwrite(bytearray(CHUNK))))
+
+    done = 0
+    t0 = time.monotonic()
+    lastPrint = 0.0
+    posIn = os.lseek(fi, 0, os.SEEK_CUR)
+    posOut = os.lseek(fo, 0, os.SEEK_CUR)
+    name, fn = methods.pop(0)
+    pagecache.advise_sequential(fi)
+    dropIn = pagecache.c_drop_behind(fi)
+    dropOut = pagecache.c_drop_behind(fo, write=True)
+    try:
+        while True:
+            throttle.consume(CHUNK)
+            try:
+                n = fn(fi, fo, CHUNK)
+            except OSError as e:
+                # nepodporováno se pozná hned na prvním bloku, později je to skutečná chyba
+                if done or e.errno not in _UNSUPPORTED or not methods:
+                    raise
+                # splice mohl už načíst do roury → vrátíme pozice na začátek
+                os.lseek(fi, posIn, os.SEEK_SET)
+                os.lseek(fo, posOut, os.SEEK_SET)
+                name, fn = methods.pop(0)
+                continue
+            if not n:
+                break
+            done += n
+            dropIn(n)
+            dropOut(n)
+            now = time.monotonic()
+            if progress and now - lastPrint >= 0.5:
+                lastPrint = now
+                progress(done, total, done / max(now - t0, 1e-9), name)
+    finally:
+        dropIn.close()
+        dropOut.close()
+        if sp is not None:
+            sp.close()
+    if progress:
+        progress(done, total, done / max(time.monotonic() - t0, 1e-9), name)
+        sys.stdout.write("\n")
+    return {"bytes": done, "seconds": time.monotonic() - t0, "method": name}
+
+
+def copy_file(src: str | Path, dst: str | Path,
+              progress: Optional[Callable[[int, int | None, float, str], None]] = print_progress) -> dict:
+    """Náhrada `dd if=src of=dst bs=4M` (soubor i blokové zařízení), končí fsync.
+
+    Blokové zařízení jako cíl se nezkracuje, běžný soubor se vytvoří / přepíše.
+
+    Returns:
+        dict: {"bytes", "seconds", "method"}
+    """
+    isFile = not Path(dst).exists() or Path(dst).is_file()
+    flags = os.O_WRONLY | (os.O_CREAT | os.O_TRUNC if isFile else 0)
+    fi = os.open(src, os.O_RDONLY)
+    try:
+        fo = os.open(dst, flags, 0o644)
+        try:
+            try:
+                total = os.lseek(fi, 0, os.SEEK_END)
+                os.lseek(fi, 0, os.SEEK_SET)
+            except OSError:
+                total = None
+            stats = copy_fd(fi, fo, total, progress)
+            os.fsync(fo)
+        finally:
+            os.close(fo)
+    finally:
+        os.close(fi)
+    return stats
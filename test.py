@@ -10,6 +10,8 @@ from libs.JBLibs.term import text_color, en_color,reset
 from libs.JBLibs import fs_smart_bkp as bkp
 from datetime import datetime
 from libs.JBLibs import fs_swap
+from libs import catalog
+from libs import reflink
 
 DISK_CFG:str="/etc/disk_util/settings.conf"
 
@@ -646,7 +648,7 @@ class m_disk_oper(c_menu):
         )        
         print(f"Zálohuji disk {self.diskName} typem zálohy: {popis}")
         if zkratka=="s":
-            return bkp.smart_backup(
+            x=bkp.smart_backup(
                 disk=self.diskName,
                 outdir=o_dir,
                 autoprefix=True,
@@ -655,7 +657,7 @@ class m_disk_oper(c_menu):
             )
             
         elif zkratka=="j":
-            return bkp.smart_backup(
+            x=bkp.smart_backup(
                 disk=self.diskName,
                 outdir=o_dir,
                 autoprefix=True,
@@ -664,7 +666,7 @@ class m_disk_oper(c_menu):
                 ddOnly=True
             )
         elif zkratka=="r":
-            return bkp.raw_backup(
+            x=bkp.raw_backup(
                 disk=self.diskName,
                 outdir=o_dir,
                 autoprefix=True,
@@ -674,15 +676,27 @@ class m_disk_oper(c_menu):
                     
         else:
             return onSelReturn(err="Zrušeno uživatelem.")
+        # nová záloha do katalogu – přeindexuje se jen adresář tohoto disku
+        try:
+            catalog.rebuild(o_dir)
+        except Exception as e:
+            print(f"[CATALOG] Aktualizace katalogu selhala: {e}")
+        return x
         
+    _bkpSets:set[str]|None=None
+    """Cesty záloh z katalogu pro rychlé označení v selectDir, None = kontrola manifest.json."""
+
     @staticmethod        
     def restore_disk_onShowMenuItem(itm:c_fs_itm,lText:str,rText:str) -> tuple[str,str]:
         """Funkce pro úpravu zobrazení položky v menu výběru zálohy disku.
         """
         p=Path(itm.path)
         # pokud obsahuje manifest tak jej lze vybrat, tak změníme rText
-        manifestFile=p / "manifest.json"
-        if manifestFile.is_file():
+        if m_disk_oper._bkpSets is not None:
+            isBkp=str(p.resolve()) in m_disk_oper._bkpSets
+        else:
+            isBkp=(p / "manifest.json").is_file()
+        if isBkp:
             rText=text_color("<BKP>", en_color.BRIGHT_GREEN)
         return (lText, rText)
     
@@ -698,6 +712,8 @@ class m_disk_oper(c_menu):
     def restore_disk(self,selItem:c_menu_item) -> None|onSelReturn:
         """Obnoví celý disk ze zálohy.
         """
+        # zálohy z katalogu, ať se nemusí u každého adresáře číst manifest
+        m_disk_oper._bkpSets=catalog.set_paths(disk_settings.BKP_DIR)
         # select adresář se zálohou
         bkpDir=selectDir(
             str(disk_settings.BKP_DIR),
@@ -779,6 +795,7 @@ class m_image_oper(c_menu):
         self.menu.append( c_menu_item("Připojit .img soubor jako loop device", "m", self.mount_image) )
         self.menu.append( c_menu_item("Ověřit sidecar soubor", "t", self.test_sidecar) )
         self.menu.append( c_menu_item("Vytvořit/opravit sidecar soubor", "c", self.create_sidecar) )
+        self.menu.append( c_menu_item("Kopie pro úpravy (reflink)", "k", self.copy_image) )
         
     def mount_image(self,selItem:c_menu_item) -> None|onSelReturn:
         """Mountne image soubor jako loop device
@@ -846,6 +863,25 @@ class m_image_oper(c_menu):
             ret.err=f"Chyba při vytváření/opravě sidecar souboru: {e}"
         return ret
 
+    def copy_image(self,selItem:c_menu_item) -> None|onSelReturn:
+        """Vytvoří kopii image pro úpravy, na btrfs/XFS okamžitě přes reflink.
+        """
+        ret = onSelReturn()
+        reset()
+        flnm=get_input(
+            "Zadejte název kopie, bez přípony",
+            minMessageWidth=self.minMenuWidth,
+        )
+        if not flnm:
+            return ret.errRet("Zrušeno uživatelem.")
+        dst=self.selectedImage.with_name(flnm).with_suffix(".img")
+        try:
+            how=reflink.copy_image(self.selectedImage, dst, forEdit=True)
+            ret.ok=f"Kopie vytvořena: {str(dst)} ({how})"
+        except Exception as e:
+            ret.err=f"Chyba při kopírování image: {e}"
+        return ret
+
 
 # ****************************************************
 # ******************* PARTITION MENU *****************